@@ -15,10 +15,12 @@ import secrets
 import urllib.parse
 
 from .handlers import get_upcoming_events, get_calendar_color, create_event_from_text, create_google_calendar_event, \
-    check_token_health
+    check_token_health, delete_credentials, event_to_record, event_from_record
 from .init_bot import bot, dp
 from app.settings import get_settings
 from .keyboards import get_postpone_time_options_keyboard, get_main_keyboard
+from .pending_store import get_pending_store
+from .preview import EventPreview
 
 CREDENTIALS_FILE = os.path.join(os.path.dirname(__file__), '../../credentials.json')
 USER_CREDENTIALS_DIR = "/service/user_credentials"
@@ -44,6 +46,15 @@ class EventCreation(StatesGroup):
     waiting_for_commit = State()
 
 
+def create_auth_flow(**kwargs):
+    """
+    Creates the OAuth flow; the callback recreates it with the stored ``code_verifier``.
+    """
+    return InstalledAppFlow.from_client_secrets_file(
+        CREDENTIALS_FILE, settings.scopes, redirect_uri=f"{settings.server_address}/callback", **kwargs
+    )
+
+
 
 @user_router.message(CommandStart())
 async def start_handler(message: Message):
@@ -67,17 +78,13 @@ async def auth_handler(message: Message, state: FSMContext):
     user_id = message.from_user.id
     
     # Удаляем старый токен, если он существует
-    token_path = os.path.join(USER_CREDENTIALS_DIR, f'token_{user_id}.json')
-    if os.path.exists(token_path):
-        try:
-            os.remove(token_path)
+    try:
+        if await delete_credentials(user_id):
             logger.info(f"Удален старый токен для пользователя {user_id}")
-        except Exception as e:
-            logger.warning(f"Не удалось удалить старый токен для пользователя {user_id}: {e}")
+    except Exception as e:
+        logger.warning(f"Не удалось удалить старый токен для пользователя {user_id}: {e}")
     
-    flow = InstalledAppFlow.from_client_secrets_file(
-        CREDENTIALS_FILE, settings.scopes, redirect_uri=f"{settings.server_address}/callback"
-    )
+    flow = create_auth_flow()
     auth_state = secrets.token_urlsafe(16)
     composite_state = f"{auth_state}|{user_id}"
     encoded_composite_state = urllib.parse.quote(composite_state)
@@ -91,7 +98,9 @@ async def auth_handler(message: Message, state: FSMContext):
     )
 
     await state.set_state(AuthState.waiting_for_auth_code)
-    await state.update_data(auth_state=auth_state, auth_flow=flow, user_id=user_id)
+    # Вместо объекта flow хранится только то, что нужно для его повторного создания в /callback
+    get_pending_store().set('oauth', user_id, {'state': auth_state, 'code_verifier': flow.code_verifier},
+                            settings.oauth_state_ttl)
 
     # Create an inline keyboard with a link to the authorization URL
     builder = InlineKeyboardBuilder()
@@ -161,17 +170,13 @@ async def reauthorize_handler(callback_query: types.CallbackQuery, state: FSMCon
     user_id = callback_query.from_user.id
     
     # Удаляем старый токен, если он существует
-    token_path = os.path.join(USER_CREDENTIALS_DIR, f'token_{user_id}.json')
-    if os.path.exists(token_path):
-        try:
-            os.remove(token_path)
+    try:
+        if await delete_credentials(user_id):
             logger.info(f"Удален старый токен для пользователя {user_id} при повторной авторизации")
-        except Exception as e:
-            logger.warning(f"Не удалось удалить старый токен для пользователя {user_id}: {e}")
+    except Exception as e:
+        logger.warning(f"Не удалось удалить старый токен для пользователя {user_id}: {e}")
     
-    flow = InstalledAppFlow.from_client_secrets_file(
-        CREDENTIALS_FILE, settings.scopes, redirect_uri=f"{settings.server_address}/callback"
-    )
+    flow = create_auth_flow()
     auth_state = secrets.token_urlsafe(16)
     composite_state = f"{auth_state}|{user_id}"
     encoded_composite_state = urllib.parse.quote(composite_state)
@@ -185,7 +190,9 @@ async def reauthorize_handler(callback_query: types.CallbackQuery, state: FSMCon
     )
 
     await state.set_state(AuthState.waiting_for_auth_code)
-    await state.update_data(auth_state=auth_state, auth_flow=flow, user_id=user_id)
+    # Вместо объекта flow хранится только то, что нужно для его повторного создания в /callback
+    get_pending_store().set('oauth', user_id, {'state': auth_state, 'code_verifier': flow.code_verifier},
+                            settings.oauth_state_ttl)
 
     # Create an inline keyboard with a link to the authorization URL
     builder = InlineKeyboardBuilder()
@@ -244,7 +251,6 @@ async def create_event_handler(message: types.Message, state: FSMContext): # Cor
     logger.info(f"Установлено состояние ожидания текста для пользователя {message.from_user.id}")
     # No callback_query.answer needed
 
-events_memory = {}
 @user_router.message(EventCreation.waiting_for_text)
 async def process_event_details(message: types.Message, state: FSMContext):
     """Processes the event details entered by the user."""
@@ -252,11 +258,21 @@ async def process_event_details(message: types.Message, state: FSMContext):
     user_id = str(message.from_user.id)  # Получаем ID пользователя
     user_text = message.text
 
+    # Заглушка отправляется, только если ответ задерживается, и обновляется по мере ответа LLM
+    preview = EventPreview(message)
     try:
+        if settings.llm_stream_preview:
+            preview.start()
+
         # Вызываем функцию для создания события из текста
-        result = await create_event_from_text(user_id, user_text)
+        result = await create_event_from_text(user_id, user_text,
+                                              on_partial=preview.on_partial if settings.llm_stream_preview else None)
         logger.info(f"Событие обработано для пользователя {user_id}")
 
+        if isinstance(result, str):
+            await preview.finish(result)
+            return
+
         # Create inline keyboard for confirmation
         keyboard = InlineKeyboardMarkup(inline_keyboard=[
             [InlineKeyboardButton(text="Подтвердить", callback_data="confirm_event")],
@@ -264,14 +280,14 @@ async def process_event_details(message: types.Message, state: FSMContext):
         ])
 
         # Отправляем пользователю предварительный просмотр события с кнопками
-        await message.answer(
+        await preview.finish(
             f"Предварительный просмотр события:\n{result.calendar_name} "
             f"\n{result.event_summary}\n{result.date}\n{result.start_time}\n{result.end_time}",
             reply_markup=keyboard
         )
         logger.info(f"Отправлен предварительный просмотр события пользователю {user_id}")
 
-        events_memory[user_id] = result
+        get_pending_store().set('event', user_id, event_to_record(result), settings.pending_event_ttl)
 
         await state.set_state(EventCreation.waiting_for_commit)
         logger.info(f"Установлено состояние ожидания подтверждения для пользователя {user_id}")
@@ -282,7 +298,7 @@ async def process_event_details(message: types.Message, state: FSMContext):
 
     except Exception as e:
         logger.exception("An error occurred while processing event details")
-        await message.reply("Извините, произошла ошибка. Пожалуйста, попробуйте снова.")
+        await preview.finish("Извините, произошла ошибка. Пожалуйста, попробуйте снова.")
 
     finally:
         # Сбрасываем состояние
@@ -295,7 +311,8 @@ async def confirm_event_handler(callback_query: types.CallbackQuery, state: FSMC
     logger.info(f"Получено подтверждение события от пользователя {callback_query.from_user.id}")
 
     user_id = str(callback_query.from_user.id)
-    event = events_memory.get(user_id)
+    record = get_pending_store().pop('event', user_id)
+    event = event_from_record(record) if record is not None else None
     print(event)
     if event is None:
         logger.error(f"Данные события не найдены для пользователя {user_id}")
@@ -327,6 +344,7 @@ async def confirm_event_handler(callback_query: types.CallbackQuery, state: FSMC
 async def reject_event_handler(callback_query: types.CallbackQuery, state: FSMContext):
     """Rejects the event and resets the state."""
     logger.info(f"Получен отказ от события от пользователя {callback_query.from_user.id}")
+    get_pending_store().pop('event', callback_query.from_user.id)
     await callback_query.message.edit_reply_markup(reply_markup=None)  # Remove the keyboard
     await callback_query.message.answer("Событие отклонено.")
 
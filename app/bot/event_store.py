@@ -0,0 +1,301 @@
+import datetime
+import logging
+import os
+import sqlite3
+import threading
+import uuid
+from functools import lru_cache
+
+import pytz
+
+from app.settings import get_settings
+
+logger = logging.getLogger(__name__)
+
+settings = get_settings()
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS sync_state (
+    user_id TEXT NOT NULL,
+    calendar_id TEXT NOT NULL,
+    sync_token TEXT,
+    synced_at TEXT,
+    PRIMARY KEY (user_id, calendar_id)
+);
+CREATE TABLE IF NOT EXISTS events (
+    user_id TEXT NOT NULL,
+    calendar_id TEXT NOT NULL,
+    event_id TEXT NOT NULL,
+    summary TEXT NOT NULL,
+    start_utc TEXT NOT NULL,
+    PRIMARY KEY (user_id, calendar_id, event_id)
+);
+CREATE INDEX IF NOT EXISTS events_by_start ON events (user_id, calendar_id, start_utc);
+CREATE TABLE IF NOT EXISTS push_channels (
+    channel_id TEXT PRIMARY KEY,
+    user_id TEXT NOT NULL,
+    calendar_id TEXT NOT NULL,
+    resource_id TEXT NOT NULL,
+    token TEXT NOT NULL,
+    expiration REAL NOT NULL,
+    dirty INTEGER NOT NULL DEFAULT 0
+);
+CREATE INDEX IF NOT EXISTS push_channels_by_calendar ON push_channels (user_id, calendar_id);
+CREATE INDEX IF NOT EXISTS push_channels_by_expiration ON push_channels (expiration);
+CREATE TABLE IF NOT EXISTS sent_reminders (
+    user_id TEXT NOT NULL,
+    calendar_id TEXT NOT NULL,
+    event_id TEXT NOT NULL,
+    start_at REAL NOT NULL,
+    offset_minutes INTEGER NOT NULL,
+    claimed_at REAL NOT NULL DEFAULT 0,
+    claimed_by TEXT,
+    sent_at REAL,
+    PRIMARY KEY (user_id, calendar_id, event_id, start_at, offset_minutes)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS sent_reminders_by_start ON sent_reminders (start_at);
+"""
+
+# Отметка процесса в записях о напоминаниях: незавершенную отправку другого процесса можно повторить
+PROCESS_ID = uuid.uuid4().hex
+
+# Формат, в котором время хранится в базе: строки в UTC сортируются так же, как время
+TIME_FORMAT = '%Y-%m-%dT%H:%M:%S'
+
+
+def to_utc(value: str) -> datetime.datetime:
+    """
+    Parses a Google Calendar dateTime/date string into an aware UTC datetime.
+    """
+    start_datetime = datetime.datetime.fromisoformat(value.replace('Z', '+00:00'))
+    if start_datetime.tzinfo is None:
+        return start_datetime.replace(tzinfo=pytz.utc)
+    return start_datetime.astimezone(pytz.utc)
+
+
+def format_utc(value: datetime.datetime) -> str:
+    return value.astimezone(pytz.utc).strftime(TIME_FORMAT)
+
+
+class EventStore:
+    """
+    Local SQLite copy of users' upcoming events, filled by Calendar API incremental sync.
+    """
+
+    def __init__(self, path: str):
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._lock = threading.Lock()
+        self._connection = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._connection.execute("PRAGMA journal_mode=WAL")
+        self._connection.execute("PRAGMA synchronous=NORMAL")
+        self._connection.executescript(SCHEMA)
+
+    def get_sync_token(self, user_id, calendar_id):
+        with self._lock:
+            row = self._connection.execute(
+                "SELECT sync_token FROM sync_state WHERE user_id = ? AND calendar_id = ?",
+                (str(user_id), calendar_id)
+            ).fetchone()
+        return row[0] if row else None
+
+    def reset_calendar(self, user_id, calendar_id):
+        """
+        Forgets the sync token and events of a calendar so the next sync is a full one.
+        """
+        with self._lock, self._connection:
+            self._connection.execute("BEGIN")
+            self._connection.execute("DELETE FROM sync_state WHERE user_id = ? AND calendar_id = ?",
+                                     (str(user_id), calendar_id))
+            self._connection.execute("DELETE FROM events WHERE user_id = ? AND calendar_id = ?",
+                                     (str(user_id), calendar_id))
+
+    def apply_changes(self, user_id, calendar_id, events, sync_token, full_sync=False):
+        """
+        Applies one sync result atomically: upserts changed events, removes cancelled ones
+        and stores the next sync token.
+        """
+        user_id = str(user_id)
+        prune_before = format_utc(datetime.datetime.now(pytz.utc) - datetime.timedelta(days=1))
+        with self._lock, self._connection:
+            self._connection.execute("BEGIN")
+            if full_sync:
+                self._connection.execute("DELETE FROM events WHERE user_id = ? AND calendar_id = ?",
+                                         (user_id, calendar_id))
+            for event in events:
+                start = event.get('start', {})
+                start = start.get('dateTime', start.get('date'))
+                if event.get('status') == 'cancelled' or not start:
+                    self._connection.execute(
+                        "DELETE FROM events WHERE user_id = ? AND calendar_id = ? AND event_id = ?",
+                        (user_id, calendar_id, event['id'])
+                    )
+                    continue
+                self._connection.execute(
+                    "INSERT OR REPLACE INTO events (user_id, calendar_id, event_id, summary, start_utc) "
+                    "VALUES (?, ?, ?, ?, ?)",
+                    (user_id, calendar_id, event['id'], event.get('summary', ''), format_utc(to_utc(start)))
+                )
+            # Прошедшие события больше не нужны ни для /events, ни для напоминаний
+            self._connection.execute(
+                "DELETE FROM events WHERE user_id = ? AND calendar_id = ? AND start_utc < ?",
+                (user_id, calendar_id, prune_before)
+            )
+            self._connection.execute(
+                "INSERT OR REPLACE INTO sync_state (user_id, calendar_id, sync_token, synced_at) "
+                "VALUES (?, ?, ?, ?)",
+                (user_id, calendar_id, sync_token, format_utc(datetime.datetime.now(pytz.utc)))
+            )
+
+    def upcoming_events(self, user_id, calendar_id, since: datetime.datetime, limit: int):
+        """
+        Returns ``(event_id, summary, start_utc)`` tuples of a calendar starting at or after ``since``.
+        """
+        with self._lock:
+            rows = self._connection.execute(
+                "SELECT event_id, summary, start_utc FROM events "
+                "WHERE user_id = ? AND calendar_id = ? AND start_utc >= ? "
+                "ORDER BY start_utc LIMIT ?",
+                (str(user_id), calendar_id, format_utc(since), limit)
+            ).fetchall()
+        return [
+            (event_id, summary, pytz.utc.localize(datetime.datetime.strptime(start_utc, TIME_FORMAT)))
+            for event_id, summary, start_utc in rows
+        ]
+
+    def clear_user(self, user_id):
+        with self._lock, self._connection:
+            self._connection.execute("BEGIN")
+            self._connection.execute("DELETE FROM sync_state WHERE user_id = ?", (str(user_id),))
+            self._connection.execute("DELETE FROM events WHERE user_id = ?", (str(user_id),))
+            self._connection.execute("DELETE FROM push_channels WHERE user_id = ?", (str(user_id),))
+
+    def add_channel(self, channel_id, user_id, calendar_id, resource_id, token, expiration):
+        # Новый канал помечается измененным: изменения до его создания нужно забрать синхронизацией
+        with self._lock:
+            self._connection.execute(
+                "INSERT OR REPLACE INTO push_channels "
+                "(channel_id, user_id, calendar_id, resource_id, token, expiration, dirty) "
+                "VALUES (?, ?, ?, ?, ?, ?, 1)",
+                (channel_id, str(user_id), calendar_id, resource_id, token, expiration)
+            )
+
+    def get_channel(self, channel_id):
+        """
+        Returns ``(user_id, calendar_id, resource_id, token, expiration)`` of a channel or None.
+        """
+        with self._lock:
+            return self._connection.execute(
+                "SELECT user_id, calendar_id, resource_id, token, expiration FROM push_channels "
+                "WHERE channel_id = ?",
+                (channel_id,)
+            ).fetchone()
+
+    def delete_channel(self, channel_id):
+        with self._lock:
+            self._connection.execute("DELETE FROM push_channels WHERE channel_id = ?", (channel_id,))
+
+    def user_channels(self, user_id):
+        """
+        Returns ``(channel_id, calendar_id, resource_id, expiration)`` of all channels of a user.
+        """
+        with self._lock:
+            return self._connection.execute(
+                "SELECT channel_id, calendar_id, resource_id, expiration FROM push_channels WHERE user_id = ?",
+                (str(user_id),)
+            ).fetchall()
+
+    def channels_expiring(self, before: float):
+        """
+        Returns ``(channel_id, user_id, calendar_id, resource_id)`` of channels expiring before ``before``.
+        """
+        with self._lock:
+            return self._connection.execute(
+                "SELECT channel_id, user_id, calendar_id, resource_id FROM push_channels WHERE expiration < ?",
+                (before,)
+            ).fetchall()
+
+    def calendars_needing_sync(self, user_id, calendar_ids, now: float):
+        """
+        Returns the calendars that have no live push channel or got a change notification,
+        and clears their change flag.
+        """
+        with self._lock, self._connection:
+            self._connection.execute("BEGIN IMMEDIATE")
+            clean = {
+                calendar_id for calendar_id, in self._connection.execute(
+                    "SELECT calendar_id FROM push_channels WHERE user_id = ? AND dirty = 0 AND expiration > ?",
+                    (str(user_id), now)
+                )
+            }
+            needing_sync = [calendar_id for calendar_id in calendar_ids if calendar_id not in clean]
+            self._connection.executemany(
+                "UPDATE push_channels SET dirty = 0 WHERE user_id = ? AND calendar_id = ?",
+                [(str(user_id), calendar_id) for calendar_id in needing_sync]
+            )
+        return needing_sync
+
+    def mark_dirty(self, user_id, calendar_id):
+        with self._lock:
+            self._connection.execute(
+                "UPDATE push_channels SET dirty = 1 WHERE user_id = ? AND calendar_id = ?",
+                (str(user_id), calendar_id)
+            )
+
+
+    def claim_reminder(self, user_id, calendar_id, event_id, start_at, offset_minutes, now: float,
+                       stale_after: float):
+        """
+        Records a reminder in the sent-reminder ledger before it is sent.
+
+        Returns False if the same reminder (same event start and offset) was already sent or is
+        being sent, so it must not be sent again. A claim that was never marked sent is taken over
+        when it was made by another process (which died mid-send: reminders are sent by one
+        process at a time) or more than ``stale_after`` seconds ago.
+        """
+        with self._lock:
+            cursor = self._connection.execute(
+                "INSERT INTO sent_reminders "
+                "(user_id, calendar_id, event_id, start_at, offset_minutes, claimed_at, claimed_by) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?) "
+                "ON CONFLICT (user_id, calendar_id, event_id, start_at, offset_minutes) "
+                "DO UPDATE SET claimed_at = excluded.claimed_at, claimed_by = excluded.claimed_by "
+                "WHERE sent_reminders.sent_at IS NULL "
+                "AND (sent_reminders.claimed_by IS NOT excluded.claimed_by OR sent_reminders.claimed_at < ?)",
+                (str(user_id), calendar_id, event_id, start_at, offset_minutes, now, PROCESS_ID,
+                 now - stale_after)
+            )
+        return cursor.rowcount == 1
+
+    def mark_reminder_sent(self, user_id, calendar_id, event_id, start_at, offset_minutes, now: float):
+        with self._lock:
+            self._connection.execute(
+                "UPDATE sent_reminders SET sent_at = ? WHERE user_id = ? AND calendar_id = ? AND event_id = ? "
+                "AND start_at = ? AND offset_minutes = ?",
+                (now, str(user_id), calendar_id, event_id, start_at, offset_minutes)
+            )
+
+    def release_reminder(self, user_id, calendar_id, event_id, start_at, offset_minutes):
+        """
+        Removes a ledger entry of a reminder that failed to send so it can be retried.
+        """
+        with self._lock:
+            self._connection.execute(
+                "DELETE FROM sent_reminders WHERE user_id = ? AND calendar_id = ? AND event_id = ? "
+                "AND start_at = ? AND offset_minutes = ?",
+                (str(user_id), calendar_id, event_id, start_at, offset_minutes)
+            )
+
+    def compact_reminders(self, now: float) -> int:
+        """
+        Drops ledger entries of events that have already started and returns the ledger size.
+        """
+        with self._lock:
+            self._connection.execute("DELETE FROM sent_reminders WHERE start_at < ?", (now,))
+            return self._connection.execute("SELECT COUNT(*) FROM sent_reminders").fetchone()[0]
+
+
+@lru_cache()
+def get_event_store() -> EventStore:
+    return EventStore(settings.event_store_path)
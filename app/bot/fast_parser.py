@@ -0,0 +1,247 @@
+import datetime
+import re
+from typing import Optional
+
+MONTHS = {
+    'января': 1, 'февраля': 2, 'марта': 3, 'апреля': 4, 'мая': 5, 'июня': 6,
+    'июля': 7, 'августа': 8, 'сентября': 9, 'октября': 10, 'ноября': 11, 'декабря': 12,
+}
+
+WEEKDAYS = {
+    'понедельник': 0, 'вторник': 1, 'среда': 2, 'среду': 2, 'четверг': 3,
+    'пятница': 4, 'пятницу': 4, 'суббота': 5, 'субботу': 5, 'воскресенье': 6,
+}
+
+RELATIVE_DAYS = {'сегодня': 0, 'завтра': 1, 'послезавтра': 2}
+
+DAY_PARTS = r'(?:\s*(?P<{name}>утра|дня|вечера|ночи))?'
+
+# Слова, при которых разбор неоднозначен или требует понимания контекста: такие тексты разбирает LLM
+AMBIGUOUS_RE = re.compile(
+    r'\b(?:следующ\w*|прошл\w*|кажд\w*|ежедневн\w*|утром|вечером|днем|ночью|вчера|позавчера|'
+    r'недел\w*|месяц\w*|выходн\w*|будн\w*|или|либо|примерно|около)\b',
+    re.IGNORECASE
+)
+
+RELATIVE_RE = re.compile(
+    r'\bчерез\s+(?:(?P<half>полчаса)|(?P<one_and_half>полтора\s+часа)|(?P<hour>час)|'
+    r'(?P<value>\d{1,3})\s*(?P<unit>час(?:а|ов)?|минут[уы]?|мин|дн(?:я|ей)|день))\b',
+    re.IGNORECASE
+)
+DAY_WORD_RE = re.compile(r'\b(?P<word>сегодня|послезавтра|завтра)\b', re.IGNORECASE)
+WEEKDAY_RE = re.compile(
+    r'\b(?:(?:в|во)\s+)?(?P<weekday>понедельник|вторник|среду|среда|четверг|пятницу|пятница|субботу|суббота|'
+    r'воскресенье)\b',
+    re.IGNORECASE
+)
+MONTH_DATE_RE = re.compile(
+    r'\b(?P<day>\d{1,2})\s+(?P<month>' + '|'.join(MONTHS) + r')(?:\s+(?P<year>\d{4})(?:\s*г(?:ода|\.)?)?)?\b',
+    re.IGNORECASE
+)
+NUMERIC_DATE_RE = re.compile(
+    r'(?<![\w.:])(?<!\bв\s)(?P<day>\d{1,2})\.(?P<month>\d{1,2})(?:\.(?P<year>\d{2}|\d{4}))?(?![\w.:])',
+    re.IGNORECASE
+)
+RANGE_RE = re.compile(
+    r'(?:\b(?:с|со|в)\s+)?(?<![\w.:])(?P<start_h>\d{1,2})(?:[:.](?P<start_m>\d{2}))?' + DAY_PARTS.format(name='start_part')
+    + r'\s*(?:-|–|—|\bдо\b)\s*(?P<end_h>\d{1,2})(?:[:.](?P<end_m>\d{2}))?' + DAY_PARTS.format(name='end_part')
+    + r'(?![\w:.])(?!\s*(?:час|мин|дн|' + '|'.join(MONTHS) + r'))',
+    re.IGNORECASE
+)
+AT_TIME_RE = re.compile(
+    r'\b(?:в|к)\s+(?P<h>\d{1,2})(?:[:.](?P<m>\d{2}))?(?:\s*час(?:а|ов)?)?' + DAY_PARTS.format(name='part')
+    + r'(?![\w:.])(?!\s*(?:мин|дн|' + '|'.join(MONTHS) + r'))',
+    re.IGNORECASE
+)
+COLON_TIME_RE = re.compile(r'(?<![\w:.])(?P<h>\d{1,2}):(?P<m>\d{2})(?![\w:.])' + DAY_PARTS.format(name='part'),
+                           re.IGNORECASE)
+DURATION_RE = re.compile(
+    r'\bна\s+(?:(?P<half>полчаса)|(?P<one_and_half>полтора\s+часа)|(?P<hour>час)|'
+    r'(?P<value>\d{1,3})\s*(?P<unit>час(?:а|ов)?|минут[уы]?|мин))\b',
+    re.IGNORECASE
+)
+# Предлоги и союзы, оставшиеся по краям названия после удаления даты и времени
+DANGLING_WORDS_RE = re.compile(r'^(?:(?:в|во|с|со|до|на|к|и)\s+)+|(?:\s+(?:в|во|с|со|до|на|к|и))+$', re.IGNORECASE)
+
+
+def _to_hour(hour: int, part: Optional[str]) -> Optional[int]:
+    part = (part or '').lower()
+    if part == 'утра':
+        hour = 0 if hour == 12 else hour
+    elif part in ('дня', 'вечера'):
+        hour = hour + 12 if hour < 12 else hour
+    elif part == 'ночи':
+        hour = 0 if hour == 12 else hour
+    return hour if 0 <= hour <= 23 else None
+
+
+class _ParseState:
+    def __init__(self, now: datetime.datetime):
+        self.now = now
+        self.date = None
+        self.start = None
+        self.end = None
+        self.duration = None
+        self.ambiguous = False
+
+    def set_date(self, date):
+        if self.date is not None and self.date != date:
+            self.ambiguous = True
+        self.date = date
+
+    def set_time(self, hour, minute, part, explicit_minutes):
+        hour = _to_hour(hour, part)
+        if hour is None or minute > 59:
+            self.ambiguous = True
+            return None
+        # "в 3" без уточнения может быть и 3:00, и 15:00
+        if not part and not explicit_minutes and 1 <= hour <= 6:
+            self.ambiguous = True
+        return datetime.time(hour, minute)
+
+
+def _minutes(match) -> int:
+    if match.group('half'):
+        return 30
+    if match.group('one_and_half'):
+        return 90
+    if match.group('hour'):
+        return 60
+    value = int(match.group('value'))
+    unit = match.group('unit').lower()
+    if unit.startswith('час'):
+        return value * 60
+    if unit.startswith('дн') or unit == 'день':
+        return value * 24 * 60
+    return value
+
+
+def parse_event_text(text: str, now: datetime.datetime) -> Optional[dict]:
+    """
+    Rule-based parser for common Russian phrasing like "завтра в 15:00 созвон",
+    "в пятницу 10-11 встреча" or "через 2 часа спортзал".
+
+    ``now`` is the current time in the user's timezone. Returns the same fields the LLM
+    extraction returns (date, start/end time as strings) when the text is understood
+    unambiguously, otherwise None so the caller falls back to the LLM.
+    """
+    text = text.replace('ё', 'е').replace('Ё', 'Е').strip()
+    if not text or AMBIGUOUS_RE.search(text):
+        return None
+
+    state = _ParseState(now)
+    today = now.date()
+
+    def relative(match):
+        minutes = _minutes(match)
+        unit = (match.group('unit') or '').lower()
+        if unit.startswith('дн') or unit == 'день':
+            state.set_date(today + datetime.timedelta(days=minutes // (24 * 60)))
+        else:
+            if state.start is not None:
+                state.ambiguous = True
+            start = now + datetime.timedelta(minutes=minutes)
+            state.set_date(start.date())
+            state.start = start.time().replace(second=0, microsecond=0)
+        return ' '
+
+    def day_word(match):
+        state.set_date(today + datetime.timedelta(days=RELATIVE_DAYS[match.group('word').lower()]))
+        return ' '
+
+    def weekday(match):
+        target = WEEKDAYS[match.group('weekday').lower()]
+        days_ahead = (target - today.weekday()) % 7
+        state.set_date(today + datetime.timedelta(days=days_ahead))
+        return ' '
+
+    def calendar_date(match, month):
+        day = int(match.group('day'))
+        year = match.group('year')
+        try:
+            if year:
+                year = int(year)
+                date = datetime.date(year + 2000 if year < 100 else year, month, day)
+            else:
+                date = datetime.date(today.year, month, day)
+                # Даты из прошлого не используются: без года это дата в следующем году
+                if date < today:
+                    date = date.replace(year=today.year + 1)
+        except ValueError:
+            state.ambiguous = True
+            return match.group(0)
+        state.set_date(date)
+        return ' '
+
+    def time_range(match):
+        start = state.set_time(int(match.group('start_h')), int(match.group('start_m') or 0),
+                               match.group('start_part') or match.group('end_part'),
+                               match.group('start_m') is not None)
+        end = state.set_time(int(match.group('end_h')), int(match.group('end_m') or 0),
+                             match.group('end_part') or match.group('start_part'),
+                             match.group('end_m') is not None)
+        if start is None or end is None or end <= start or state.start is not None:
+            state.ambiguous = True
+            return match.group(0)
+        state.start, state.end = start, end
+        return ' '
+
+    def single_time(match):
+        time = state.set_time(int(match.group('h')), int(match.group('m') or 0), match.group('part'),
+                              match.group('m') is not None)
+        if time is None or state.start is not None:
+            state.ambiguous = True
+            return match.group(0)
+        state.start = time
+        return ' '
+
+    def duration(match):
+        if state.duration is not None:
+            state.ambiguous = True
+        state.duration = datetime.timedelta(minutes=_minutes(match))
+        return ' '
+
+    text = RELATIVE_RE.sub(relative, text)
+    text = DAY_WORD_RE.sub(day_word, text)
+    text = WEEKDAY_RE.sub(weekday, text)
+    text = MONTH_DATE_RE.sub(lambda match: calendar_date(match, MONTHS[match.group('month').lower()]), text)
+    text = NUMERIC_DATE_RE.sub(
+        lambda match: calendar_date(match, int(match.group('month'))) if 1 <= int(match.group('month')) <= 12
+        else match.group(0),
+        text
+    )
+    text = DURATION_RE.sub(duration, text)
+    text = RANGE_RE.sub(time_range, text)
+    text = AT_TIME_RE.sub(single_time, text)
+    text = COLON_TIME_RE.sub(single_time, text)
+
+    if state.ambiguous or state.start is None:
+        return None
+
+    date = state.date or today
+    start = datetime.datetime.combine(date, state.start)
+    # Время без даты, которое уже прошло сегодня, неоднозначно
+    if start < now.replace(tzinfo=None, second=0, microsecond=0):
+        return None
+    if state.end is not None and state.duration is not None:
+        return None
+    end = state.end
+    if end is None and state.duration is not None:
+        end_datetime = start + state.duration
+        if end_datetime.date() != date:
+            return None
+        end = end_datetime.time()
+
+    summary = ' '.join(text.split()).strip(' ,.;:-–—')
+    summary = DANGLING_WORDS_RE.sub('', summary).strip(' ,.;:-–—')
+    # Оставшиеся цифры означают, что часть текста не разобрана
+    if not summary or any(char.isdigit() for char in summary):
+        return None
+
+    return {
+        'event_summary': summary[0].upper() + summary[1:],
+        'event_description': '',
+        'date': date.strftime('%Y-%m-%d'),
+        'start_time': state.start.strftime('%H:%M'),
+        'end_time': end.strftime('%H:%M') if end is not None else 'NONE',
+    }
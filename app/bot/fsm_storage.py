@@ -0,0 +1,66 @@
+import json
+import os
+import sqlite3
+import threading
+from typing import Any, Dict, Optional
+
+from aiogram.fsm.state import State
+from aiogram.fsm.storage.base import BaseStorage, DefaultKeyBuilder, StateType, StorageKey
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS fsm (
+    key TEXT PRIMARY KEY,
+    state TEXT,
+    data TEXT NOT NULL DEFAULT '{}'
+) WITHOUT ROWID;
+"""
+
+
+class SQLiteStorage(BaseStorage):
+    """
+    FSM storage in a SQLite file shared by all worker processes, so any worker can continue
+    a conversation started in another one.
+    """
+
+    def __init__(self, path: str):
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._key_builder = DefaultKeyBuilder(with_destiny=True)
+        self._lock = threading.Lock()
+        self._connection = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._connection.execute("PRAGMA journal_mode=WAL")
+        self._connection.execute("PRAGMA synchronous=NORMAL")
+        self._connection.executescript(SCHEMA)
+
+    def _key(self, key: StorageKey) -> str:
+        return self._key_builder.build(key)
+
+    async def set_state(self, key: StorageKey, state: StateType = None) -> None:
+        state = state.state if isinstance(state, State) else state
+        with self._lock:
+            self._connection.execute(
+                "INSERT INTO fsm (key, state) VALUES (?, ?) ON CONFLICT (key) DO UPDATE SET state = excluded.state",
+                (self._key(key), state)
+            )
+
+    async def get_state(self, key: StorageKey) -> Optional[str]:
+        with self._lock:
+            row = self._connection.execute("SELECT state FROM fsm WHERE key = ?", (self._key(key),)).fetchone()
+        return row[0] if row else None
+
+    async def set_data(self, key: StorageKey, data: Dict[str, Any]) -> None:
+        with self._lock:
+            self._connection.execute(
+                "INSERT INTO fsm (key, data) VALUES (?, ?) ON CONFLICT (key) DO UPDATE SET data = excluded.data",
+                (self._key(key), json.dumps(data))
+            )
+
+    async def get_data(self, key: StorageKey) -> Dict[str, Any]:
+        with self._lock:
+            row = self._connection.execute("SELECT data FROM fsm WHERE key = ?", (self._key(key),)).fetchone()
+        return json.loads(row[0]) if row else {}
+
+    async def close(self) -> None:
+        with self._lock:
+            self._connection.close()
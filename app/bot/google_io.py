@@ -0,0 +1,171 @@
+import asyncio
+import functools
+import json
+import logging
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Optional
+
+from app.bot.metrics import metrics
+from app.settings import get_settings
+
+logger = logging.getLogger(__name__)
+
+try:
+    from google_auth_httplib2 import AuthorizedHttp
+    from googleapiclient.http import build_http
+except ImportError as e:
+    logger.error(f"Ошибка импорта httplib2: {e}")
+    AuthorizedHttp = None
+    build_http = None
+
+settings = get_settings()
+
+# Максимальное число запросов в одном batch-запросе Calendar API
+GOOGLE_BATCH_LIMIT = 50
+RETRYABLE_STATUSES = (429, 500, 502, 503, 504)
+# 403 повторяется только при превышении частоты запросов: остальные 403 (квота, права доступа) не пройдут и повторно
+RATE_LIMIT_REASONS = ('rateLimitExceeded', 'userRateLimitExceeded')
+
+_executor = None
+_thread_local = threading.local()
+
+
+def get_executor() -> ThreadPoolExecutor:
+    """
+    Returns the dedicated executor used for all blocking Google I/O.
+    """
+    global _executor
+    if _executor is None:
+        _executor = ThreadPoolExecutor(max_workers=max(1, settings.google_io_workers),
+                                       thread_name_prefix="google-io")
+    return _executor
+
+
+def shutdown_executor():
+    global _executor
+    if _executor is not None:
+        _executor.shutdown(wait=False, cancel_futures=True)
+        _executor = None
+
+
+async def run_google(func, *args, **kwargs):
+    """
+    Runs a blocking googleapiclient/google-auth call in the Google I/O executor.
+    """
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(get_executor(), functools.partial(func, *args, **kwargs))
+
+
+def _thread_http():
+    # httplib2.Http не потокобезопасен, поэтому у каждого потока пула свое соединение.
+    # build_http задает таймаут сокета (60 с), иначе зависшее соединение навсегда занимает поток пула
+    http = getattr(_thread_local, "http", None)
+    if http is None:
+        http = build_http()
+        _thread_local.http = http
+    return http
+
+
+def _execute_request(request, credentials=None):
+    if credentials is None:
+        credentials = getattr(getattr(request, "http", None), "credentials", None)
+    started = time.monotonic()
+    try:
+        if credentials is not None and AuthorizedHttp is not None:
+            return request.execute(http=AuthorizedHttp(credentials, http=_thread_http()))
+        return request.execute()
+    finally:
+        metrics.observe("google.request_latency", time.monotonic() - started)
+
+
+async def execute(request):
+    """
+    Awaitable replacement for ``request.execute()`` on googleapiclient requests.
+    """
+    return await run_google(_execute_request, request)
+
+
+def error_status(error):
+    return getattr(getattr(error, "resp", None), "status", None)
+
+
+def error_reason(error) -> Optional[str]:
+    """
+    Returns the ``reason`` of a Google API error (e.g. ``rateLimitExceeded``), if the body has one.
+    """
+    try:
+        data = json.loads(getattr(error, "content", None) or b"")
+    except (TypeError, ValueError):
+        return None
+    details = data.get("error") if isinstance(data, dict) else None
+    if not isinstance(details, dict):
+        return None
+    for item in (details.get("errors") or []) + (details.get("details") or []):
+        if isinstance(item, dict) and item.get("reason"):
+            return item["reason"]
+    return None
+
+
+def is_rate_limit_error(error) -> bool:
+    """
+    Tells whether a 403 means the request rate was exceeded (and may succeed when retried).
+    """
+    return error_status(error) == 403 and error_reason(error) in RATE_LIMIT_REASONS
+
+
+def is_retryable_error(error) -> bool:
+    status = error_status(error)
+    return status is None or status in RETRYABLE_STATUSES or is_rate_limit_error(error)
+
+
+def _execute_batch_chunk(service, chunk):
+    results = {}
+    keys = [key for key, _ in chunk]
+
+    def callback(request_id, response, exception):
+        results[keys[int(request_id)]] = exception if exception is not None else response
+
+    batch = service.new_batch_http_request(callback=callback)
+    for index, (_, request) in enumerate(chunk):
+        batch.add(request, request_id=str(index))
+
+    credentials = getattr(getattr(chunk[0][1], "http", None), "credentials", None)
+    try:
+        _execute_request(batch, credentials)
+        error = RuntimeError("Ответ на часть batch-запроса не получен")
+    except Exception as e:
+        # Ошибка транспорта относится ко всем частям батча, которые не успели получить ответ
+        error = e
+    for key in keys:
+        results.setdefault(key, error)
+    return results
+
+
+async def execute_batch(service, requests: dict) -> dict:
+    """
+    Executes many requests of one service as HTTP batch requests.
+
+    Requests are split into batches of at most ``GOOGLE_BATCH_LIMIT`` parts. Every sub-response is
+    mapped back to its key; parts that failed with a retryable status are retried on their own.
+    Returns ``{key: response_or_exception}``.
+    """
+    results = {}
+    pending = list(requests.items())
+    retries = max(0, settings.google_batch_retries)
+    for attempt in range(retries + 1):
+        chunks = [pending[i:i + GOOGLE_BATCH_LIMIT] for i in range(0, len(pending), GOOGLE_BATCH_LIMIT)]
+        metrics.inc("google.batches", len(chunks))
+        for chunk_results in await asyncio.gather(*(run_google(_execute_batch_chunk, service, chunk)
+                                                    for chunk in chunks)):
+            results.update(chunk_results)
+
+        pending = [(key, request) for key, request in pending
+                   if isinstance(results[key], Exception) and is_retryable_error(results[key])]
+        if not pending or attempt == retries:
+            break
+        metrics.inc("google.batch_part_retries", len(pending))
+        logger.warning(f"Повтор {len(pending)} неудачных частей батча (попытка {attempt + 1})")
+        await asyncio.sleep(0.5 * 2 ** attempt)
+    return results
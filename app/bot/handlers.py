@@ -1,8 +1,9 @@
+import asyncio
 import json
 import os
 import logging
 import datetime
-from pprint import pprint
+import time
 from typing import Optional
 
 logger = logging.getLogger(__name__)
@@ -11,6 +12,7 @@ from aiogram import Bot
 import pytz
 
 try:
+    from google.auth.exceptions import RefreshError
     from google.auth.transport.requests import Request
     from google.oauth2.credentials import Credentials
     from googleapiclient.discovery import build
@@ -44,6 +46,7 @@ except ImportError as e:
     Request = MockRequest
     Credentials = MockCredentials
     HttpError = MockHttpError
+    RefreshError = Exception
     build = lambda service, version, credentials=None: type('MockService', (), {
         'calendarList': lambda: type('MockCalendarList', (),
                                      {'list': lambda: type('MockList', (), {'execute': lambda: {'items': []}})()})(),
@@ -51,34 +54,31 @@ except ImportError as e:
                                {'list': lambda: type('MockList', (), {'execute': lambda: {'items': []}})()})()})()
 from dataclasses import dataclass, asdict
 
+from pydantic import BaseModel, ValidationError
+
 from langchain.prompts import PromptTemplate
-from langchain.chains import LLMChain
 from langchain_core.prompts import ChatPromptTemplate
 
+from app.bot.event_store import get_event_store, to_utc
+from app.bot.fast_parser import RELATIVE_RE, parse_event_text
+from app.bot.google_io import error_reason, error_status, execute, execute_batch, run_google
 from app.bot.keyboards import get_auth_keyboard, get_postpone_keyboard
+from app.bot.llm import invoke_llm
+from app.bot.llm_cache import calendars_fingerprint, get_llm_cache, make_key, normalize_text
+from app.bot.metrics import metrics
+from app.bot.push_channels import ensure_channels, stop_user_channels
+from app.bot.reminders import Reminder, reminder_scheduler
+from app.bot.service_pool import service_pool
+from app.bot.telegram_limiter import bulk_sends
+from app.bot.token_store import get_token_store
 from app.settings import get_settings
 
-from langchain_gigachat.chat_models import GigaChat
-
 CREDENTIALS_FILE = os.path.join(os.path.dirname(__file__), '../../credentials.json')
-USER_CREDENTIALS_DIR = "/service/user_credentials"
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
 settings = get_settings()
 
-try:
-    llm = GigaChat(
-        # Для авторизации запросов используйте ключ, полученный в проекте GigaChat API
-        credentials=settings.gigachat_key,
-        verify_ssl_certs=False,
-    )
-    logger.info("LLM успешно инициализирован")
-except Exception as e:
-    logger.error(f"Ошибка инициализации LLM: {e}")
-    # Создаем заглушку для LLM
-    llm = type('MockLLM', (), {'invoke': lambda self, prompt: type('MockResponse', (), {
-        'content': '{"event_summary": "Тестовое событие", "event_description": "Описание", "date": "2024-01-01", "start_time": "10:00", "end_time": "11:00"}'})()})()
 DEFAULT_CALENDAR_ID = 'primary'
 LOCAL_TIMEZONE = pytz.timezone('Europe/Moscow')
 
@@ -98,46 +98,211 @@ async def get_calendar_color(calendar_name: str) -> str:
     return calendar_colors.get(calendar_name, "⬛️")  # Default color
 
 
+# Кэш загруженных учетных данных: str(user_id) -> Credentials
+_credentials_cache = {}
+# Отметка сохранения токена (TokenStore.updated_at), из которого получены учетные данные в кэше
+_credentials_version = {}
+
+
+def _needs_refresh(creds):
+    if creds.expired:
+        return True
+    if creds.expiry is None:
+        return False
+    margin = datetime.timedelta(seconds=settings.credentials_refresh_margin)
+    return creds.expiry - datetime.datetime.utcnow() <= margin
+
+
+def invalidate_credentials(user_id):
+    """
+    Drops the in-memory credentials of a user so the next get_creds reads the token from the store.
+    """
+    _credentials_cache.pop(str(user_id), None)
+    _credentials_version.pop(str(user_id), None)
+
+
+def store_credentials(user_id, creds):
+    get_token_store().save(user_id, creds.to_json(), creds.expiry)
+    _credentials_version[str(user_id)] = get_token_store().updated_at(user_id)
+
+
+def _token_replaced(user_id):
+    """
+    Tells whether the user's token was saved or deleted by another process since it was cached;
+    if so, drops everything this process cached for the user.
+    """
+    version = get_token_store().updated_at(user_id)
+    if version == _credentials_version.get(str(user_id)):
+        return False
+    metrics.inc("credentials_cache.replaced")
+    invalidate_user_caches(user_id)
+    if version is None:
+        reminder_scheduler.remove_user(user_id)
+    return True
+
+
+def load_credentials(user_id):
+    """
+    Reads the stored credentials of a user; returns None if there is no token.
+    """
+    token = get_token_store().load(user_id)
+    if token is None:
+        return None
+    return Credentials.from_authorized_user_info(json.loads(token), settings.scopes)
+
+
+# Выполняющиеся обновления токенов: str(user_id) -> asyncio.Task с обновленными учетными данными
+_refreshing = {}
+
+
+async def _refresh(user_id, creds):
+    try:
+        with metrics.timer("credentials.refresh"):
+            await run_google(creds.refresh, Request())
+    except Exception:
+        metrics.inc("credentials.refresh_errors")
+        raise
+    store_credentials(user_id, creds)
+    _credentials_cache[str(user_id)] = creds
+    metrics.inc("credentials.refreshes")
+    logger.info(f"Токен успешно обновлен для пользователя {user_id}")
+    return creds
+
+
+def _refresh_done(key, task):
+    if _refreshing.get(key) is task:
+        del _refreshing[key]
+    # Ошибка обновления без ожидающих не должна попадать в лог как "never retrieved"
+    if not task.cancelled():
+        task.exception()
+
+
+async def refresh_credentials(user_id, creds):
+    """
+    Refreshes the access token of a user and persists it.
+
+    Concurrent callers for the same user share one in-flight refresh and get its result
+    (the refreshed Credentials) or its exception. The refresh runs in its own task, so
+    cancelling any of the callers (including the first one) doesn't affect the others.
+    """
+    key = str(user_id)
+    task = _refreshing.get(key)
+    if task is not None:
+        metrics.inc("credentials.refresh_deduplicated")
+    else:
+        task = asyncio.create_task(_refresh(user_id, creds))
+        _refreshing[key] = task
+        task.add_done_callback(lambda done: _refresh_done(key, done))
+    return await asyncio.shield(task)
+
+
+def _drop_failed_token(user_id, creds, error):
+    """
+    Deletes the stored token after a failed refresh, unless it was replaced in the meantime
+    (new authorization or a refresh by another process) or the error was transient.
+    """
+    invalidate_credentials(user_id)
+    if not isinstance(error, RefreshError):
+        return
+    try:
+        stored = get_token_store().load(user_id)
+        if stored is not None and json.loads(stored).get('token') != creds.token:
+            logger.info(f"Токен пользователя {user_id} уже заменен, удаление пропущено")
+            return
+    except ValueError:
+        pass
+    get_token_store().delete(user_id)
+
+
 async def get_creds(user_id):
-    creds = None
-    token_path = os.path.join(USER_CREDENTIALS_DIR, f'token_{user_id}.json')
+    creds = _credentials_cache.get(str(user_id))
+    # При нескольких процессах токен могли обновить, заменить (/auth) или удалить в другом процессе
+    if creds is not None and settings.workers > 1 and _token_replaced(user_id):
+        creds = None
+
+    if creds is not None and not _needs_refresh(creds):
+        metrics.inc("credentials_cache.hits")
+        return creds
+    metrics.inc("credentials_cache.misses")
 
-    if os.path.exists(token_path):
+    if creds is None:
         try:
-            creds = Credentials.from_authorized_user_file(token_path, settings.scopes)
-            logger.info(f"Срок действия токена из файла: {creds.expiry}")
+            _credentials_version[str(user_id)] = get_token_store().updated_at(user_id)
+            creds = load_credentials(user_id)
+            if creds is None:
+                return None
+            logger.info(f"Срок действия токена из хранилища: {creds.expiry}")
             logger.info(f"Текущее время UTC: {datetime.datetime.now(pytz.utc)}")
-
-            if creds.expired:
-                logger.info(f"Токен истек для пользователя {user_id}, пытаемся обновить")
-                if creds.refresh_token:
-                    try:
-                        creds.refresh(Request())
-                        with open(token_path, 'w') as f:
-                            f.write(creds.to_json())
-                        logger.info(f"Токен успешно обновлен для пользователя {user_id}")
-                    except Exception as e:
-                        logger.error(f"Не удалось обновить токен для пользователя {user_id}: {e}")
-                        os.remove(token_path)
-                        creds = None
-                else:
-                    logger.warning(f"Refresh токен недоступен для пользователя {user_id}")
-                    os.remove(token_path)
-                    creds = None
-            else:
-                logger.info(f"Токен все еще действителен для пользователя {user_id}")
-
         except Exception as e:
-            logger.error(f"Ошибка загрузки учетных данных из файла для пользователя {user_id}: {e}")
-            if os.path.exists(token_path):
-                os.remove(token_path)
-            creds = None
+            logger.error(f"Ошибка загрузки учетных данных из хранилища для пользователя {user_id}: {e}")
+            get_token_store().delete(user_id)
+            return None
+
+    if _needs_refresh(creds):
+        # Обновление на пути запроса: при работающем фоновом обновлении это редкость
+        metrics.inc("credentials.request_path_refreshes")
+        if creds.expired:
+            metrics.inc("credentials.expired_on_request")
+        logger.info(f"Токен истекает или истек для пользователя {user_id}, пытаемся обновить")
+        if creds.refresh_token:
+            try:
+                creds = await refresh_credentials(user_id, creds)
+            except Exception as e:
+                logger.error(f"Не удалось обновить токен для пользователя {user_id}: {e}")
+                _drop_failed_token(user_id, creds, e)
+                return None
+        elif creds.expired:
+            logger.warning(f"Refresh токен недоступен для пользователя {user_id}")
+            invalidate_credentials(user_id)
+            get_token_store().delete(user_id)
+            return None
+    else:
+        logger.info(f"Токен все еще действителен для пользователя {user_id}")
+
+    _credentials_cache[str(user_id)] = creds
     return creds
 
 
+# Время последнего успешного запроса к Google API: str(user_id) -> time.monotonic()
+_validated_at = {}
+
+
+def mark_validated(user_id):
+    _validated_at[str(user_id)] = time.monotonic()
+
+
+def is_recently_validated(user_id):
+    validated_at = _validated_at.get(str(user_id))
+    return validated_at is not None and time.monotonic() - validated_at < settings.service_probe_interval
+
+
+# Причины 403, означающие недействительную авторизацию. Остальные 403 (квота, частота запросов, нет прав
+# на календарь) токен не отменяют, поэтому он при них не удаляется
+AUTH_ERROR_REASONS = ('authError', 'invalidCredentials')
+
+
+def is_auth_error(error):
+    """
+    Tells whether a Google API error means the user's authorization is no longer valid.
+    """
+    status = error_status(error)
+    if status == 401:
+        return True
+    return status == 403 and error_reason(error) in AUTH_ERROR_REASONS
+
+
+async def handle_auth_error(user_id, error):
+    """
+    Central handling of auth errors: drops the user's token and returns the re-authorization reply.
+    """
+    logger.error(f"Ошибка аутентификации Google API для пользователя {user_id}: {error}")
+    metrics.inc("google.auth_errors")
+    await delete_credentials(user_id)
+    return ("Ошибка аутентификации. Пожалуйста, повторно авторизуйте бота.", get_auth_keyboard())
+
+
 async def get_calendar_service(user_id):
     creds = await get_creds(user_id)
-    token_path = os.path.join(USER_CREDENTIALS_DIR, f'token_{user_id}.json')
 
     if not creds:
         logger.warning(f"Действительные учетные данные не найдены для пользователя {user_id}")
@@ -147,86 +312,134 @@ async def get_calendar_service(user_id):
     if not creds.refresh_token:
         logger.warning(f"Refresh токен не найден для пользователя {user_id}. Требуется повторная авторизация.")
         # Удаляем файл токена, так как refresh токен отсутствует
-        if os.path.exists(token_path):
-            os.remove(token_path)
+        await delete_credentials(user_id)
         return ("Refresh токен не найден. Пожалуйста, повторно авторизуйте бота.", get_auth_keyboard())
 
-    # Проверяем, истек ли токен и пытаемся обновить его
-    if creds.expired:
-        try:
-            creds.refresh(Request())
-            # Сохраняем обновленные учетные данные
-            with open(token_path, 'w') as f:
-                f.write(creds.to_json())
-            logger.info(f"Токен успешно обновлен для пользователя {user_id}")
-        except Exception as e:
-            logger.error(f"Не удалось обновить токен для пользователя {user_id}: {e}")
-            # Если не удалось обновить, удаляем файл токена
-            if os.path.exists(token_path):
-                os.remove(token_path)
-            return ("Не удалось обновить токен. Пожалуйста, повторно авторизуйте бота.", get_auth_keyboard())
-
+    # Истекающий токен уже обновлен в get_creds (refresh_credentials)
     try:
-        service = build('calendar', 'v3', credentials=creds)
-        # Проверяем, что сервис работает, делая тестовый запрос
-        service.calendarList().list(maxResults=1).execute()
+        service = await service_pool.get(user_id, creds)
+        # Работоспособность сервиса подтверждается результатом реальных запросов;
+        # тестовый запрос делается, только если он явно включен и давно не было успешных запросов
+        if settings.service_probe_interval > 0 and not is_recently_validated(user_id):
+            await execute(service.calendarList().list(maxResults=1))
+            mark_validated(user_id)
         return service
     except HttpError as error:
         logger.error(f"Произошла ошибка при создании сервиса календаря для пользователя {user_id}: {error}")
         # Если ошибка связана с аутентификацией, удаляем токен
-        if error.resp.status in [401, 403]:
-            if os.path.exists(token_path):
-                os.remove(token_path)
-            return ("Ошибка аутентификации. Пожалуйста, повторно авторизуйте бота.", get_auth_keyboard())
+        if is_auth_error(error):
+            return await handle_auth_error(user_id, error)
         return None
     except Exception as error:
         logger.error(f"Неожиданная ошибка при создании сервиса календаря для пользователя {user_id}: {error}")
         return None
 
 
-async def get_calendar_list(service):
+# Кэш списков календарей: str(user_id) -> {'etag': ..., 'items': [...], 'fetched_at': time.monotonic()}
+_calendar_list_cache = {}
+
+
+def invalidate_calendar_list(user_id):
+    """
+    Drops the cached calendar list of a user so the next request downloads it again.
+    """
+    _calendar_list_cache.pop(str(user_id), None)
+
+
+async def get_calendar_list(service, user_id=None):
     """
     Gets the list of calendars for the user.
+
+    When ``user_id`` is given the list is cached for ``calendar_list_ttl`` seconds and then
+    revalidated with its ETag, so an unchanged list costs a 304 instead of a full download.
     """
+    cached = _calendar_list_cache.get(str(user_id)) if user_id is not None else None
+    if cached is not None and time.monotonic() - cached['fetched_at'] < settings.calendar_list_ttl:
+        metrics.inc("calendar_list_cache.hits")
+        return cached['items']
+
+    request = service.calendarList().list()
+    if cached is not None and cached['etag']:
+        request.headers['If-None-Match'] = cached['etag']
     try:
-        calendar_list = service.calendarList().list().execute()
+        calendar_list = await execute(request)
         calendars = calendar_list.get('items', [])
+        if user_id is not None:
+            metrics.inc("calendar_list_cache.misses")
+            _calendar_list_cache[str(user_id)] = {
+                'etag': calendar_list.get('etag'),
+                'items': calendars,
+                'fetched_at': time.monotonic(),
+            }
         return calendars
     except HttpError as error:
+        if cached is not None and error.resp.status == 304:
+            metrics.inc("calendar_list_cache.revalidated")
+            cached['fetched_at'] = time.monotonic()
+            return cached['items']
+        if is_auth_error(error):
+            raise
         logger.error(f"Произошла ошибка: {error}")
         return []
 
 
+def _events_list_request(service, calendar_id, num_events):
+    now = datetime.datetime.utcnow().isoformat() + 'Z'  # 'Z' indicates UTC time
+    return service.events().list(calendarId=calendar_id, timeMin=now,
+                                 maxResults=num_events, singleEvents=True,
+                                 orderBy='startTime')
+
+
 async def get_events_from_calendar(service, calendar_id, num_events=5):
     """
     Gets upcoming events from a specific calendar.
     """
-    now = datetime.datetime.utcnow().isoformat() + 'Z'  # 'Z' indicates UTC time
     try:
-        events_result = service.events().list(calendarId=calendar_id, timeMin=now,
-                                              maxResults=num_events, singleEvents=True,
-                                              orderBy='startTime').execute()
+        events_result = await execute(_events_list_request(service, calendar_id, num_events))
         events = events_result.get('items', [])
         return events
     except HttpError as error:
+        if is_auth_error(error):
+            raise
         logger.error(f"Произошла ошибка: {error}")
         return []
 
 
+async def get_events_from_calendars(service, calendar_ids, num_events=5):
+    """
+    Gets upcoming events from several calendars of one user.
+
+    Returns a list aligned with ``calendar_ids``; each item is either a list of events
+    or the exception raised for that calendar.
+    """
+    if not settings.google_batch_enabled:
+        return await asyncio.gather(
+            *(get_events_from_calendar(service, calendar_id, num_events) for calendar_id in calendar_ids),
+            return_exceptions=True
+        )
+
+    responses = await execute_batch(
+        service,
+        {index: _events_list_request(service, calendar_id, num_events)
+         for index, calendar_id in enumerate(calendar_ids)}
+    )
+    return [
+        responses[index] if isinstance(responses[index], Exception) else responses[index].get('items', [])
+        for index in range(len(calendar_ids))
+    ]
+
+
 # Функция для сохранения учетных данных пользователя (OAuth2 flow)
 async def save_credentials(user_id, credentials):
-    os.makedirs(USER_CREDENTIALS_DIR, exist_ok=True)
-    token_path = os.path.join(USER_CREDENTIALS_DIR, f'token_{user_id}.json')
-
     # Проверяем, что у нас есть refresh токен
     if not credentials.refresh_token:
         logger.warning(
             f"Refresh токен не получен для пользователя {user_id}. Это может вызвать проблемы с авторизацией позже.")
 
     try:
-        with open(token_path, 'w') as token:
-            token.write(credentials.to_json())
-        logger.info(f"Учетные данные сохранены для пользователя {user_id} в {token_path}")
+        store_credentials(user_id, credentials)
+        invalidate_user_caches(user_id)
+        logger.info(f"Учетные данные сохранены для пользователя {user_id}")
         logger.info(f"Срок действия токена: {credentials.expiry}")
         logger.info(f"Есть refresh токен: {bool(credentials.refresh_token)}")
     except Exception as e:
@@ -234,7 +447,140 @@ async def save_credentials(user_id, credentials):
         raise
 
 
-async def get_upcoming_events(user_id, num_events=5):
+def invalidate_user_caches(user_id):
+    """
+    Drops everything this process cached for a user: credentials, Calendar service and calendar list.
+    """
+    invalidate_credentials(user_id)
+    service_pool.invalidate(user_id)
+    invalidate_calendar_list(user_id)
+    _validated_at.pop(str(user_id), None)
+
+
+async def delete_credentials(user_id):
+    """
+    Deletes the stored token of a user and drops everything cached for it.
+    """
+    if settings.calendar_push_enabled:
+        # Каналы уведомлений останавливаются, пока старые учетные данные еще доступны
+        try:
+            creds = _credentials_cache.get(str(user_id)) or load_credentials(user_id)
+            if creds is not None:
+                await stop_user_channels(await service_pool.get(user_id, creds), user_id)
+        except Exception as e:
+            logger.warning(f"Не удалось остановить каналы уведомлений пользователя {user_id}: {e}")
+    invalidate_user_caches(user_id)
+    get_event_store().clear_user(user_id)
+    reminder_scheduler.remove_user(user_id)
+    return get_token_store().delete(user_id)
+
+
+def _sync_request(service, calendar_id, sync_token, page_token=None):
+    if sync_token:
+        return service.events().list(calendarId=calendar_id, syncToken=sync_token, pageToken=page_token,
+                                     singleEvents=True, maxResults=2500)
+    # Полная синхронизация: прошлые события не нужны ни для /events, ни для напоминаний
+    time_min = (datetime.datetime.utcnow() - datetime.timedelta(days=1)).isoformat() + 'Z'
+    return service.events().list(calendarId=calendar_id, timeMin=time_min, pageToken=page_token,
+                                 singleEvents=True, maxResults=2500)
+
+
+async def _execute_many(service, requests):
+    if settings.google_batch_enabled:
+        return await execute_batch(service, requests)
+    keys = list(requests)
+    responses = await asyncio.gather(*(execute(requests[key]) for key in keys), return_exceptions=True)
+    return dict(zip(keys, responses))
+
+
+async def sync_calendar_events(service, user_id, calendar_ids):
+    """
+    Brings the local event store up to date with Calendar API incremental sync.
+
+    Calendars without a sync token (or whose token expired with 410 Gone) get a full sync;
+    the rest only download what changed since the previous sync.
+    Returns ``{calendar_id: exception}`` for calendars that failed to sync.
+    """
+    store = get_event_store()
+    sync_tokens = {calendar_id: store.get_sync_token(user_id, calendar_id) for calendar_id in calendar_ids}
+    first_pages = await _execute_many(
+        service,
+        {calendar_id: _sync_request(service, calendar_id, sync_tokens[calendar_id]) for calendar_id in calendar_ids}
+    )
+
+    errors = {}
+    for calendar_id in calendar_ids:
+        response = first_pages[calendar_id]
+        try:
+            if isinstance(response, HttpError) and response.resp.status == 410:
+                logger.info(f"Токен синхронизации устарел для календаря {calendar_id} пользователя {user_id}, "
+                            f"выполняем полную синхронизацию")
+                metrics.inc("event_sync.full_resyncs")
+                store.reset_calendar(user_id, calendar_id)
+                sync_tokens[calendar_id] = None
+                response = await execute(_sync_request(service, calendar_id, None))
+            elif isinstance(response, Exception):
+                raise response
+
+            items = list(response.get('items', []))
+            while response.get('nextPageToken'):
+                response = await execute(_sync_request(service, calendar_id, sync_tokens[calendar_id],
+                                                       response['nextPageToken']))
+                items.extend(response.get('items', []))
+            store.apply_changes(user_id, calendar_id, items, response.get('nextSyncToken'),
+                                full_sync=sync_tokens[calendar_id] is None)
+            metrics.inc("event_sync.changed_events", len(items))
+        except Exception as e:
+            metrics.inc("event_sync.errors")
+            errors[calendar_id] = e
+    return errors
+
+
+async def sync_user_calendars(user_id, calendar_ids):
+    """
+    Refetches the changes of the given calendars after a push notification.
+    """
+    service = await get_calendar_service(user_id)
+    if service is None or isinstance(service, tuple):
+        return
+    store = get_event_store()
+    calendars_to_sync = store.calendars_needing_sync(user_id, calendar_ids, time.time())
+    if not calendars_to_sync:
+        return
+    errors = await sync_calendar_events(service, user_id, calendars_to_sync)
+    for calendar_id, error in errors.items():
+        logger.error(f"Не удалось синхронизировать календарь {calendar_id} пользователя {user_id}: {error}")
+        store.mark_dirty(user_id, calendar_id)
+    # Напоминания обновляются сразу, не дожидаясь периодического обновления
+    await schedule_user_reminders(user_id)
+
+
+async def renew_push_channels():
+    """
+    Renews push notification channels that expire soon.
+    """
+    store = get_event_store()
+    expiring = {}
+    for _, user_id, calendar_id, _ in store.channels_expiring(time.time() + settings.calendar_push_renew_before):
+        expiring.setdefault(user_id, []).append(calendar_id)
+
+    for user_id, calendar_ids in expiring.items():
+        service = await get_calendar_service(user_id)
+        if service is None or isinstance(service, tuple):
+            continue
+        try:
+            await ensure_channels(service, user_id, calendar_ids)
+        except Exception as e:
+            logger.error(f"Не удалось продлить каналы уведомлений пользователя {user_id}: {e}")
+
+
+async def fetch_upcoming_events(user_id, num_events=5):
+    """
+    Gets upcoming events of all the user's calendars.
+
+    Returns a list of ``(calendar_id, calendar_name, event_id, event_summary, start_utc)`` or,
+    like get_upcoming_events, an error message / re-authorization tuple.
+    """
     service = await get_calendar_service(user_id)
 
     if isinstance(service, tuple):  # If response is tuple
@@ -243,26 +589,61 @@ async def get_upcoming_events(user_id, num_events=5):
     all_events = []
 
     try:
-        calendars = await get_calendar_list(service)
+        calendars = await get_calendar_list(service, user_id)
 
         if not calendars:
             return "Календари не найдены или не удалось получить список календарей."
-
-        for calendar in calendars:
-            calendar_id = calendar['id']
+        mark_validated(user_id)
+        calendar_ids = [calendar['id'] for calendar in calendars]
+
+        # Для каждого календаря получаем (ошибка, [(id, название, начало в UTC)]); порядок совпадает с порядком календарей
+        if settings.event_sync_enabled:
+            # События читаются из локального хранилища, из Google скачиваются только изменения
+            store = get_event_store()
+            if settings.calendar_push_enabled:
+                # Синхронизируем только календари без канала уведомлений или с пришедшими изменениями
+                await ensure_channels(service, user_id, calendar_ids)
+                calendars_to_sync = store.calendars_needing_sync(user_id, calendar_ids, time.time())
+            else:
+                calendars_to_sync = calendar_ids
+            errors = await sync_calendar_events(service, user_id, calendars_to_sync) if calendars_to_sync else {}
+            for calendar_id in errors:
+                store.mark_dirty(user_id, calendar_id)
+            now = datetime.datetime.now(pytz.utc)
+            results = [
+                (errors.get(calendar_id),
+                 store.upcoming_events(user_id, calendar_id, now, num_events))
+                for calendar_id in calendar_ids
+            ]
+        else:
+            # Запрашиваем события всех календарей одним batch-запросом
+            results = []
+            for events in await get_events_from_calendars(service, calendar_ids, num_events):
+                if isinstance(events, Exception):
+                    results.append((events, []))
+                    continue
+                results.append((None, [
+                    (event['id'], event.get('summary', ''),
+                     to_utc(event['start'].get('dateTime', event['start'].get('date'))))
+                    for event in events if event['start'].get('dateTime', event['start'].get('date'))
+                ]))
+
+        for calendar, (error, events) in zip(calendars, results):
             calendar_name = calendar['summary']  # Имя календаря
-            events = await get_events_from_calendar(service, calendar_id, num_events)
-
-            for event in events:
-                start = event['start'].get('dateTime', event['start'].get('date'))
-                if start:
-                    start_datetime = datetime.datetime.fromisoformat(start.replace('Z', '+00:00'))
-                    if start_datetime.tzinfo is None:
-                        local_start_time = start_datetime.replace(tzinfo=pytz.utc).astimezone(LOCAL_TIMEZONE)
-                    else:
-                        local_start_time = start_datetime.astimezone(LOCAL_TIMEZONE)
-                    all_events.append((calendar_name, event['summary'], local_start_time.strftime('%Y-%m-%d %H:%M')))
+            if isinstance(error, HttpError) and is_auth_error(error):
+                return await handle_auth_error(user_id, error)
+            if error is not None:
+                logger.error(f"Не удалось получить события календаря {calendar['id']} "
+                             f"для пользователя {user_id}: {error}")
 
+            for event_id, event_summary, start_utc in events:
+                all_events.append((calendar['id'], calendar_name, event_id, event_summary, start_utc))
+
+    except HttpError as error:
+        if is_auth_error(error):
+            return await handle_auth_error(user_id, error)
+        logger.error(f"Произошла ошибка при получении списка календарей: {error}")
+        return []
     except Exception as e:
         logger.error(f"Произошла ошибка при получении списка календарей: {e}")
         return []
@@ -270,68 +651,123 @@ async def get_upcoming_events(user_id, num_events=5):
     return all_events
 
 
+async def get_upcoming_events(user_id, num_events=5):
+    events = await fetch_upcoming_events(user_id, num_events)
+    if isinstance(events, (str, tuple)):
+        return events
+    return [
+        (calendar_name, event_summary, start_utc.astimezone(LOCAL_TIMEZONE).strftime('%Y-%m-%d %H:%M'))
+        for _, calendar_name, _, event_summary, start_utc in events
+    ]
+
+
 async def send_event_reminders(bot: Bot):
     """
-    Sends event reminders to all authorized users.
+    Refreshes the reminder schedule of all authorized users.
+
+    Reminders themselves are delivered by ``reminder_scheduler`` at their exact instants; this
+    periodic job only refetches events. Users are processed concurrently, at most
+    ``settings.reminder_concurrency`` at a time.
     """
     # Get the list of user IDs from the credentials directory
     user_ids = await get_all_user_ids()
+    # Напоминания пользователей, чей токен удален (в том числе в другом процессе), больше не отправляются
+    for user_id in reminder_scheduler.user_ids() - {str(user_id) for user_id in user_ids}:
+        reminder_scheduler.remove_user(user_id)
 
     if not user_ids:
         logger.info("Нет авторизованных пользователей для отправки напоминаний")
         return
 
-    now = datetime.datetime.now(LOCAL_TIMEZONE)  # Замените на ваш часовой пояс
+    semaphore = asyncio.Semaphore(max(1, settings.reminder_concurrency))
+    tick_started = time.monotonic()
 
-    for user_id in user_ids:
-        upcoming_events = await get_upcoming_events(user_id, num_events=5)
+    async def process_user(user_id):
+        async with semaphore:
+            user_started = time.monotonic()
+            try:
+                await schedule_user_reminders(user_id)
+            except Exception as e:
+                metrics.inc("reminders.user_errors")
+                logger.exception(f"Ошибка при обновлении напоминаний пользователя {user_id}: {e}")
+            finally:
+                metrics.observe("reminders.user_latency", time.monotonic() - user_started)
+
+    await asyncio.gather(*(process_user(user_id) for user_id in user_ids))
+    metrics.set_gauge("reminder_ledger.size", get_event_store().compact_reminders(time.time()))
+    ledger_lookups = metrics.counter("reminder_ledger.hits") + metrics.counter("reminder_ledger.misses")
+    if ledger_lookups:
+        metrics.set_gauge("reminder_ledger.hit_rate", metrics.counter("reminder_ledger.hits") / ledger_lookups)
+
+    tick_duration = time.monotonic() - tick_started
+    metrics.observe("reminders.tick_duration", tick_duration)
+    metrics.set_gauge("reminders.tick_users", len(user_ids))
+    logger.info(f"Тик напоминаний завершен за {tick_duration:.2f} с, пользователей: {len(user_ids)}")
 
-        # Проверяем, что upcoming_events является списком, а не строкой ошибки или кортежем
-        if isinstance(upcoming_events, (str, tuple)):
-            logger.warning(f"Ошибка получения событий для пользователя {user_id}: {upcoming_events}")
-            continue
 
-        for calendar_name, event_summary, event_start_time_str in upcoming_events:
-            color = await get_calendar_color(calendar_name)
+async def schedule_user_reminders(user_id):
+    """
+    Rebuilds a single user's reminders in the reminder scheduler from their upcoming events.
+    """
+    upcoming_events = await fetch_upcoming_events(user_id, num_events=5)
 
-            event_start_time = datetime.datetime.strptime(event_start_time_str, '%Y-%m-%d %H:%M')
-            event_start_time = LOCAL_TIMEZONE.localize(event_start_time)
-            time_difference = event_start_time - now
-            if datetime.timedelta(minutes=15) <= time_difference <= datetime.timedelta(
-                    hours=2):  # Проверяем, если событие через 15-30 минут
-                total_minutes = int(time_difference.total_seconds() / 60)
+    # Проверяем, что upcoming_events является списком, а не строкой ошибки или кортежем
+    if isinstance(upcoming_events, (str, tuple)):
+        logger.warning(f"Ошибка получения событий для пользователя {user_id}: {upcoming_events}")
+        if isinstance(upcoming_events, tuple):
+            reminder_scheduler.remove_user(user_id)
+        return
 
-                if total_minutes < 60:
-                    time_string = f"{total_minutes} минут"
-                else:
-                    hours = total_minutes // 60
-                    minutes = total_minutes % 60
-                    time_string = f"{hours} часов {minutes} минут"
-                await bot.send_message(chat_id=user_id,
-                                       text=f"<b>Напоминание: </b> {color} {event_summary} начнется через {time_string}",
-                                       parse_mode="HTML", reply_markup=get_postpone_keyboard(event_id=1))  # TODO
-                logger.info(f"Напоминание отправлено пользователю {user_id} для события {event_summary}")
+    reminder_scheduler.update_user(user_id, upcoming_events)
 
 
-async def get_all_user_ids():
+async def send_reminder(bot: Bot, reminder: Reminder):
     """
-    Gets all user IDs by listing files in the credentials directory.
+    Sends a single due reminder unless the sent-reminder ledger shows it was already sent.
+
+    The reminder is claimed in the ledger before sending and marked sent only after delivery;
+    a failed or interrupted send releases the claim so the reminder can be sent again.
     """
-    user_ids = []
+    if settings.workers > 1 and get_token_store().updated_at(reminder.user_id) is None:
+        logger.info(f"Токен пользователя {reminder.user_id} удален, напоминание не отправляется")
+        reminder_scheduler.remove_user(reminder.user_id)
+        return
+    store = get_event_store()
+    ledger_key = (reminder.user_id, reminder.calendar_id, reminder.event_id, reminder.start_at,
+                  reminder.offset_minutes)
+    if not store.claim_reminder(*ledger_key, now=time.time(), stale_after=settings.reminder_claim_timeout):
+        metrics.inc("reminder_ledger.hits")
+        logger.info(f"Напоминание пользователю {reminder.user_id} о событии {reminder.event_summary} уже отправлено")
+        return
+    metrics.inc("reminder_ledger.misses")
 
-    # Проверяем, существует ли директория
-    if not os.path.exists(USER_CREDENTIALS_DIR):
-        logger.warning(f"Директория учетных данных не существует: {USER_CREDENTIALS_DIR}")
-        return user_ids
+    color = await get_calendar_color(reminder.calendar_name)
+    total_minutes = max(0, int((reminder.start_at - time.time()) / 60))
 
-    for filename in os.listdir(USER_CREDENTIALS_DIR):
-        if filename.startswith('token_') and filename.endswith('.json'):
-            try:
-                user_id = int(filename.split('_')[1].split('.')[0])
-                user_ids.append(user_id)
-            except ValueError:
-                logger.warning(f"Некорректное имя файла в директории учетных данных: {filename}")
-    return user_ids
+    if total_minutes < 60:
+        time_string = f"{total_minutes} минут"
+    else:
+        hours = total_minutes // 60
+        minutes = total_minutes % 60
+        time_string = f"{hours} часов {minutes} минут"
+    try:
+        with bulk_sends():
+            await bot.send_message(chat_id=reminder.user_id,
+                                   text=f"<b>Напоминание: </b> {color} {reminder.event_summary} начнется через {time_string}",
+                                   parse_mode="HTML", reply_markup=get_postpone_keyboard(event_id=1))  # TODO
+    except BaseException:
+        # В том числе отмена задачи при остановке: напоминание отправит следующий запуск
+        store.release_reminder(*ledger_key)
+        raise
+    store.mark_reminder_sent(*ledger_key, now=time.time())
+    logger.info(f"Напоминание отправлено пользователю {reminder.user_id} для события {reminder.event_summary}")
+
+
+async def get_all_user_ids():
+    """
+    Gets the IDs of all users with a stored token.
+    """
+    return get_token_store().user_ids()
 
 
 @dataclass
@@ -345,6 +781,23 @@ class EventDetails:
     calendar_name: Optional[str] = None
 
 
+def event_to_record(event_details: EventDetails) -> dict:
+    """
+    Serializes prepared EventDetails (with datetime start/end) into a JSON-compatible dict.
+    """
+    record = asdict(event_details)
+    record['start_time'] = event_details.start_time.isoformat()
+    record['end_time'] = event_details.end_time.isoformat()
+    return record
+
+
+def event_from_record(record: dict) -> EventDetails:
+    event_details = EventDetails(**record)
+    event_details.start_time = datetime.datetime.fromisoformat(record['start_time'])
+    event_details.end_time = datetime.datetime.fromisoformat(record['end_time'])
+    return event_details
+
+
 # Функция для создания события в Google Calendar
 async def create_google_calendar_event(user_id, event_summary, event_description, start_time, end_time,
                                        calendar_id=DEFAULT_CALENDAR_ID):
@@ -357,7 +810,7 @@ async def create_google_calendar_event(user_id, event_summary, event_description
         return False  # Или выбросить исключение
 
     try:
-        service = build('calendar', 'v3', credentials=creds)
+        service = await service_pool.get(user_id, creds)
 
         event = {
             'summary': event_summary,
@@ -372,17 +825,31 @@ async def create_google_calendar_event(user_id, event_summary, event_description
             },
         }
 
-        event = service.events().insert(calendarId=calendar_id, body=event).execute()
+        event = await execute(service.events().insert(calendarId=calendar_id, body=event))
+        mark_validated(user_id)
         logger.info(f'Событие создано в календаре {calendar_id}: {event.get("htmlLink")}')
         return True
     except HttpError as error:
+        if is_auth_error(error):
+            await handle_auth_error(user_id, error)
         logger.error(f"Произошла ошибка при создании события: {error}")
         return False
 
 
-# Функция для обработки запроса пользователя, классификации и создания события (ОБЪЕДИНЕННАЯ)
-async def create_event_from_text(user_id, user_text):
-    system_template = """
+class ExtractedEvent(BaseModel):
+    """
+    Schema of the event details returned by the LLM.
+    """
+    event_summary: str
+    event_description: str
+    date: str
+    start_time: str
+    end_time: str
+    # Заполняется только в режиме одного запроса, когда модель сразу выбирает календарь
+    calendar: Optional[str] = None
+
+
+EXTRACTION_TEMPLATE = """
         You are a helpful assistant that extracts event details from user input.
         Given the following text, extract the event summary, event_description, date, start time, and end time.
 
@@ -392,149 +859,248 @@ async def create_event_from_text(user_id, user_text):
         If there is no explicit event_description, provide a short description of what the event is.
 
         **Do not use dates from the past.  Any date generated must be equal to or later than the current date.**
-
+        {calendar_instructions}
         Return the data in the following JSON format:
-        {{
+        {{{{
           "event_summary": "...",
           "event_description": "...",
           "date": "YYYY-MM-DD",
           "start_time": "HH:MM",
-          "end_time": "HH:MM"
-        }}
-        current date: {current_datetime}
-        User Text: {user_text}
+          "end_time": "HH:MM"{calendar_field}
+        }}}}
+        current date: {{current_datetime}}
+        User Text: {{user_text}}
         """
+
+CALENDAR_INSTRUCTIONS = """
+        Also select the best Google Calendar to put the event into: choose the *single best* calendar from the list below.
+        The "calendar" value *MUST* be the *EXACT* name of one of the available calendars. If none of the calendars are appropriate, return "Стандартный".
+
+        Available Calendars:
+        {calendar_list}
+"""
+
+
+def _build_extraction_prompt(user_text, available_calendars=None):
+    if available_calendars:
+        calendar_list = "\n        ".join(calendar['summary'] for calendar in available_calendars)
+        system_template = EXTRACTION_TEMPLATE.format(
+            calendar_instructions=CALENDAR_INSTRUCTIONS.format(calendar_list=calendar_list)
+            .replace('{', '{{').replace('}', '}}'),
+            calendar_field=',\n          "calendar": "..."'
+        )
+    else:
+        system_template = EXTRACTION_TEMPLATE.format(calendar_instructions='', calendar_field='')
     current_datetime = datetime.datetime.now().strftime("%Y-%m-%d %H:%M")
 
     prompt_template = ChatPromptTemplate.from_messages(
         [("system", system_template), ("user", "{user_text}")]
     )
+    return prompt_template.invoke({"user_text": user_text, "current_datetime": current_datetime})
 
-    prompt = prompt_template.invoke({"user_text": user_text, "current_datetime": current_datetime})
 
+def _parse_extraction(response_content):
+    """
+    Validates the LLM response against ExtractedEvent; returns the model or an error message.
+    """
+    content = response_content.strip()
+    # Модель иногда оборачивает JSON в markdown-блок
+    if content.startswith('```'):
+        content = content.strip('`').removeprefix('json').strip()
     try:
-        response = llm.invoke(prompt)
-        response_content = response.content
-    except Exception as e:
-        logger.error(f"Ошибка при вызове LLM: {e}")
-        return "Извините, произошла ошибка при обработке вашего запроса. Пожалуйста, попробуйте снова."
+        return ExtractedEvent.model_validate_json(content)
+    except ValidationError as e:
+        logger.error(f"Ответ LLM не соответствует схеме: {e}, Ответ: {response_content}")
+        if any(error['type'] == 'json_invalid' for error in e.errors()):
+            return "Извините, я не смог понять детали. Пожалуйста, переформулируйте ваш запрос."
+        return "Извините, произошла ошибка при обработке деталей события. Пожалуйста, попробуйте снова."
 
-    try:
-        event_data = json.loads(response_content)
 
-        # Проверяем, что все необходимые поля присутствуют
-        required_fields = ['event_summary', 'event_description', 'date', 'start_time', 'end_time']
-        for field in required_fields:
-            if field not in event_data:
-                logger.error(f"Отсутствует обязательное поле в ответе LLM: {field}")
-                return "Извините, произошла ошибка при обработке деталей события. Пожалуйста, попробуйте снова."
+def _build_event_details(extracted: ExtractedEvent):
+    """
+    Turns validated extraction fields into EventDetails with real start/end datetimes,
+    or returns an error message for the user.
+    """
+    event_details = EventDetails(
+        event_summary=extracted.event_summary,
+        event_description=extracted.event_description,
+        date=extracted.date,
+        start_time=extracted.start_time,
+        end_time=extracted.end_time,
+    )
+    logger.debug(f"Извлеченные детали события: {asdict(event_details)}")
+
+    event_summary = event_details.event_summary
+    date_str = event_details.date
+    start_time_str = event_details.start_time
+    end_time_str = event_details.end_time
+
+    # Проверяем, что название события не пустое
+    if not event_summary or event_summary.strip() == "":
+        return "Извините, не удалось определить название события. Пожалуйста, укажите более подробную информацию."
 
-        # Проверяем, что все поля являются строками
-        for field in required_fields:
-            if not isinstance(event_data[field], str):
-                logger.error(f"Поле {field} не является строкой: {type(event_data[field])}")
-                return "Извините, произошла ошибка при обработке деталей события. Пожалуйста, попробуйте снова."
+    # Проверяем, что описание события не пустое
+    if not event_details.event_description or event_details.event_description.strip() == "":
+        event_details.event_description = f"Событие: {event_summary}"
 
+    # Проверка, что время указано
+    if start_time_str == "NONE" or not start_time_str:
+        return "Извините, мне нужно конкретное время для планирования события."
+
+    try:
+        date = datetime.datetime.strptime(date_str, "%Y-%m-%d").date()
+    except ValueError:
+        logger.warning(f"Некорректный формат даты: {date_str}, используем завтрашний день")
+        # Если не удалось распарсить дату, используем завтрашний день
+        tomorrow = datetime.datetime.now() + datetime.timedelta(days=1)
+        date = tomorrow.date()
+
+    start_time = datetime.datetime.combine(date, datetime.datetime.strptime(start_time_str, "%H:%M").time())
+    # Если не указано время окончания - прибавляем час
+    if end_time_str == "NONE" or not end_time_str:
+        end_time = start_time + datetime.timedelta(hours=1)
+    else:
         try:
-            event_details = EventDetails(**event_data)
-        except TypeError as e:
-            logger.error(f"Ошибка при создании EventDetails: {e}")
-            return "Извините, произошла ошибка при обработке деталей события. Пожалуйста, попробуйте снова."
-        except Exception as e:
-            logger.error(f"Неожиданная ошибка при создании EventDetails: {e}")
-            return "Извините, произошла ошибка при обработке деталей события. Пожалуйста, попробуйте снова."
+            end_time = datetime.datetime.combine(date, datetime.datetime.strptime(end_time_str, "%H:%M").time())
+        except ValueError:
+            logger.warning(f"Некорректное время окончания: {end_time_str}, используем время начала + 1 час")
+            end_time = start_time + datetime.timedelta(hours=1)
 
-        print(asdict(event_details))  # Вывод в виде словаря
+    event_details.start_time = start_time
+    event_details.end_time = end_time
+    return event_details
 
-        event_summary = event_details.event_summary
-        event_description = event_details.event_description
-        date_str = event_details.date
-        start_time_str = event_details.start_time
-        end_time_str = event_details.end_time
 
-        # Проверяем, что название события не пустое
-        if not event_summary or event_summary.strip() == "":
-            return "Извините, не удалось определить название события. Пожалуйста, укажите более подробную информацию."
+def _calendar_id_by_name(calendar_name, available_calendars):
+    if not calendar_name:
+        return DEFAULT_CALENDAR_ID
+    for calendar in available_calendars:
+        if calendar['summary'] == calendar_name.strip():
+            return calendar['id']
+    logger.warning(f"Календарь '{calendar_name}' не найден. Используется календарь по умолчанию.")
+    return DEFAULT_CALENDAR_ID
 
-        # Проверяем, что описание события не пустое
-        if not event_description or event_description.strip() == "":
-            event_description = f"Событие: {event_summary}"
 
-        # Проверка, что время указано
-        if start_time_str == "NONE" or not start_time_str:
-            return "Извините, мне нужно конкретное время для планирования события."
+def _calendar_cache_key(event_summary, event_description, available_calendars):
+    return make_key(normalize_text(event_summary), normalize_text(event_description),
+                    calendars_fingerprint(available_calendars))
 
-        try:
-            date = datetime.datetime.strptime(date_str, "%Y-%m-%d").date()
-        except ValueError:
-            logger.warning(f"Некорректный формат даты: {date_str}, используем завтрашний день")
-            # Если не удалось распарсить дату, используем завтрашний день
-            tomorrow = datetime.datetime.now() + datetime.timedelta(days=1)
-            date = tomorrow.date()
-        except Exception as exc:
-            logger.warning(f"Ошибка при парсинге даты: {exc}, используем завтрашний день")
-            # Если не удалось распарсить дату, используем завтрашний день
-            tomorrow = datetime.datetime.now() + datetime.timedelta(days=1)
-            date = tomorrow.date()
-
-        start_time = datetime.datetime.combine(date, datetime.datetime.strptime(start_time_str, "%H:%M").time())
-        # Если не указано время окончания - прибавляем час
-        if end_time_str == "NONE" or not end_time_str:
-            end_time = start_time + datetime.timedelta(hours=1)
-        else:
-            try:
-                end_time = datetime.datetime.combine(date, datetime.datetime.strptime(end_time_str, "%H:%M").time())
-            except ValueError:
-                logger.warning(f"Некорректное время окончания: {end_time_str}, используем время начала + 1 час")
-                end_time = start_time + datetime.timedelta(hours=1)
 
-        # 6. Получение списка календарей
-        creds = await get_creds(user_id)
-        if creds is None:
-            return "Извините, не удалось получить учетные данные."
+async def _get_available_calendars(user_id):
+    creds = await get_creds(user_id)
+    if creds is None:
+        return None
+    service = await service_pool.get(user_id, creds)
+    return await get_calendar_list(service, user_id)
+
+
+def _fast_parse(user_text):
+    """
+    Tries the rule-based parser before the LLM; returns ExtractedEvent or None.
+    """
+    if not settings.fast_parser_enabled:
+        return None
+    fields = parse_event_text(user_text, datetime.datetime.now(LOCAL_TIMEZONE))
+    metrics.inc("fast_parser.hits" if fields is not None else "fast_parser.misses")
+    parsed = metrics.counter("fast_parser.hits") + metrics.counter("fast_parser.misses")
+    metrics.set_gauge("fast_parser.hit_rate", metrics.counter("fast_parser.hits") / parsed)
+    if fields is None:
+        return None
+    logger.info(f"Текст события разобран без LLM: {fields}")
+    return ExtractedEvent(**fields)
+
 
-        service = build('calendar', 'v3', credentials=creds)
-        available_calendars = await get_calendar_list(service)
+def _date_bucket(user_text):
+    # Относительное время ("через 2 часа") зависит от текущей минуты, остальное - только от даты
+    now = datetime.datetime.now(LOCAL_TIMEZONE)
+    return now.strftime("%Y-%m-%d %H:%M") if RELATIVE_RE.search(user_text) else now.strftime("%Y-%m-%d")
+
+
+async def _extract_with_llm(user_text, available_calendars, on_partial=None):
+    """
+    Returns ExtractedEvent for the text from the LLM or the LLM cache, or an error message.
+    ``on_partial`` receives the partial LLM response while it is streamed.
+    """
+    cache_key = make_key(normalize_text(user_text), _date_bucket(user_text),
+                         calendars_fingerprint(available_calendars))
+    if settings.llm_cache_enabled:
+        cached = get_llm_cache().get("extraction", cache_key)
+        if cached is not None:
+            return ExtractedEvent.model_validate_json(cached)
+
+    prompt = _build_extraction_prompt(user_text, available_calendars)
+    try:
+        response = await invoke_llm(prompt, on_partial=on_partial)
+    except Exception as e:
+        logger.error(f"Ошибка при вызове LLM: {e}")
+        return "Извините, произошла ошибка при обработке вашего запроса. Пожалуйста, попробуйте снова."
+
+    extracted = _parse_extraction(response.content)
+    if settings.llm_cache_enabled and not isinstance(extracted, str):
+        get_llm_cache().set("extraction", cache_key, extracted.model_dump_json())
+    return extracted
+
+
+# Функция для обработки запроса пользователя, классификации и создания события (ОБЪЕДИНЕННАЯ)
+async def create_event_from_text(user_id, user_text, on_partial=None):
+    """
+    Extracts event details from free text and picks a calendar for the event.
+
+    Typical phrasing is parsed by rules (see fast_parser); only the rest goes to the LLM.
+    With ``settings.llm_single_call`` the calendar list is fetched first and the model returns
+    the fields and the chosen calendar in one response; otherwise the calendar is chosen by
+    choose_calendar. Rule-parsed text skips extraction and only costs the short calendar-only
+    request, which choose_calendar caches per event and calendar set. ``on_partial`` is passed to
+    invoke_llm to stream the extraction response.
+    """
+    try:
+        available_calendars = None
+        extracted = _fast_parse(user_text)
+        rule_parsed = extracted is not None
+        single_call = settings.llm_single_call and not rule_parsed
+        if not rule_parsed:
+            if single_call:
+                available_calendars = await _get_available_calendars(user_id)
+                if available_calendars is None:
+                    return "Извините, не удалось получить учетные данные."
+
+            extracted = await _extract_with_llm(user_text, available_calendars, on_partial)
+            if isinstance(extracted, str):
+                return extracted
+
+        event_details = _build_event_details(extracted)
+        if isinstance(event_details, str):
+            return event_details
+
+        # Получение списка календарей, если он не был получен до запроса к LLM
+        if available_calendars is None:
+            available_calendars = await _get_available_calendars(user_id)
+            if available_calendars is None:
+                return "Извините, не удалось получить учетные данные."
 
         if not available_calendars:
             logger.warning(f"Не найдено доступных календарей для пользователя {user_id}")
             # Используем календарь по умолчанию
             calendar_id = DEFAULT_CALENDAR_ID
-            calendar_name = 'Стандартный'
+        elif single_call:
+            calendar_id = _calendar_id_by_name(extracted.calendar, available_calendars)
         else:
-            # 7. Выбор подходящего календаря
-            calendar_id = await choose_calendar(event_summary, event_description, available_calendars)
-            print('\n')
-            print(calendar_id)
-            print('\n')
-            calendar_name = next((cal['summary'] for cal in available_calendars if cal['id'] == calendar_id),
-                                 "Стандартный")
-            if not calendar_id:
-                calendar_id = DEFAULT_CALENDAR_ID
-                calendar_name = 'Стандартный'
-        # 8. Создание события в выбранном календаре
-        print('\n')
-        print(calendar_id)
-        print(calendar_name)
-        print('12312312312312312312')
-        print('\n')
+            # Выбор подходящего календаря отдельным запросом
+            calendar_id = await choose_calendar(event_details.event_summary, event_details.event_description,
+                                                available_calendars)
+        calendar_name = next((cal['summary'] for cal in available_calendars if cal['id'] == calendar_id),
+                             "Стандартный")
+
         event_details.calendar_id = calendar_id
         event_details.calendar_name = calendar_name
-        event_details.start_time = start_time
-        event_details.end_time = end_time
         return event_details
-        # success = await create_google_calendar_event(user_id, event_summary, event_description, start_time, end_time, calendar_id)
-        #
-        # if success:
-        #     # Находим имя календаря по его ID
-        #     calendar_name = next((cal['summary'] for cal in available_calendars if cal['id'] == calendar_id), "Стандартный")
-        #     return f"Event created in {calendar_name} calendar."
-        # else:
-        #     return "Sorry, there was an error creating the event."
-
-    except json.JSONDecodeError as e:
-        logger.error(f"Ошибка декодирования JSON: {e}, Ответ: {response}")
-        return "Извините, я не смог понять детали. Пожалуйста, переформулируйте ваш запрос."
+
+    except HttpError as error:
+        if is_auth_error(error):
+            await handle_auth_error(user_id, error)
+            return "Ошибка аутентификации. Пожалуйста, повторно авторизуйте бота."
+        logger.error(f"Ошибка Google API при подготовке события: {error}")
+        return "Извините, произошла ошибка при обращении к Google Calendar. Пожалуйста, попробуйте снова."
     except ValueError as e:
         logger.error(f"Ошибка значения: {e}")
         return "Извините, я не смог разобрать дату или время. Пожалуйста, проверьте формат."
@@ -575,23 +1141,24 @@ async def choose_calendar(event_summary, event_description, available_calendars)
     calendar_names = [calendar['summary'] for calendar in available_calendars]
     calendar_list_str = "\n".join(calendar_names)
 
-    # 3. Создание LLM Chain
-    llm_chain = LLMChain(prompt=prompt, llm=llm)
-
-    # 4. Запуск LLM Chain
-    try:
-        chosen_calendar_name = llm_chain.run({"event_summary": event_summary, "event_description": event_description,
-                                              "calendar_list": calendar_list_str})
-        chosen_calendar_name = chosen_calendar_name.strip()  # Удалите лишние пробелы
-    except Exception as e:
-        logger.error(f"Ошибка при выборе календаря: {e}")
-        return DEFAULT_CALENDAR_ID
+    # 3. Запуск LLM, если выбор для такого события и набора календарей еще не закэширован
+    cache_key = _calendar_cache_key(event_summary, event_description, available_calendars)
+    chosen_calendar_name = get_llm_cache().get("calendar", cache_key) if settings.llm_cache_enabled else None
+    if chosen_calendar_name is None:
+        try:
+            response = await invoke_llm(prompt.format(event_summary=event_summary,
+                                                      event_description=event_description,
+                                                      calendar_list=calendar_list_str))
+            chosen_calendar_name = response.content.strip()  # Удалите лишние пробелы
+        except Exception as e:
+            logger.error(f"Ошибка при выборе календаря: {e}")
+            return DEFAULT_CALENDAR_ID
+        if settings.llm_cache_enabled and chosen_calendar_name:
+            get_llm_cache().set("calendar", cache_key, chosen_calendar_name)
 
     logger.info(f"Выбранное имя календаря: {chosen_calendar_name}")
 
-    # 5. Поиск calendar_id по имени
-    pprint(chosen_calendar_name)
-
+    # 4. Поиск calendar_id по имени
     if not chosen_calendar_name:
         return DEFAULT_CALENDAR_ID
     for calendar in available_calendars:
@@ -615,24 +1182,105 @@ async def check_token_health(user_id):
 
     if creds.expired:
         try:
-            creds.refresh(Request())
-            # Сохраняем обновленные учетные данные
-            token_path = os.path.join(USER_CREDENTIALS_DIR, f'token_{user_id}.json')
-            with open(token_path, 'w') as f:
-                f.write(creds.to_json())
+            await refresh_credentials(user_id, creds)
             return "refreshed", "Токен успешно обновлен"
         except Exception as e:
             logger.error(f"Не удалось обновить токен для пользователя {user_id}: {e}")
             return "refresh_failed", f"Не удалось обновить токен: {e}"
 
-    # Проверяем, сколько времени осталось до истечения токена
-    time_until_expiry = creds.expiry - datetime.datetime.now(pytz.utc)
+    if creds.expiry is None:
+        return "healthy", "Токен в порядке"
+
+    # Проверяем, сколько времени осталось до истечения токена (Credentials.expiry - наивное UTC)
+    time_until_expiry = creds.expiry - datetime.datetime.utcnow()
     if time_until_expiry.total_seconds() < 3600:  # Меньше часа
         return "expiring_soon", f"Токен истекает через {int(time_until_expiry.total_seconds() / 60)} минут"
 
     return "healthy", "Токен в порядке"
 
 
+async def _refresh_user_token(bot: Bot, user_id, start_at, semaphore):
+    await asyncio.sleep(max(0.0, start_at - asyncio.get_running_loop().time()))
+    async with semaphore:
+        creds = _credentials_cache.get(str(user_id)) or load_credentials(user_id)
+        if creds is None or not creds.refresh_token or creds.expiry is None:
+            return
+        # Токен могли уже обновить на пути запроса
+        if creds.expiry - datetime.datetime.utcnow() > datetime.timedelta(seconds=settings.token_refresh_ahead):
+            metrics.inc("token_refresher.skipped")
+            return
+        try:
+            await refresh_credentials(user_id, creds)
+            metrics.inc("token_refresher.refreshed")
+        except Exception as e:
+            metrics.inc("token_refresher.errors")
+            logger.error(f"Фоновое обновление токена пользователя {user_id} не удалось: {e}")
+            _drop_failed_token(user_id, creds, e)
+            if isinstance(e, RefreshError):
+                try:
+                    with bulk_sends():
+                        await bot.send_message(
+                            chat_id=user_id,
+                            text=f"⚠️ Обнаружена проблема с авторизацией: Не удалось обновить токен: {e}\n\n"
+                                 f"Пожалуйста, используйте /auth для повторной авторизации бота.",
+                            reply_markup=get_auth_keyboard()
+                        )
+                except Exception as e:
+                    logger.error(f"Не удалось отправить уведомление о проблеме с токеном пользователю {user_id}: {e}")
+
+
+# Доля интервала запуска, в которую укладываются все обновления: иначе следующий запуск задачи
+# пропускается планировщиком (max_instances=1) и токены на границе интервала могут истечь
+TOKEN_REFRESH_WINDOW = 0.5
+
+
+async def refresh_expiring_tokens(bot: Bot):
+    """
+    Refreshes access tokens shortly before they expire, so requests rarely wait for a refresh.
+
+    Tokens expiring within ``token_refresh_ahead`` seconds (plus one run interval) are refreshed
+    around ``expiry - token_refresh_ahead``, spread out to at most ``token_refresh_rate``
+    refreshes per second with ``token_refresh_concurrency`` in flight. All refreshes start within
+    the first ``TOKEN_REFRESH_WINDOW`` of the run interval (earlier than due if needed); tokens
+    that don't fit at that rate are left to the next run.
+    """
+    ahead = datetime.timedelta(seconds=settings.token_refresh_ahead)
+    now = datetime.datetime.utcnow()
+    user_ids = get_token_store().expiring_before(
+        now + ahead + datetime.timedelta(seconds=settings.token_refresh_interval))
+    metrics.set_gauge("token_refresher.due", len(user_ids))
+    if not user_ids:
+        return
+
+    loop = asyncio.get_running_loop()
+    semaphore = asyncio.Semaphore(max(1, settings.token_refresh_concurrency))
+    interval = 1 / settings.token_refresh_rate if settings.token_refresh_rate > 0 else 0.0
+    window = settings.token_refresh_interval * TOKEN_REFRESH_WINDOW
+    started = next_slot = loop.time()
+    deadline = started + window
+    tasks = []
+    deferred = 0
+    for user_id in user_ids:
+        try:
+            creds = _credentials_cache.get(str(user_id)) or load_credentials(user_id)
+        except Exception as e:
+            logger.error(f"Ошибка загрузки учетных данных из хранилища для пользователя {user_id}: {e}")
+            continue
+        if creds is None or creds.expiry is None:
+            continue
+        due_at = started + min(window, max(0.0, (creds.expiry - ahead - now).total_seconds()))
+        start_at = max(due_at, next_slot)
+        if start_at > deadline:
+            deferred += 1
+            continue
+        next_slot = start_at + interval
+        tasks.append(_refresh_user_token(bot, user_id, start_at, semaphore))
+    metrics.set_gauge("token_refresher.deferred", deferred)
+    if deferred:
+        logger.warning(f"Не успевают обновиться за запуск токенов: {deferred}, они перенесены на следующий запуск")
+    await asyncio.gather(*tasks)
+
+
 async def monitor_tokens(bot: Bot):
     """
     Мониторит состояние токенов всех пользователей и уведомляет о проблемах.
@@ -643,29 +1291,31 @@ async def monitor_tokens(bot: Bot):
         logger.info("Нет авторизованных пользователей для мониторинга токенов")
         return
 
-    for user_id in user_ids:
-        status, message = await check_token_health(user_id)
-
-        if status in ["no_token", "no_refresh", "refresh_failed"]:
-            try:
-                await bot.send_message(
-                    chat_id=user_id,
-                    text=f"⚠️ Обнаружена проблема с авторизацией: {message}\n\n"
-                         f"Пожалуйста, используйте /auth для повторной авторизации бота.",
-                    reply_markup=get_auth_keyboard()
-                )
-                logger.warning(f"Проблема со здоровьем токена для пользователя {user_id}: {message}")
-            except Exception as e:
-                logger.error(f"Не удалось отправить уведомление о проблеме с токеном пользователю {user_id}: {e}")
-
-        elif status == "expiring_soon":
-            try:
-                await bot.send_message(
-                    chat_id=user_id,
-                    text=f"ℹ️ Ваш токен авторизации скоро истечет: {message}\n\n"
-                         f"Бот автоматически обновит его, но если у вас возникнут проблемы, "
-                         f"пожалуйста, используйте /auth для повторной авторизации."
-                )
-                logger.info(f"Токен скоро истечет для пользователя {user_id}: {message}")
-            except Exception as e:
-                logger.error(f"Не удалось отправить уведомление об истечении токена пользователю {user_id}: {e}")
+    # Уведомления рассылаются всем пользователям и не должны задерживать ответы на сообщения
+    with bulk_sends():
+        for user_id in user_ids:
+            status, message = await check_token_health(user_id)
+
+            if status in ["no_token", "no_refresh", "refresh_failed"]:
+                try:
+                    await bot.send_message(
+                        chat_id=user_id,
+                        text=f"⚠️ Обнаружена проблема с авторизацией: {message}\n\n"
+                             f"Пожалуйста, используйте /auth для повторной авторизации бота.",
+                        reply_markup=get_auth_keyboard()
+                    )
+                    logger.warning(f"Проблема со здоровьем токена для пользователя {user_id}: {message}")
+                except Exception as e:
+                    logger.error(f"Не удалось отправить уведомление о проблеме с токеном пользователю {user_id}: {e}")
+
+            elif status == "expiring_soon":
+                try:
+                    await bot.send_message(
+                        chat_id=user_id,
+                        text=f"ℹ️ Ваш токен авторизации скоро истечет: {message}\n\n"
+                             f"Бот автоматически обновит его, но если у вас возникнут проблемы, "
+                             f"пожалуйста, используйте /auth для повторной авторизации."
+                    )
+                    logger.info(f"Токен скоро истечет для пользователя {user_id}: {message}")
+                except Exception as e:
+                    logger.error(f"Не удалось отправить уведомление об истечении токена пользователю {user_id}: {e}")
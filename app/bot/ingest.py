@@ -0,0 +1,27 @@
+import logging
+import random
+
+from aiogram.types import Update
+
+logger = logging.getLogger(__name__)
+
+# Сколько символов тела запроса писать в отладочный лог
+LOG_BODY_LIMIT = 500
+
+
+def parse_update(body: bytes, bot=None) -> Update:
+    """
+    Validates a webhook body straight from bytes, without building an intermediate dict.
+    """
+    return Update.model_validate_json(body, context={"bot": bot})
+
+
+def log_update(update: Update, body: bytes, sample_rate: float):
+    """
+    Logs a short summary of a sampled fraction of updates; the truncated body only at DEBUG.
+    """
+    if sample_rate > 0 and random.random() < sample_rate:
+        logger.info("Получен webhook: update_id=%s, тип=%s, %d байт",
+                    update.update_id, update.event_type, len(body))
+    if logger.isEnabledFor(logging.DEBUG):
+        logger.debug("Тело webhook: %s", body[:LOG_BODY_LIMIT].decode('utf-8', errors='replace'))
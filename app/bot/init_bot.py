@@ -1,8 +1,19 @@
 from aiogram import Bot, Dispatcher
 from aiogram.client.default import DefaultBotProperties
+from app.bot.fsm_storage import SQLiteStorage
+from app.bot.telegram_limiter import RateLimitMiddleware, TelegramRateLimiter
 from app.settings import get_settings
 
 settings = get_settings()
 
 bot = Bot(token=settings.bot_token, default=DefaultBotProperties(parse_mode=None))
-dp = Dispatcher()
+if settings.telegram_rate_limit_enabled:
+    # Лимит общий для бота, поэтому при нескольких процессах делится между ними
+    bot.session.middleware(RateLimitMiddleware(
+        TelegramRateLimiter(settings.telegram_rate / settings.workers,
+                            max(1, settings.telegram_burst // settings.workers),
+                            settings.telegram_chat_interval),
+        settings.telegram_retries
+    ))
+# При нескольких процессах состояние диалогов должно быть общим, иначе используется MemoryStorage
+dp = Dispatcher(storage=SQLiteStorage(settings.fsm_storage_path) if settings.workers > 1 else None)
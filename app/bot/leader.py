@@ -0,0 +1,64 @@
+import asyncio
+import fcntl
+import logging
+import os
+
+from app.bot.metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+
+class LeaderLock:
+    """
+    Leader election between worker processes on one host through an exclusive flock.
+
+    The lock is held for the lifetime of the process and released by the OS when the
+    process exits, so a follower takes over if the leader dies.
+    """
+
+    def __init__(self, path: str):
+        self._path = path
+        self._fd = None
+
+    @property
+    def is_leader(self) -> bool:
+        return self._fd is not None
+
+    def try_acquire(self) -> bool:
+        if self._fd is not None:
+            return True
+        directory = os.path.dirname(self._path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        fd = os.open(self._path, os.O_RDWR | os.O_CREAT, 0o644)
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            os.close(fd)
+            return False
+        os.ftruncate(fd, 0)
+        os.write(fd, str(os.getpid()).encode())
+        self._fd = fd
+        metrics.set_gauge("leader.is_leader", 1)
+        logger.info(f"Процесс {os.getpid()} стал ведущим")
+        return True
+
+    async def wait(self, interval: float) -> bool:
+        """
+        Retries the lock every ``interval`` seconds until this process becomes the leader.
+
+        Returns True if the lock was held by another process, i.e. this one took over.
+        """
+        metrics.set_gauge("leader.is_leader", 0)
+        took_over = False
+        while not self.try_acquire():
+            took_over = True
+            await asyncio.sleep(interval)
+        return took_over
+
+    def release(self):
+        if self._fd is not None:
+            fcntl.flock(self._fd, fcntl.LOCK_UN)
+            os.close(self._fd)
+            self._fd = None
+            metrics.set_gauge("leader.is_leader", 0)
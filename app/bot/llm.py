@@ -0,0 +1,95 @@
+import asyncio
+import logging
+import time
+
+from langchain_gigachat.chat_models import GigaChat
+
+from app.bot.metrics import metrics
+from app.settings import get_settings
+
+logger = logging.getLogger(__name__)
+
+settings = get_settings()
+
+try:
+    llm = GigaChat(
+        # Для авторизации запросов используйте ключ, полученный в проекте GigaChat API
+        credentials=settings.gigachat_key,
+        verify_ssl_certs=False,
+    )
+    logger.info("LLM успешно инициализирован")
+except Exception as e:
+    logger.error(f"Ошибка инициализации LLM: {e}")
+    # Создаем заглушку для LLM
+    llm = type('MockLLM', (), {'invoke': lambda self, prompt: type('MockResponse', (), {
+        'content': '{"event_summary": "Тестовое событие", "event_description": "Описание", "date": "2024-01-01", "start_time": "10:00", "end_time": "11:00"}'})()})()
+
+_semaphore = None
+_queued = 0
+_in_flight = 0
+
+
+def _get_semaphore():
+    global _semaphore
+    if _semaphore is None:
+        _semaphore = asyncio.Semaphore(max(1, settings.llm_concurrency))
+    return _semaphore
+
+
+async def _ainvoke(prompt):
+    if hasattr(llm, 'ainvoke'):
+        return await llm.ainvoke(prompt)
+    return await asyncio.get_running_loop().run_in_executor(None, llm.invoke, prompt)
+
+
+async def _astream(prompt, on_partial):
+    # Ответ собирается из фрагментов; после каждого фрагмента вызывается on_partial с текстом на данный момент.
+    # on_partial не ждет ничего медленного: слот LLM и таймаут запроса в это время заняты
+    response = None
+    async for chunk in llm.astream(prompt):
+        response = chunk if response is None else response + chunk
+        on_partial(response.content)
+    if response is None:
+        raise ValueError("LLM вернул пустой ответ")
+    return response
+
+
+async def invoke_llm(prompt, timeout=None, on_partial=None):
+    """
+    Calls GigaChat without blocking the event loop.
+
+    At most ``settings.llm_concurrency`` calls run at once, the rest wait in a queue; each call
+    is limited by ``timeout`` (``settings.llm_timeout`` by default) and raises asyncio.TimeoutError.
+    With ``on_partial`` the response is streamed and the callback is called with the text
+    received so far after every chunk; it must return at once (see EventPreview.on_partial).
+    """
+    global _queued, _in_flight
+    semaphore = _get_semaphore()
+    queued_at = time.monotonic()
+    _queued += 1
+    metrics.set_gauge("llm.queue_depth", _queued)
+    try:
+        await semaphore.acquire()
+    finally:
+        _queued -= 1
+        metrics.set_gauge("llm.queue_depth", _queued)
+
+    metrics.observe("llm.queue_wait", time.monotonic() - queued_at)
+    _in_flight += 1
+    metrics.set_gauge("llm.in_flight", _in_flight)
+    started = time.monotonic()
+    try:
+        if on_partial is not None and hasattr(llm, 'astream'):
+            call = _astream(prompt, on_partial)
+        else:
+            call = _ainvoke(prompt)
+        return await asyncio.wait_for(call, timeout or settings.llm_timeout)
+    except asyncio.TimeoutError:
+        metrics.inc("llm.timeouts")
+        logger.error(f"Превышено время ожидания ответа LLM ({timeout or settings.llm_timeout} с)")
+        raise
+    finally:
+        _in_flight -= 1
+        metrics.set_gauge("llm.in_flight", _in_flight)
+        metrics.observe("llm.latency", time.monotonic() - started)
+        semaphore.release()
@@ -0,0 +1,115 @@
+import hashlib
+import logging
+import os
+import sqlite3
+import threading
+import time
+from functools import lru_cache
+
+from cachetools import TTLCache
+
+from app.bot.metrics import metrics
+from app.settings import get_settings
+
+logger = logging.getLogger(__name__)
+
+settings = get_settings()
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS llm_cache (
+    namespace TEXT NOT NULL,
+    key TEXT NOT NULL,
+    value TEXT NOT NULL,
+    expires_at REAL NOT NULL,
+    PRIMARY KEY (namespace, key)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS llm_cache_by_expiration ON llm_cache (expires_at);
+"""
+
+# Через сколько записей в базу удалять из нее просроченные и лишние записи
+PRUNE_EVERY = 100
+
+
+def normalize_text(text: str) -> str:
+    return ' '.join(text.lower().replace('ё', 'е').split()).strip(' .,!?;')
+
+
+def calendars_fingerprint(available_calendars) -> str:
+    """
+    Identifies a user's calendar set: a cached choice is only valid for the same calendars.
+    """
+    if not available_calendars:
+        return ''
+    calendars = sorted((calendar['id'], calendar['summary']) for calendar in available_calendars)
+    return hashlib.sha256(repr(calendars).encode()).hexdigest()[:16]
+
+
+def make_key(*parts) -> str:
+    return hashlib.sha256('\x1f'.join(str(part) for part in parts).encode()).hexdigest()
+
+
+class LLMCache:
+    """
+    Bounded TTL cache of LLM results with an optional SQLite copy that survives restarts.
+
+    Values are strings (validated JSON or a calendar name), stored per namespace.
+    """
+
+    def __init__(self, maxsize: int, ttl: float, path: str = ''):
+        self._ttl = ttl
+        self._maxsize = maxsize
+        self._memory = TTLCache(maxsize=maxsize, ttl=ttl)
+        self._lock = threading.Lock()
+        self._connection = None
+        self._writes = 0
+        if path:
+            directory = os.path.dirname(path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            self._connection = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+            self._connection.execute("PRAGMA journal_mode=WAL")
+            self._connection.execute("PRAGMA synchronous=NORMAL")
+            self._connection.executescript(SCHEMA)
+
+    def get(self, namespace: str, key: str):
+        value = self._memory.get((namespace, key))
+        if value is None and self._connection is not None:
+            with self._lock:
+                row = self._connection.execute(
+                    "SELECT value FROM llm_cache WHERE namespace = ? AND key = ? AND expires_at > ?",
+                    (namespace, key, time.time())
+                ).fetchone()
+            if row is not None:
+                value = row[0]
+                self._memory[(namespace, key)] = value
+        metrics.inc(f"llm_cache.{namespace}.hits" if value is not None else f"llm_cache.{namespace}.misses")
+        return value
+
+    def set(self, namespace: str, key: str, value: str):
+        self._memory[(namespace, key)] = value
+        metrics.set_gauge("llm_cache.size", len(self._memory))
+        if self._connection is None:
+            return
+        now = time.time()
+        with self._lock:
+            self._connection.execute(
+                "INSERT OR REPLACE INTO llm_cache (namespace, key, value, expires_at) VALUES (?, ?, ?, ?)",
+                (namespace, key, value, now + self._ttl)
+            )
+            self._writes += 1
+            if self._writes % PRUNE_EVERY == 0:
+                self._prune(now)
+
+    def _prune(self, now: float):
+        self._connection.execute("DELETE FROM llm_cache WHERE expires_at <= ?", (now,))
+        # Сверх лимита удаляются записи, которые истекают раньше остальных
+        self._connection.execute(
+            "DELETE FROM llm_cache WHERE expires_at <= ("
+            "SELECT expires_at FROM llm_cache ORDER BY expires_at DESC LIMIT 1 OFFSET ?)",
+            (self._maxsize,)
+        )
+
+
+@lru_cache()
+def get_llm_cache() -> LLMCache:
+    return LLMCache(settings.llm_cache_size, settings.llm_cache_ttl, settings.llm_cache_path)
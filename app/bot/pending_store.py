@@ -0,0 +1,136 @@
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+from abc import ABC, abstractmethod
+from functools import lru_cache
+from typing import Optional
+
+from cachetools import TLRUCache
+
+from app.bot.metrics import metrics
+from app.settings import get_settings
+
+logger = logging.getLogger(__name__)
+
+settings = get_settings()
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS pending (
+    namespace TEXT NOT NULL,
+    key TEXT NOT NULL,
+    value TEXT NOT NULL,
+    expires_at REAL NOT NULL,
+    PRIMARY KEY (namespace, key)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS pending_by_expiration ON pending (expires_at);
+"""
+
+# Через сколько записей удалять из базы просроченные и лишние записи
+PRUNE_EVERY = 100
+
+
+class PendingStore(ABC):
+    """
+    Short-lived per-user state (event previews awaiting confirmation, OAuth requests).
+
+    Records are JSON-serializable dicts; each one expires after its own TTL.
+    """
+
+    @abstractmethod
+    def get(self, namespace: str, key) -> Optional[dict]:
+        ...
+
+    @abstractmethod
+    def set(self, namespace: str, key, value: dict, ttl: float):
+        ...
+
+    @abstractmethod
+    def pop(self, namespace: str, key) -> Optional[dict]:
+        ...
+
+
+class MemoryPendingStore(PendingStore):
+    """
+    In-process store: LRU-evicted beyond ``maxsize`` records, expired records are dropped.
+    """
+
+    def __init__(self, maxsize: int):
+        self._records = TLRUCache(maxsize=maxsize, ttu=lambda key, value, now: now + value[1], timer=time.monotonic)
+
+    def get(self, namespace, key):
+        record = self._records.get((namespace, str(key)))
+        return json.loads(record[0]) if record is not None else None
+
+    def set(self, namespace, key, value, ttl):
+        self._records[(namespace, str(key))] = (json.dumps(value), ttl)
+        metrics.set_gauge("pending_store.size", len(self._records))
+
+    def pop(self, namespace, key):
+        record = self._records.pop((namespace, str(key)), None)
+        metrics.set_gauge("pending_store.size", len(self._records))
+        return json.loads(record[0]) if record is not None else None
+
+
+class SQLitePendingStore(PendingStore):
+    """
+    SQLite-backed store, so pending confirmations survive a restart.
+    """
+
+    def __init__(self, path: str, maxsize: int):
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._maxsize = maxsize
+        self._writes = 0
+        self._lock = threading.Lock()
+        self._connection = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._connection.execute("PRAGMA journal_mode=WAL")
+        self._connection.execute("PRAGMA synchronous=NORMAL")
+        self._connection.executescript(SCHEMA)
+
+    def get(self, namespace, key):
+        with self._lock:
+            row = self._connection.execute(
+                "SELECT value FROM pending WHERE namespace = ? AND key = ? AND expires_at > ?",
+                (namespace, str(key), time.time())
+            ).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def set(self, namespace, key, value, ttl):
+        now = time.time()
+        with self._lock:
+            self._connection.execute(
+                "INSERT OR REPLACE INTO pending (namespace, key, value, expires_at) VALUES (?, ?, ?, ?)",
+                (namespace, str(key), json.dumps(value), now + ttl)
+            )
+            self._writes += 1
+            if self._writes % PRUNE_EVERY == 0:
+                self._connection.execute("DELETE FROM pending WHERE expires_at <= ?", (now,))
+                self._connection.execute(
+                    "DELETE FROM pending WHERE expires_at <= ("
+                    "SELECT expires_at FROM pending ORDER BY expires_at DESC LIMIT 1 OFFSET ?)",
+                    (self._maxsize,)
+                )
+
+    def pop(self, namespace, key):
+        with self._lock, self._connection:
+            self._connection.execute("BEGIN IMMEDIATE")
+            row = self._connection.execute(
+                "SELECT value, expires_at FROM pending WHERE namespace = ? AND key = ?", (namespace, str(key))
+            ).fetchone()
+            self._connection.execute("DELETE FROM pending WHERE namespace = ? AND key = ?", (namespace, str(key)))
+        if row is None or row[1] <= time.time():
+            return None
+        return json.loads(row[0])
+
+
+@lru_cache()
+def get_pending_store() -> PendingStore:
+    # Процессы должны видеть записи друг друга, поэтому при нескольких процессах хранилище всегда в SQLite
+    path = settings.pending_store_path or (settings.shared_pending_store_path if settings.workers > 1 else '')
+    if path:
+        return SQLitePendingStore(path, settings.pending_store_size)
+    return MemoryPendingStore(settings.pending_store_size)
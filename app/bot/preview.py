@@ -0,0 +1,134 @@
+import asyncio
+import logging
+import re
+import time
+
+from aiogram import types
+from aiogram.exceptions import TelegramBadRequest
+
+from app.bot.metrics import metrics
+from app.settings import get_settings
+
+logger = logging.getLogger(__name__)
+
+settings = get_settings()
+
+# Полностью полученные строковые поля в еще не законченном JSON-ответе LLM
+PARTIAL_FIELD_RE = re.compile(r'"(?P<name>\w+)"\s*:\s*"(?P<value>(?:[^"\\]|\\.)*)"')
+
+FIELD_LABELS = [
+    ('event_summary', 'Название'),
+    ('date', 'Дата'),
+    ('start_time', 'Начало'),
+    ('end_time', 'Окончание'),
+    ('calendar', 'Календарь'),
+]
+
+PLACEHOLDER_TEXT = "Обрабатываю ваш запрос..."
+
+
+def partial_fields(content: str) -> dict:
+    return {match.group('name'): match.group('value') for match in PARTIAL_FIELD_RE.finditer(content)}
+
+
+class EventPreview:
+    """
+    Placeholder message that is edited while the event is being extracted.
+
+    The placeholder is sent lazily: with the first partial LLM response or after
+    ``settings.preview_placeholder_delay`` seconds, so a quick result (rule-parsed text,
+    cached extraction, an error) is sent as a single message without an extra edit.
+    Edits are throttled to ``settings.preview_edit_interval`` seconds and skipped when the
+    text has not changed; errors from Telegram never interrupt event processing.
+    """
+
+    def __init__(self, message: types.Message):
+        self._message = message
+        self._placeholder = None
+        self._text = None
+        self._edited_at = 0.0
+        self._partial = None
+        self._flush_task = None
+        self._placeholder_task = None
+        self._placeholder_needed = asyncio.Event()
+        self._placeholder_sending = False
+
+    def start(self):
+        """
+        Schedules the placeholder; it is not sent if finish() comes first.
+        """
+        self._placeholder_task = asyncio.create_task(self._send_placeholder())
+
+    async def _send_placeholder(self):
+        try:
+            await asyncio.wait_for(self._placeholder_needed.wait(), settings.preview_placeholder_delay)
+        except asyncio.TimeoutError:
+            pass
+        self._placeholder_sending = True
+        try:
+            self._placeholder = await self._message.answer(PLACEHOLDER_TEXT)
+            self._text = PLACEHOLDER_TEXT
+        except Exception as e:
+            logger.warning(f"Не удалось отправить сообщение-заглушку: {e}")
+
+    def on_partial(self, content: str):
+        """
+        Remembers the latest partial LLM response; the edit is made by a separate task, so a slow
+        Telegram request never holds the LLM slot or eats into the LLM timeout.
+        """
+        if self._placeholder_task is None:
+            return
+        self._placeholder_needed.set()
+        self._partial = content
+        if self._flush_task is None or self._flush_task.done():
+            self._flush_task = asyncio.create_task(self._flush())
+
+    async def _flush(self):
+        await asyncio.shield(self._placeholder_task)
+        if self._placeholder is None:
+            return
+        # Между правками проходит не меньше preview_edit_interval; показывается последний полученный ответ
+        while self._partial is not None:
+            delay = settings.preview_edit_interval - (time.monotonic() - self._edited_at)
+            if delay > 0:
+                await asyncio.sleep(delay)
+            fields = partial_fields(self._partial)
+            self._partial = None
+            lines = [f"{label}: {fields[name]}" for name, label in FIELD_LABELS
+                     if fields.get(name, 'NONE') != 'NONE']
+            if lines:
+                await self._edit(PLACEHOLDER_TEXT + "\n\n" + "\n".join(lines))
+
+    async def finish(self, text: str, reply_markup=None):
+        """
+        Shows the final text; falls back to a new message if the placeholder can't be edited.
+        """
+        if self._flush_task is not None:
+            self._partial = None
+            self._flush_task.cancel()
+            await asyncio.gather(self._flush_task, return_exceptions=True)
+        if self._placeholder_task is not None:
+            # Заглушка, которая еще не отправляется, больше не нужна; уже отправляемую дожидаемся
+            if not self._placeholder_sending:
+                self._placeholder_task.cancel()
+            await asyncio.gather(self._placeholder_task, return_exceptions=True)
+        if self._placeholder is not None and await self._edit(text, reply_markup):
+            return
+        await self._message.answer(text, reply_markup=reply_markup)
+
+    async def _edit(self, text: str, reply_markup=None) -> bool:
+        if text == self._text and reply_markup is None:
+            return True
+        self._edited_at = time.monotonic()
+        try:
+            await self._placeholder.edit_text(text, reply_markup=reply_markup)
+        except TelegramBadRequest as e:
+            if "message is not modified" not in str(e):
+                logger.warning(f"Не удалось обновить предварительный просмотр: {e}")
+                return False
+        except Exception as e:
+            logger.warning(f"Не удалось обновить предварительный просмотр: {e}")
+            return False
+        self._text = text
+        metrics.inc("preview.edits")
+        return True
@@ -0,0 +1,110 @@
+import logging
+import secrets
+import time
+import uuid
+
+from app.bot.event_store import get_event_store
+from app.bot.google_io import execute
+from app.bot.metrics import metrics
+from app.settings import get_settings
+
+logger = logging.getLogger(__name__)
+
+settings = get_settings()
+
+# Через сколько секунд повторять попытку подписки на календарь, который ее не поддерживает
+WATCH_RETRY_INTERVAL = 24 * 3600
+
+# Календари, подписка на которые не удалась: (str(user_id), calendar_id) -> time.monotonic()
+_watch_failures = {}
+
+
+async def watch_calendar(service, user_id, calendar_id):
+    """
+    Creates an events.watch channel that notifies /calendar-push about changes in a calendar.
+    """
+    channel_id = uuid.uuid4().hex
+    token = secrets.token_urlsafe(16)
+    response = await execute(service.events().watch(calendarId=calendar_id, body={
+        'id': channel_id,
+        'type': 'web_hook',
+        'address': settings.calendar_push_url,
+        'token': token,
+        'params': {'ttl': str(settings.calendar_push_ttl)},
+    }))
+    expiration = int(response.get('expiration', 0)) / 1000 or time.time() + settings.calendar_push_ttl
+    get_event_store().add_channel(channel_id, user_id, calendar_id, response['resourceId'], token, expiration)
+    metrics.inc("push.channels_created")
+    logger.info(f"Создан канал уведомлений {channel_id} для календаря {calendar_id} пользователя {user_id}")
+
+
+async def stop_channel(service, channel_id, resource_id):
+    try:
+        await execute(service.channels().stop(body={'id': channel_id, 'resourceId': resource_id}))
+        metrics.inc("push.channels_stopped")
+    except Exception as e:
+        logger.warning(f"Не удалось остановить канал уведомлений {channel_id}: {e}")
+    get_event_store().delete_channel(channel_id)
+
+
+async def ensure_channels(service, user_id, calendar_ids):
+    """
+    Makes sure every calendar has a push channel that is not about to expire.
+
+    Channels close to expiration are renewed: a new channel is created first and the old one
+    is stopped afterwards, so no notification is lost in between.
+    """
+    store = get_event_store()
+    renew_at = time.time() + settings.calendar_push_renew_before
+    channels = store.user_channels(user_id)
+    watched = {calendar_id for _, calendar_id, _, expiration in channels if expiration > renew_at}
+
+    for calendar_id in calendar_ids:
+        if calendar_id in watched:
+            continue
+        failed_at = _watch_failures.get((str(user_id), calendar_id))
+        if failed_at is not None and time.monotonic() - failed_at < WATCH_RETRY_INTERVAL:
+            continue
+        try:
+            await watch_calendar(service, user_id, calendar_id)
+            _watch_failures.pop((str(user_id), calendar_id), None)
+        except Exception as e:
+            # Например, календари праздников не поддерживают уведомления, для них остается опрос
+            _watch_failures[(str(user_id), calendar_id)] = time.monotonic()
+            logger.warning(f"Не удалось подписаться на изменения календаря {calendar_id} "
+                           f"пользователя {user_id}: {e}")
+            continue
+        for channel_id, channel_calendar_id, resource_id, expiration in channels:
+            if channel_calendar_id == calendar_id:
+                await stop_channel(service, channel_id, resource_id)
+
+
+async def stop_user_channels(service, user_id):
+    for channel_id, _, resource_id, _ in get_event_store().user_channels(user_id):
+        await stop_channel(service, channel_id, resource_id)
+
+
+def handle_notification(channel_id, token, resource_id, resource_state):
+    """
+    Processes the headers of a Calendar push notification.
+
+    Returns ``(user_id, calendar_id)`` of the calendar that changed, or None when there is
+    nothing to refetch (sync handshake, unknown channel or a token mismatch).
+    """
+    channel = get_event_store().get_channel(channel_id) if channel_id else None
+    if channel is None:
+        metrics.inc("push.unknown_channel")
+        logger.warning(f"Уведомление для неизвестного канала {channel_id}")
+        return None
+
+    user_id, calendar_id, stored_resource_id, stored_token, _ = channel
+    if token != stored_token or resource_id != stored_resource_id:
+        metrics.inc("push.rejected")
+        logger.warning(f"Отклонено уведомление канала {channel_id}: токен или ресурс не совпадает")
+        return None
+
+    metrics.inc("push.notifications")
+    if resource_state == 'sync':
+        return None
+    get_event_store().mark_dirty(user_id, calendar_id)
+    return user_id, calendar_id
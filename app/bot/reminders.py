@@ -0,0 +1,165 @@
+import asyncio
+import heapq
+import itertools
+import logging
+import time
+from dataclasses import dataclass
+
+from app.bot.metrics import metrics
+from app.settings import get_settings
+
+logger = logging.getLogger(__name__)
+
+settings = get_settings()
+
+
+@dataclass(frozen=True)
+class Reminder:
+    user_id: str
+    calendar_id: str
+    calendar_name: str
+    event_id: str
+    event_summary: str
+    start_at: float
+    offset_minutes: int
+
+    @property
+    def fire_at(self) -> float:
+        return self.start_at - self.offset_minutes * 60
+
+    @property
+    def key(self):
+        return self.user_id, self.calendar_id, self.event_id, self.start_at, self.offset_minutes
+
+
+class ReminderScheduler:
+    """
+    Min-heap of upcoming reminder instants built from fetched events.
+
+    The run loop sleeps until the earliest reminder is due, so a reminder goes out within
+    seconds of its instant and the work per wake-up is proportional to the due reminders.
+    Outdated heap entries (event moved or deleted) are skipped lazily when popped.
+    """
+
+    def __init__(self):
+        self._heap = []
+        self._counter = itertools.count()
+        # user_id -> {(calendar_id, event_id, offset_minutes): Reminder}
+        self._reminders = {}
+        # Ключи отправленных напоминаний, хранятся до начала события: Reminder.key -> start_at
+        self._delivered = {}
+        self._wakeup = asyncio.Event()
+        self._task = None
+
+    def update_user(self, user_id, events):
+        """
+        Replaces the reminders of a user with the ones derived from ``events``:
+        ``(calendar_id, calendar_name, event_id, event_summary, start_utc)`` tuples.
+        """
+        # Напоминания отправляет только процесс, в котором запущен цикл доставки (ведущий)
+        if self._task is None:
+            return
+        user_id = str(user_id)
+        now = time.time()
+        reminders = {}
+        for calendar_id, calendar_name, event_id, event_summary, start_utc in events:
+            for offset_minutes in settings.reminder_offset_minutes:
+                reminder = Reminder(user_id, calendar_id, calendar_name, event_id, event_summary,
+                                    start_utc.timestamp(), offset_minutes)
+                if reminder.key in self._delivered:
+                    continue
+                # Чуть опоздавшие напоминания (например, после перезапуска) еще отправляются
+                if reminder.fire_at >= now - settings.reminder_grace_seconds and reminder.start_at > now:
+                    reminders[(calendar_id, event_id, offset_minutes)] = reminder
+
+        previous = self._reminders.get(user_id, {})
+        earliest = self._heap[0][0] if self._heap else None
+        for key, reminder in reminders.items():
+            if previous.get(key) != reminder:
+                heapq.heappush(self._heap, (reminder.fire_at, next(self._counter), reminder))
+        if reminders:
+            self._reminders[user_id] = reminders
+        else:
+            self._reminders.pop(user_id, None)
+        self._compact()
+        metrics.set_gauge("reminders.scheduled", sum(len(items) for items in self._reminders.values()))
+
+        if self._heap and (earliest is None or self._heap[0][0] < earliest):
+            self._wakeup.set()
+
+    def user_ids(self):
+        return set(self._reminders)
+
+    def remove_user(self, user_id):
+        self._reminders.pop(str(user_id), None)
+        self._compact()
+
+    def _compact(self):
+        # Устаревшие записи удаляются лениво; если их стало слишком много, куча перестраивается
+        now = time.time()
+        self._delivered = {key: start_at for key, start_at in self._delivered.items() if start_at > now}
+        live = sum(len(items) for items in self._reminders.values())
+        if len(self._heap) > 2 * live + 64:
+            self._heap = [item for item in self._heap if self._is_current(item[2])]
+            heapq.heapify(self._heap)
+
+    def _is_current(self, reminder):
+        key = (reminder.calendar_id, reminder.event_id, reminder.offset_minutes)
+        return self._reminders.get(reminder.user_id, {}).get(key) == reminder
+
+    def _pop_due(self, now):
+        due = []
+        while self._heap and self._heap[0][0] <= now:
+            _, _, reminder = heapq.heappop(self._heap)
+            if not self._is_current(reminder):
+                continue
+            user_reminders = self._reminders[reminder.user_id]
+            del user_reminders[(reminder.calendar_id, reminder.event_id, reminder.offset_minutes)]
+            if not user_reminders:
+                del self._reminders[reminder.user_id]
+            self._delivered[reminder.key] = reminder.start_at
+            due.append(reminder)
+        return due
+
+    async def _run(self, send):
+        while True:
+            now = time.time()
+            due = self._pop_due(now)
+            if due:
+                metrics.inc("reminders.due", len(due))
+                for reminder, result in zip(due, await asyncio.gather(*(send(reminder) for reminder in due),
+                                                                        return_exceptions=True)):
+                    metrics.observe("reminders.delivery_lag", max(0.0, time.time() - reminder.fire_at))
+                    if isinstance(result, Exception):
+                        # Неотправленное напоминание снова попадет в расписание при следующем обновлении
+                        self._delivered.pop(reminder.key, None)
+                        metrics.inc("reminders.send_errors")
+                        logger.error(f"Не удалось отправить напоминание пользователю {reminder.user_id} "
+                                     f"о событии {reminder.event_summary}: {result}")
+                continue
+
+            self._wakeup.clear()
+            timeout = self._heap[0][0] - now if self._heap else None
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout)
+            except asyncio.TimeoutError:
+                pass
+
+    def start(self, send):
+        """
+        Starts the delivery loop; ``send`` is an async callable taking a Reminder.
+        """
+        if self._task is None:
+            self._task = asyncio.create_task(self._run(send))
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+
+reminder_scheduler = ReminderScheduler()
@@ -0,0 +1,75 @@
+import json
+import logging
+
+from cachetools import TTLCache
+
+from app.bot.google_io import run_google
+from app.bot.metrics import metrics
+from app.settings import get_settings
+
+logger = logging.getLogger(__name__)
+
+try:
+    from googleapiclient import discovery_cache
+    from googleapiclient.discovery import build, build_from_document
+except ImportError as e:
+    logger.error(f"Ошибка импорта googleapiclient: {e}")
+    discovery_cache = None
+    build = build_from_document = None
+
+settings = get_settings()
+
+_discovery_document = None
+
+
+def _get_discovery_document():
+    # Документ discovery Calendar API разбирается один раз на процесс
+    global _discovery_document
+    if _discovery_document is None and discovery_cache is not None:
+        document = discovery_cache.get_static_doc('calendar', 'v3')
+        if document:
+            _discovery_document = json.loads(document)
+    return _discovery_document
+
+
+def _build_service(creds):
+    document = _get_discovery_document()
+    if document is None:
+        return build('calendar', 'v3', credentials=creds)
+    return build_from_document(document, credentials=creds)
+
+
+class CalendarServicePool:
+    """
+    Process-wide LRU/TTL pool of Calendar service objects keyed by user.
+
+    A pooled service is reused while the user's credentials stay the same and is rebuilt
+    when the access or refresh token changes.
+    """
+
+    def __init__(self, maxsize: int, ttl: float):
+        self._services = TTLCache(maxsize=maxsize, ttl=ttl)
+
+    @staticmethod
+    def _fingerprint(creds):
+        return creds.refresh_token, creds.token
+
+    async def get(self, user_id, creds):
+        key = str(user_id)
+        entry = self._services.get(key)
+        if entry is not None and entry[0] == self._fingerprint(creds):
+            metrics.inc("service_pool.hits")
+            return entry[1]
+
+        metrics.inc("service_pool.misses")
+        service = await run_google(_build_service, creds)
+        self._services[key] = (self._fingerprint(creds), service)
+        metrics.set_gauge("service_pool.size", len(self._services))
+        return service
+
+    def invalidate(self, user_id):
+        self._services.pop(str(user_id), None)
+        metrics.set_gauge("service_pool.size", len(self._services))
+
+
+service_pool = CalendarServicePool(settings.service_pool_size, settings.service_pool_ttl)
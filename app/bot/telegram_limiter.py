@@ -0,0 +1,141 @@
+import asyncio
+import contextvars
+import heapq
+import itertools
+import logging
+import time
+from contextlib import contextmanager
+
+from aiogram.client.session.middlewares.base import BaseRequestMiddleware
+from aiogram.exceptions import TelegramRetryAfter
+
+from app.bot.metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+# Приоритеты исходящих сообщений: ответы пользователям отправляются раньше массовых рассылок
+INTERACTIVE = 0
+BULK = 1
+
+send_priority = contextvars.ContextVar('send_priority', default=INTERACTIVE)
+
+# Сколько записей о последней отправке в чат хранить, прежде чем удалять устаревшие
+CHAT_PACING_LIMIT = 10000
+
+
+@contextmanager
+def bulk_sends():
+    """
+    Marks Telegram requests made inside the block (reminders, notifications) as bulk.
+    """
+    token = send_priority.set(BULK)
+    try:
+        yield
+    finally:
+        send_priority.reset(token)
+
+
+class TelegramRateLimiter:
+    """
+    Global token bucket plus per-chat pacing for outgoing Telegram requests.
+
+    When the bucket is empty, waiters are served in priority order (interactive before bulk),
+    and in arrival order within a priority.
+    """
+
+    def __init__(self, rate: float, burst: int, chat_interval: float):
+        self._rate = rate
+        self._burst = max(1, burst)
+        self._chat_interval = chat_interval
+        self._tokens = float(self._burst)
+        self._updated = time.monotonic()
+        self._waiters = []
+        self._counter = itertools.count()
+        self._dispatcher = None
+        # chat_id -> time.monotonic(), когда в чат можно отправить следующее сообщение
+        self._chat_next = {}
+
+    def _refill(self, now):
+        self._tokens = min(self._burst, self._tokens + (now - self._updated) * self._rate)
+        self._updated = now
+
+    async def _wait_chat(self, chat_id):
+        if chat_id is None:
+            return
+        now = time.monotonic()
+        if len(self._chat_next) > CHAT_PACING_LIMIT:
+            self._chat_next = {chat: at for chat, at in self._chat_next.items() if at > now}
+        start = max(now, self._chat_next.get(chat_id, 0.0))
+        self._chat_next[chat_id] = start + self._chat_interval
+        if start > now:
+            await asyncio.sleep(start - now)
+
+    async def acquire(self, chat_id, priority: int):
+        await self._wait_chat(chat_id)
+        now = time.monotonic()
+        self._refill(now)
+        if not self._waiters and self._tokens >= 1:
+            self._tokens -= 1
+            return
+        future = asyncio.get_running_loop().create_future()
+        heapq.heappush(self._waiters, (priority, next(self._counter), future))
+        metrics.set_gauge("telegram.waiting", len(self._waiters))
+        if self._dispatcher is None or self._dispatcher.done():
+            self._dispatcher = asyncio.create_task(self._dispatch())
+        await future
+
+    async def _dispatch(self):
+        while self._waiters:
+            self._refill(time.monotonic())
+            while self._waiters and self._tokens >= 1:
+                _, _, future = heapq.heappop(self._waiters)
+                if future.done():
+                    continue
+                self._tokens -= 1
+                future.set_result(None)
+            metrics.set_gauge("telegram.waiting", len(self._waiters))
+            if self._waiters:
+                await asyncio.sleep((1 - self._tokens) / self._rate)
+
+    def pause(self, chat_id, seconds: float):
+        """
+        Holds back requests to a chat after a flood-control error.
+        """
+        self._chat_next[chat_id] = max(self._chat_next.get(chat_id, 0.0), time.monotonic() + seconds)
+
+
+class RateLimitMiddleware(BaseRequestMiddleware):
+    """
+    Bot session middleware that paces requests addressed to a chat and retries them
+    after TelegramRetryAfter.
+    """
+
+    def __init__(self, limiter: TelegramRateLimiter, retries: int):
+        self._limiter = limiter
+        self._retries = retries
+
+    async def __call__(self, make_request, bot, method):
+        # Ограничиваются только запросы, адресованные чату (отправка и редактирование сообщений)
+        chat_id = getattr(method, 'chat_id', None)
+        if chat_id is None:
+            return await make_request(bot, method)
+
+        priority = send_priority.get()
+        name = "bulk" if priority == BULK else "interactive"
+        queued_at = time.monotonic()
+        for attempt in range(self._retries + 1):
+            await self._limiter.acquire(chat_id, priority)
+            if attempt == 0:
+                metrics.observe(f"telegram.{name}.queue_wait", time.monotonic() - queued_at)
+            started = time.monotonic()
+            try:
+                response = await make_request(bot, method)
+            except TelegramRetryAfter as e:
+                metrics.inc("telegram.retry_after")
+                if attempt == self._retries:
+                    raise
+                logger.warning(f"Ограничение частоты Telegram для чата {chat_id}, повтор через {e.retry_after} с")
+                self._limiter.pause(chat_id, e.retry_after)
+                continue
+            metrics.observe(f"telegram.{name}.send_latency", time.monotonic() - started)
+            return response
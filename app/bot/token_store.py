@@ -0,0 +1,240 @@
+import datetime
+import json
+import logging
+import os
+import sqlite3
+import tempfile
+import threading
+from abc import ABC, abstractmethod
+from functools import lru_cache
+from typing import List, Optional
+
+from app.settings import get_settings
+
+logger = logging.getLogger(__name__)
+
+settings = get_settings()
+
+USER_CREDENTIALS_DIR = "/service/user_credentials"
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS tokens (
+    user_id TEXT PRIMARY KEY,
+    token TEXT NOT NULL,
+    expiry TEXT,
+    updated_at TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS tokens_by_expiry ON tokens (expiry);
+"""
+
+# Формат времени истечения токена: наивное UTC, как Credentials.expiry; строки сортируются как время
+TIME_FORMAT = '%Y-%m-%dT%H:%M:%S'
+
+
+def _format_expiry(expiry: Optional[datetime.datetime]) -> Optional[str]:
+    return expiry.strftime(TIME_FORMAT) if expiry is not None else None
+
+
+def write_atomic(path: str, data: str):
+    """
+    Writes a file through a temporary file and os.replace, so readers never see a partial token.
+    """
+    directory = os.path.dirname(path) or '.'
+    fd, tmp_path = tempfile.mkstemp(dir=directory, prefix='.tmp_')
+    try:
+        with os.fdopen(fd, 'w') as f:
+            f.write(data)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, path)
+    except Exception:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+
+class TokenStore(ABC):
+    """
+    Storage of users' OAuth tokens (``Credentials.to_json()`` strings).
+    """
+
+    @abstractmethod
+    def load(self, user_id) -> Optional[str]:
+        ...
+
+    @abstractmethod
+    def save(self, user_id, token: str, expiry: Optional[datetime.datetime]):
+        ...
+
+    @abstractmethod
+    def delete(self, user_id) -> bool:
+        ...
+
+    @abstractmethod
+    def user_ids(self) -> List[int]:
+        ...
+
+    @abstractmethod
+    def updated_at(self, user_id) -> Optional[str]:
+        """
+        Returns a marker that changes on every save of the user's token, or None without a token.
+        """
+
+    @abstractmethod
+    def expiring_before(self, before: datetime.datetime) -> List[int]:
+        """
+        Returns users whose access token expires before ``before`` (naive UTC).
+        """
+
+
+class FileTokenStore(TokenStore):
+    """
+    One ``token_{user_id}.json`` file per user in a directory.
+    """
+
+    def __init__(self, directory: str):
+        self._directory = directory
+
+    def _path(self, user_id):
+        return os.path.join(self._directory, f'token_{user_id}.json')
+
+    def load(self, user_id):
+        try:
+            with open(self._path(user_id)) as f:
+                return f.read()
+        except FileNotFoundError:
+            return None
+
+    def save(self, user_id, token, expiry):
+        os.makedirs(self._directory, exist_ok=True)
+        write_atomic(self._path(user_id), token)
+
+    def delete(self, user_id):
+        try:
+            os.remove(self._path(user_id))
+            return True
+        except FileNotFoundError:
+            return False
+
+    def updated_at(self, user_id):
+        try:
+            return str(os.stat(self._path(user_id)).st_mtime_ns)
+        except FileNotFoundError:
+            return None
+
+    def user_ids(self):
+        user_ids = []
+
+        # Проверяем, существует ли директория
+        if not os.path.exists(self._directory):
+            logger.warning(f"Директория учетных данных не существует: {self._directory}")
+            return user_ids
+
+        for filename in os.listdir(self._directory):
+            if filename.startswith('token_') and filename.endswith('.json'):
+                try:
+                    user_id = int(filename.split('_')[1].split('.')[0])
+                    user_ids.append(user_id)
+                except ValueError:
+                    logger.warning(f"Некорректное имя файла в директории учетных данных: {filename}")
+        return user_ids
+
+    def expiring_before(self, before):
+        expiring = []
+        for user_id in self.user_ids():
+            try:
+                expiry = json.loads(self.load(user_id) or '{}').get('expiry')
+            except ValueError:
+                continue
+            if expiry and expiry[:19] < _format_expiry(before):
+                expiring.append(user_id)
+        return expiring
+
+
+class SQLiteTokenStore(TokenStore):
+    """
+    Tokens in one SQLite table (WAL) with an index on the token expiry.
+    """
+
+    def __init__(self, path: str):
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._lock = threading.Lock()
+        self._connection = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._connection.execute("PRAGMA journal_mode=WAL")
+        self._connection.execute("PRAGMA synchronous=NORMAL")
+        self._connection.executescript(SCHEMA)
+
+    def load(self, user_id):
+        with self._lock:
+            row = self._connection.execute("SELECT token FROM tokens WHERE user_id = ?", (str(user_id),)).fetchone()
+        return row[0] if row else None
+
+    def save(self, user_id, token, expiry):
+        with self._lock:
+            self._connection.execute(
+                "INSERT OR REPLACE INTO tokens (user_id, token, expiry, updated_at) VALUES (?, ?, ?, ?)",
+                (str(user_id), token, _format_expiry(expiry), datetime.datetime.utcnow().isoformat())
+            )
+
+    def delete(self, user_id):
+        with self._lock:
+            cursor = self._connection.execute("DELETE FROM tokens WHERE user_id = ?", (str(user_id),))
+        return cursor.rowcount > 0
+
+    def updated_at(self, user_id):
+        with self._lock:
+            row = self._connection.execute(
+                "SELECT updated_at FROM tokens WHERE user_id = ?", (str(user_id),)
+            ).fetchone()
+        return row[0] if row else None
+
+    def user_ids(self):
+        with self._lock:
+            rows = self._connection.execute("SELECT user_id FROM tokens").fetchall()
+        return [int(user_id) for user_id, in rows]
+
+    def expiring_before(self, before):
+        with self._lock:
+            rows = self._connection.execute(
+                "SELECT user_id FROM tokens WHERE expiry < ? ORDER BY expiry", (_format_expiry(before),)
+            ).fetchall()
+        return [int(user_id) for user_id, in rows]
+
+
+def migrate_directory(directory: str, store: TokenStore) -> int:
+    """
+    Moves ``token_{user_id}.json`` files into ``store`` once.
+
+    Imported files are renamed to ``*.migrated`` so later runs don't overwrite refreshed
+    tokens with stale copies. Returns the number of migrated users.
+    """
+    if not os.path.isdir(directory):
+        return 0
+    migrated = 0
+    for user_id in FileTokenStore(directory).user_ids():
+        path = os.path.join(directory, f'token_{user_id}.json')
+        try:
+            with open(path) as f:
+                token = f.read()
+            expiry = json.loads(token).get('expiry')
+            expiry = datetime.datetime.strptime(expiry[:19], TIME_FORMAT) if expiry else None
+            if store.load(user_id) is None:
+                store.save(user_id, token, expiry)
+            os.replace(path, path + '.migrated')
+            migrated += 1
+        except Exception as e:
+            logger.error(f"Не удалось перенести токен пользователя {user_id} из {path}: {e}")
+    if migrated:
+        logger.info(f"Перенесено токенов из {directory}: {migrated}")
+    return migrated
+
+
+@lru_cache()
+def get_token_store() -> TokenStore:
+    if settings.token_store_backend == 'sqlite':
+        store = SQLiteTokenStore(settings.token_store_path)
+        migrate_directory(USER_CREDENTIALS_DIR, store)
+        return store
+    return FileTokenStore(USER_CREDENTIALS_DIR)
@@ -0,0 +1,102 @@
+import asyncio
+import logging
+import time
+from collections import deque
+
+from aiogram.dispatcher.middlewares.user_context import UserContextMiddleware
+
+from app.bot.metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+
+def chat_key(update):
+    """
+    Returns the chat (or, without a chat, the user) an update belongs to.
+    """
+    context = UserContextMiddleware.resolve_event_context(update)
+    return context.chat_id or context.user_id or update.update_id
+
+
+class UpdateQueue:
+    """
+    Bounded queue of Telegram updates processed by a fixed pool of workers.
+
+    The webhook only validates and enqueues an update, so Telegram gets its response
+    without waiting for slow handlers (LLM, Google API). Updates are grouped by ``key``
+    (the chat) and the shared queue holds chats, not updates: a chat is queued at most once
+    and is processed by one worker at a time, so FSM state and replies are never raced,
+    while a slow chat only delays its own updates and the other workers keep serving the rest.
+    """
+
+    def __init__(self, maxsize: int, workers: int, key=chat_key):
+        self._maxsize = maxsize
+        self._workers_count = max(1, workers)
+        self._key = key
+        self._queue = None
+        # Необработанные обновления каждого чата, который стоит в очереди или обрабатывается
+        self._chats = {}
+        self._workers = []
+        self._size = 0
+
+    def start(self, process):
+        """
+        Starts the workers; ``process`` is an async callable taking one update.
+        """
+        self._queue = asyncio.Queue()
+        self._workers = [asyncio.create_task(self._work(process)) for _ in range(self._workers_count)]
+
+    def put(self, update) -> bool:
+        """
+        Enqueues an update; returns False when the queue is full.
+        """
+        if 0 < self._maxsize <= self._size:
+            metrics.inc("webhook.queue_full")
+            return False
+        key = self._key(update)
+        pending = self._chats.get(key)
+        if pending is None:
+            pending = self._chats[key] = deque()
+            self._queue.put_nowait(key)
+        pending.append((time.monotonic(), update))
+        self._size += 1
+        metrics.set_gauge("webhook.queue_depth", self._size)
+        return True
+
+    async def _work(self, process):
+        while True:
+            key = await self._queue.get()
+            pending = self._chats[key]
+            enqueued_at, update = pending.popleft()
+            self._size -= 1
+            metrics.set_gauge("webhook.queue_depth", self._size)
+            metrics.observe("webhook.queue_wait", time.monotonic() - enqueued_at)
+            try:
+                with metrics.timer("webhook.processing"):
+                    await process(update)
+            except Exception as e:
+                metrics.inc("webhook.errors")
+                logger.error(f"Ошибка при обработке webhook: {e}")
+            finally:
+                # Следующее обновление чата встает в конец общей очереди, чтобы чат с длинной
+                # очередью не занимал воркер целиком
+                if pending:
+                    self._queue.put_nowait(key)
+                else:
+                    del self._chats[key]
+                self._queue.task_done()
+
+    async def drain(self, timeout: float):
+        """
+        Waits up to ``timeout`` seconds for queued updates to be processed, then stops the workers.
+        """
+        if self._queue is None:
+            return
+        try:
+            await asyncio.wait_for(self._queue.join(), timeout)
+        except asyncio.TimeoutError:
+            logger.warning(f"Не обработано обновлений при остановке: {self._size}")
+        for worker in self._workers:
+            worker.cancel()
+        await asyncio.gather(*self._workers, return_exceptions=True)
+        self._workers = []
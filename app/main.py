@@ -1,29 +1,56 @@
-from aiogram.types import Update
 from apscheduler.schedulers.asyncio import AsyncIOScheduler
 from fastapi import FastAPI, Request, HTTPException
-from starlette.responses import HTMLResponse
+from starlette.responses import HTMLResponse, Response
 from uvicorn import run
 from fastapi.middleware.cors import CORSMiddleware
 from contextlib import asynccontextmanager
+from functools import partial
+import asyncio
+import datetime
 import logging
 
-from app.bot.handlers import send_event_reminders, save_credentials, monitor_tokens
+from app.bot.handlers import send_event_reminders, save_credentials, monitor_tokens, renew_push_channels, \
+    sync_user_calendars, send_reminder, refresh_expiring_tokens
 from app.bot.init_bot import dp, bot
-from app.bot.bot import start_bot, stop_bot, user_router
+from app.bot.bot import start_bot, stop_bot, user_router, create_auth_flow
+from app.bot.google_io import run_google, shutdown_executor
+from app.bot.ingest import log_update, parse_update
+from app.bot.leader import LeaderLock
+from app.bot.metrics import metrics, monitor_loop_lag
+from app.bot.pending_store import get_pending_store
+from app.bot.push_channels import handle_notification
+from app.bot.reminders import reminder_scheduler
+from app.bot.update_queue import UpdateQueue
 import urllib.parse
 from app.settings import get_settings
 
 scheduler = AsyncIOScheduler()
+# Фоновые задачи синхронизации, запущенные уведомлениями календаря
+background_tasks = set()
 logger = logging.getLogger(__name__)
 logging.basicConfig(level=logging.INFO)
 
 settings = get_settings()
 
-@asynccontextmanager
-async def lifespan(app: FastAPI):
-    logger.info("Запуск приложения...")
-    dp.include_router(user_router)
-    logger.info("Роутер подключен")
+update_queue = UpdateQueue(settings.webhook_queue_size, settings.webhook_workers)
+
+leader = LeaderLock(settings.leader_lock_path)
+
+
+def is_scheduler_owner():
+    """
+    Tells whether this process runs the scheduled jobs (always true with a single worker).
+    """
+    return settings.workers <= 1 or leader.is_leader
+
+
+async def start_leader(drop_pending_updates=True):
+    """
+    Sets the webhook and starts the scheduled jobs; runs in exactly one process.
+
+    A follower taking over passes ``drop_pending_updates=False``: updates queued by Telegram
+    while the previous leader was going away still have to be processed.
+    """
     webhook_url = settings.webhook_url
     logger.info(f"Настройка webhook: {webhook_url}")
     logger.info(f"Bot token: {settings.bot_token[:10]}...")
@@ -32,21 +59,70 @@ async def lifespan(app: FastAPI):
         await bot.set_webhook(
             url=webhook_url,
             allowed_updates=dp.resolve_used_update_types(),
-            drop_pending_updates=True
+            drop_pending_updates=drop_pending_updates
         )
         logger.info("Webhook настроен успешно")
     except Exception as e:
         logger.error(f"Ошибка при настройке webhook: {e}")
     await start_bot()
-    scheduler.add_job(send_event_reminders, "interval", minutes=int(settings.default_remind_time), args=(bot,))
+    reminder_scheduler.start(partial(send_reminder, bot))
+    scheduler.add_job(send_event_reminders, "interval", minutes=int(settings.default_remind_time), args=(bot,),
+                      next_run_time=datetime.datetime.now())  # Сразу заполняем расписание напоминаний
     scheduler.add_job(monitor_tokens, "interval", hours=6, args=(bot,))  # Проверяем токены каждые 6 часов
+    if settings.token_refresh_enabled:
+        # Обновляем токены заранее, равномерно по времени
+        scheduler.add_job(refresh_expiring_tokens, "interval", seconds=settings.token_refresh_interval, args=(bot,),
+                          next_run_time=datetime.datetime.now())
+    if settings.calendar_push_enabled:
+        scheduler.add_job(renew_push_channels, "interval", hours=1)  # Продлеваем каналы уведомлений календаря
     scheduler.start()
     logger.info("Планировщик запущен")
-    yield
-    logger.info("Остановка приложения...")
+
+
+async def stop_leader():
+    await reminder_scheduler.stop()
     await stop_bot()
-    scheduler.shutdown()
+    # Ведущий мог остановиться, не успев запустить планировщик
+    if scheduler.running:
+        scheduler.shutdown()
     await bot.delete_webhook()
+
+
+async def lead():
+    # Остальные процессы ждут, пока ведущий не завершится, и тогда один из них занимает его место
+    took_over = await leader.wait(settings.leader_retry_interval)
+    await start_leader(drop_pending_updates=not took_over)
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    logger.info("Запуск приложения...")
+    dp.include_router(user_router)
+    logger.info("Роутер подключен")
+    leader_task = None
+    if settings.workers > 1:
+        leader_task = asyncio.create_task(lead())
+    else:
+        await start_leader()
+    if settings.webhook_queue_enabled:
+        update_queue.start(partial(dp.feed_update, bot))
+    loop_lag_task = asyncio.create_task(monitor_loop_lag(settings.loop_lag_interval))
+    yield
+    logger.info("Остановка приложения...")
+    try:
+        # Сначала дообрабатываем уже принятые обновления
+        await update_queue.drain(settings.webhook_drain_timeout)
+        loop_lag_task.cancel()
+        if leader_task is not None:
+            # Запуск ведущего прерывается до остановки, чтобы не остановить его наполовину запущенным
+            leader_task.cancel()
+            await asyncio.gather(leader_task, return_exceptions=True)
+        if is_scheduler_owner():
+            await stop_leader()
+    finally:
+        leader.release()
+        shutdown_executor()
+        await dp.storage.close()
     logger.info("Приложение остановлено")
 
 app = FastAPI(
@@ -76,6 +152,11 @@ async def webhook_info():
         logger.error(f"Ошибка при получении информации о webhook: {e}")
         return {"error": str(e)}
 
+@app.get("/metrics")
+async def metrics_handler():
+    """Возвращает внутренние метрики процесса"""
+    return metrics.snapshot()
+
 @app.get("/callback")
 async def callback_handler(request: Request):
     code = request.query_params.get('code')
@@ -98,17 +179,16 @@ async def callback_handler(request: Request):
 
     # Find the state by user_id (which is the same as chat_id in private chats)
     fsm_context = dp.fsm.get_context(bot, chat_id=user_id, user_id=user_id)
-    data = await fsm_context.get_data()
-
-    stored_state = data.get('auth_state')
-    flow = data.get('auth_flow')
+    auth_request = get_pending_store().get('oauth', user_id)
+    stored_state = auth_request['state'] if auth_request else None
 
     if stored_state != auth_state:
         logger.error(f"Несоответствие состояния для пользователя {user_id}: сохраненное={stored_state}, полученное={auth_state}")
         raise HTTPException(status_code=400, detail="State mismatch!")
 
     try:
-        flow.fetch_token(code=code)
+        flow = create_auth_flow(code_verifier=auth_request['code_verifier'], autogenerate_code_verifier=False)
+        await run_google(flow.fetch_token, code=code)
         credentials = flow.credentials
         
         # Проверяем, что получили refresh токен
@@ -122,6 +202,7 @@ async def callback_handler(request: Request):
         await bot.send_message(chat_id=user_id,
                                text="✅ Авторизация успешна! Теперь вы можете использовать /events для просмотра предстоящих событий.")
 
+        get_pending_store().pop('oauth', user_id)
         await fsm_context.clear()  # Clear the state
         return HTMLResponse(content="Авторизация успешна! Пожалуйста, вернитесь к Telegram боту.", status_code=200)
 
@@ -132,22 +213,52 @@ async def callback_handler(request: Request):
         raise HTTPException(status_code=500, detail=f"Authorization failed: {e}")
 
 
+@app.post("/calendar-push")
+async def calendar_push(request: Request):
+    """Принимает уведомления Google Calendar об изменениях календарей"""
+    changed = handle_notification(
+        request.headers.get("X-Goog-Channel-ID"),
+        request.headers.get("X-Goog-Channel-Token"),
+        request.headers.get("X-Goog-Resource-ID"),
+        request.headers.get("X-Goog-Resource-State"),
+    )
+    # В режиме нескольких процессов календарь синхронизирует ведущий по флагу изменения
+    if changed and is_scheduler_owner():
+        user_id, calendar_id = changed
+        logger.info(f"Получено уведомление об изменении календаря {calendar_id} пользователя {user_id}")
+        task = asyncio.create_task(sync_user_calendars(user_id, [calendar_id]))
+        background_tasks.add(task)
+        task.add_done_callback(background_tasks.discard)
+    # Google ожидает 2xx на любое уведомление, иначе повторяет его
+    return Response(status_code=200)
+
 # Маршрут для обработки вебхуков
 @app.post("/webhook")
 async def webhook(request: Request) -> None:
     try:
-        update_data = await request.json()
-        logger.info(f"Получен webhook: {update_data}")
-        update = Update.model_validate(update_data, context={"bot": bot})
+        body = await request.body()
+        update = parse_update(body, bot)
+        log_update(update, body, settings.webhook_log_sample_rate)
+        if settings.webhook_queue_enabled:
+            if not update_queue.put(update):
+                if settings.webhook_shed_when_full:
+                    metrics.inc("webhook.shed")
+                    logger.warning(f"Очередь обновлений заполнена, обновление {update.update_id} отброшено")
+                    return
+                # Telegram повторит доставку позже
+                raise HTTPException(status_code=429, detail="Update queue is full")
+            return
         await dp.feed_update(bot, update)
-        logger.info("Webhook обработан успешно")
+    except HTTPException:
+        raise
     except Exception as e:
         logger.error(f"Ошибка при обработке webhook: {e}")
         raise
 
 def main() -> None:
     run(
-        app,
+        "app.main:app",
         host='0.0.0.0',
-        port=8080
+        port=8080,
+        workers=settings.workers
     )
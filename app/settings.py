@@ -16,6 +16,96 @@ class Settings(BaseSettings):
     admin_id: str
     gigachat_key: str
     default_remind_time: str
+    # Сколько пользователей обрабатывается одновременно за один тик напоминаний
+    reminder_concurrency: int = 20
+    # За сколько минут до начала события отправлять напоминания, через запятую
+    reminder_offsets: str = "60,15"
+    # Насколько (секунды) напоминание может опоздать и все еще быть отправленным
+    reminder_grace_seconds: int = 300
+    # Через сколько секунд неподтвержденная отправка напоминания (процесс упал во время отправки) повторяется
+    reminder_claim_timeout: int = 120
+    # Размер пула потоков для блокирующих вызовов Google API
+    google_io_workers: int = 32
+    # Объединять чтения событий пользователя в batch-запросы Google API
+    google_batch_enabled: bool = True
+    # Сколько раз повторять неудачные части batch-запроса
+    google_batch_retries: int = 2
+    # Размер и время жизни (секунды) пула объектов Calendar service
+    service_pool_size: int = 1000
+    service_pool_ttl: int = 3600
+    # За сколько секунд до истечения access токена он обновляется
+    credentials_refresh_margin: int = 300
+    # Как часто (секунды) проверять сервис тестовым запросом, если не было успешных запросов; 0 - никогда
+    service_probe_interval: int = 0
+    # Сколько секунд список календарей используется без перепроверки по ETag
+    calendar_list_ttl: int = 900
+    # Читать события из локального хранилища с инкрементальной синхронизацией (syncToken)
+    event_sync_enabled: bool = True
+    event_store_path: str = "/service/data/events.sqlite3"
+    # Получать уведомления об изменениях календарей (events.watch) вместо опроса
+    calendar_push_enabled: bool = False
+    # Время жизни канала уведомлений и за сколько секунд до истечения его продлевать
+    calendar_push_ttl: int = 604800
+    calendar_push_renew_before: int = 86400
+    # Сколько запросов к GigaChat выполняется одновременно и таймаут одного запроса, секунды
+    llm_concurrency: int = 4
+    llm_timeout: float = 60
+    # Извлекать детали события и выбирать календарь одним запросом к LLM
+    llm_single_call: bool = True
+    # Разбирать типовые фразы с датой и временем правилами, без запроса к LLM
+    fast_parser_enabled: bool = True
+    # Хранилище токенов пользователей: "sqlite" (токены из /service/user_credentials переносятся один раз) или "file"
+    token_store_backend: str = "sqlite"
+    token_store_path: str = "/service/data/tokens.sqlite3"
+    # Фоновое обновление токенов: за сколько секунд до истечения обновлять, как часто проверять (секунды),
+    # сколько обновлений в секунду и одновременно
+    token_refresh_enabled: bool = True
+    token_refresh_ahead: int = 600
+    token_refresh_interval: int = 60
+    token_refresh_rate: float = 5.0
+    token_refresh_concurrency: int = 4
+    # Незавершенные действия пользователей (события до подтверждения, запросы OAuth): лимит записей,
+    # файл SQLite для хранения между перезапусками (пусто - только в памяти) и время жизни, секунды
+    pending_store_size: int = 10000
+    pending_store_path: str = ""
+    pending_event_ttl: int = 3600
+    oauth_state_ttl: int = 1800
+    # Отвечать на webhook сразу, а обновления обрабатывать очередью: размер очереди, число обработчиков,
+    # отбрасывать ли обновления при полной очереди (иначе 429) и сколько секунд дообрабатывать очередь при остановке
+    webhook_queue_enabled: bool = False
+    webhook_queue_size: int = 1000
+    webhook_workers: int = 16
+    webhook_shed_when_full: bool = False
+    webhook_drain_timeout: float = 30
+    # Доля входящих обновлений, о которых пишется строка в лог (0 - не писать)
+    webhook_log_sample_rate: float = 0.01
+    # Число процессов uvicorn. При нескольких процессах задачи по расписанию выполняет один ведущий
+    # (блокировка файла), а состояние диалогов и незавершенные действия хранятся в общих базах SQLite
+    workers: int = 1
+    leader_lock_path: str = "/service/data/scheduler.lock"
+    leader_retry_interval: float = 10
+    fsm_storage_path: str = "/service/data/fsm.sqlite3"
+    shared_pending_store_path: str = "/service/data/pending.sqlite3"
+    # Ограничение исходящих запросов к Telegram: запросов в секунду и запас на всплеск для всех чатов
+    # (на весь бот, делятся поровну между процессами), интервал между сообщениями в один чат (секунды)
+    # и число повторов после TelegramRetryAfter
+    telegram_rate_limit_enabled: bool = True
+    telegram_rate: float = 30
+    telegram_burst: int = 30
+    telegram_chat_interval: float = 1.0
+    telegram_retries: int = 3
+    # Показывать предварительный просмотр события по мере получения ответа LLM и как часто его обновлять, секунды;
+    # заглушка отправляется с первым ответом LLM или, если результата еще нет, через preview_placeholder_delay секунд
+    llm_stream_preview: bool = True
+    preview_edit_interval: float = 1.0
+    preview_placeholder_delay: float = 0.5
+    # Кэш ответов LLM: размер, время жизни (секунды) и файл SQLite для хранения между перезапусками
+    llm_cache_enabled: bool = True
+    llm_cache_size: int = 10000
+    llm_cache_ttl: int = 86400
+    llm_cache_path: str = ""
+    # Период измерения задержки event loop, секунды
+    loop_lag_interval: float = 0.5
 
     @property
     def scopes(self):
@@ -25,6 +115,10 @@ class Settings(BaseSettings):
     ]
 
 
+    @property
+    def reminder_offset_minutes(self):
+        return [int(offset) for offset in self.reminder_offsets.split(',') if offset.strip()]
+
     @property
     def echo(self):
         if self.is_debug == 'True':
@@ -34,6 +128,10 @@ class Settings(BaseSettings):
     @property
     def webhook_url(self):
         return f"{self.server_address}/webhook"
+
+    @property
+    def calendar_push_url(self):
+        return f"{self.server_address}/calendar-push"
     # @property
     # def async_session(self):
     #     connection = f'{self.POSTGRESQL_SERVER}{self.POSTGRESQL_DB}'
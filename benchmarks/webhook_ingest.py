@@ -0,0 +1,92 @@
+"""
+Micro-benchmark of the /webhook ingest path on a corpus of recorded update shapes.
+
+Compares the previous path (json.loads -> Update.model_validate -> f-string log of the whole
+payload) with the current one (Update.model_validate_json from the body bytes -> sampled
+summary log) and reports updates/sec and memory allocated per update (tracemalloc).
+
+    python -m benchmarks.webhook_ingest [--iterations 2000]
+"""
+import argparse
+import json
+import logging
+import os
+import time
+import tracemalloc
+
+from aiogram.types import Update
+
+from app.bot.ingest import log_update, parse_update
+
+CORPUS_FILE = os.path.join(os.path.dirname(__file__), 'webhook_updates.json')
+
+logger = logging.getLogger('benchmarks.webhook_ingest')
+
+
+def load_corpus():
+    with open(CORPUS_FILE, encoding='utf-8') as f:
+        return [json.dumps(update, ensure_ascii=False).encode('utf-8') for update in json.load(f)]
+
+
+def ingest_before(body: bytes):
+    update_data = json.loads(body)
+    logger.info(f"Получен webhook: {update_data}")
+    return Update.model_validate(update_data, context={"bot": None})
+
+
+def ingest_after(body: bytes):
+    update = parse_update(body)
+    log_update(update, body, sample_rate=0.01)
+    return update
+
+
+def measure_rate(ingest, corpus, iterations):
+    for body in corpus:
+        ingest(body)
+    started = time.perf_counter()
+    for _ in range(iterations):
+        for body in corpus:
+            ingest(body)
+    return iterations * len(corpus) / (time.perf_counter() - started)
+
+
+def measure_allocations(ingest, corpus, iterations):
+    """
+    Returns average bytes allocated at peak and retained per update, measured with tracemalloc.
+    """
+    peak_total = retained_total = 0
+    tracemalloc.start()
+    for _ in range(iterations):
+        for body in corpus:
+            tracemalloc.reset_peak()
+            baseline = tracemalloc.get_traced_memory()[0]
+            update = ingest(body)
+            current, peak = tracemalloc.get_traced_memory()
+            peak_total += peak - baseline
+            retained_total += current - baseline
+            del update
+    tracemalloc.stop()
+    updates = iterations * len(corpus)
+    return peak_total / updates, retained_total / updates
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--iterations', type=int, default=2000, help='passes over the corpus')
+    args = parser.parse_args()
+
+    # Как в приложении: INFO-логи включены, вывод отбрасывается, чтобы не мерить терминал
+    logging.basicConfig(level=logging.INFO, handlers=[logging.NullHandler()])
+
+    corpus = load_corpus()
+    print(f"Корпус: {len(corpus)} обновлений, {sum(map(len, corpus))} байт, проходов: {args.iterations}")
+    for name, ingest in (("before", ingest_before), ("after", ingest_after)):
+        rate = measure_rate(ingest, corpus, args.iterations)
+        # tracemalloc замедляет выполнение, поэтому аллокации меряются отдельным, более коротким прогоном
+        peak, retained = measure_allocations(ingest, corpus, max(1, args.iterations // 10))
+        print(f"{name:>6}: {rate:10.0f} updates/s, {peak:8.0f} B allocated/update (peak), "
+              f"{retained:6.0f} B retained/update")
+
+
+if __name__ == '__main__':
+    main()
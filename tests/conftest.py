@@ -0,0 +1,19 @@
+import os
+import tempfile
+
+# Настройки читаются при импорте модулей приложения, поэтому окружение задается до импорта тестов
+_data_dir = tempfile.mkdtemp(prefix='calendar-bot-tests-')
+for name, value in {
+    'bot_token': '123456:TEST-token',
+    'server_address': 'https://example.com',
+    'is_debug': 'False',
+    'admin_id': '1',
+    'gigachat_key': 'test',
+    'default_remind_time': '15',
+    'event_store_path': os.path.join(_data_dir, 'events.sqlite3'),
+    'token_store_path': os.path.join(_data_dir, 'tokens.sqlite3'),
+    'leader_lock_path': os.path.join(_data_dir, 'scheduler.lock'),
+    'fsm_storage_path': os.path.join(_data_dir, 'fsm.sqlite3'),
+    'shared_pending_store_path': os.path.join(_data_dir, 'pending.sqlite3'),
+}.items():
+    os.environ.setdefault(name, value)
@@ -0,0 +1,117 @@
+import asyncio
+import datetime
+import json
+
+import httplib2
+import pytest
+from googleapiclient.errors import HttpError
+
+from app.bot import google_io, handlers
+
+
+def http_error(status, reason=None):
+    body = {'error': {'code': status, 'message': 'error'}}
+    if reason is not None:
+        body['error']['errors'] = [{'reason': reason, 'domain': 'global'}]
+    return HttpError(httplib2.Response({'status': status}), json.dumps(body).encode())
+
+
+def test_401_is_auth_error():
+    assert handlers.is_auth_error(http_error(401, 'authError'))
+    assert handlers.is_auth_error(http_error(401))
+
+
+@pytest.mark.parametrize('reason', handlers.AUTH_ERROR_REASONS)
+def test_403_with_auth_reason_is_auth_error(reason):
+    assert handlers.is_auth_error(http_error(403, reason))
+
+
+@pytest.mark.parametrize('reason', ['rateLimitExceeded', 'userRateLimitExceeded', 'quotaExceeded',
+                                    'dailyLimitExceeded', 'forbidden', 'requiredAccessLevel',
+                                    'insufficientPermissions', None])
+def test_other_403_is_not_auth_error(reason):
+    assert not handlers.is_auth_error(http_error(403, reason))
+
+
+@pytest.mark.parametrize('status', [400, 404, 409, 500, 503])
+def test_other_statuses_are_not_auth_errors(status):
+    assert not handlers.is_auth_error(http_error(status, 'authError'))
+
+
+def test_non_json_403_is_not_auth_error():
+    assert not handlers.is_auth_error(HttpError(httplib2.Response({'status': 403}), b'Forbidden'))
+
+
+@pytest.mark.parametrize('error, retryable', [
+    (http_error(403, 'rateLimitExceeded'), True),
+    (http_error(403, 'userRateLimitExceeded'), True),
+    (http_error(429), True),
+    (http_error(503, 'backendError'), True),
+    (RuntimeError('transport error'), True),
+    (http_error(403, 'quotaExceeded'), False),
+    (http_error(403, 'forbidden'), False),
+    (http_error(401, 'authError'), False),
+    (http_error(404, 'notFound'), False),
+])
+def test_is_retryable_error(error, retryable):
+    assert google_io.is_retryable_error(error) is retryable
+
+
+class FakeRequest:
+    def __init__(self, error):
+        self.error = error
+
+    def execute(self):
+        raise self.error
+
+
+class FakeService:
+    def __init__(self, error):
+        self.error = error
+
+    def events(self):
+        return self
+
+    def insert(self, calendarId, body):
+        return FakeRequest(self.error)
+
+
+@pytest.fixture
+def insert_failing_with(monkeypatch):
+    deleted = []
+
+    async def get_creds(user_id):
+        return object()
+
+    async def delete_credentials(user_id):
+        deleted.append(user_id)
+
+    def make(error):
+        async def get_service(user_id, creds):
+            return FakeService(error)
+
+        monkeypatch.setattr(handlers, 'get_creds', get_creds)
+        monkeypatch.setattr(handlers, 'delete_credentials', delete_credentials)
+        monkeypatch.setattr(handlers.service_pool, 'get', get_service)
+        return deleted
+
+    return make
+
+
+def create_event():
+    start = datetime.datetime(2030, 1, 1, 10, 0)
+    return asyncio.run(handlers.create_google_calendar_event(
+        42, 'Встреча', '', start, start + datetime.timedelta(hours=1)))
+
+
+@pytest.mark.parametrize('reason', ['quotaExceeded', 'rateLimitExceeded', 'forbidden', 'requiredAccessLevel'])
+def test_create_event_keeps_token_on_non_auth_403(insert_failing_with, reason):
+    deleted = insert_failing_with(http_error(403, reason))
+    assert create_event() is False
+    assert deleted == []
+
+
+def test_create_event_drops_token_on_401(insert_failing_with):
+    deleted = insert_failing_with(http_error(401, 'authError'))
+    assert create_event() is False
+    assert deleted == [42]
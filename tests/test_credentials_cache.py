@@ -0,0 +1,108 @@
+import asyncio
+import datetime
+import json
+import time
+
+import pytest
+
+from app.bot import handlers
+from app.bot.token_store import SQLiteTokenStore
+
+EXPIRY = datetime.datetime(2099, 1, 1)
+
+
+def token(access_token):
+    return json.dumps({'token': access_token, 'refresh_token': 'refresh', 'client_id': 'client',
+                       'client_secret': 'secret', 'expiry': EXPIRY.isoformat() + 'Z'})
+
+
+class FakeScheduler:
+    def __init__(self, user_ids=()):
+        self.users = set(user_ids)
+        self.removed = []
+
+    def user_ids(self):
+        return set(self.users)
+
+    def remove_user(self, user_id):
+        self.removed.append(str(user_id))
+        self.users.discard(str(user_id))
+
+
+@pytest.fixture
+def store(tmp_path, monkeypatch):
+    store = SQLiteTokenStore(str(tmp_path / 'tokens.sqlite3'))
+    monkeypatch.setattr(handlers, 'get_token_store', lambda: store)
+    monkeypatch.setattr(handlers, '_credentials_cache', {})
+    monkeypatch.setattr(handlers, '_credentials_version', {})
+    monkeypatch.setattr(handlers, '_calendar_list_cache', {})
+    monkeypatch.setattr(handlers.settings, 'workers', 2)
+    return store
+
+
+@pytest.fixture
+def scheduler(monkeypatch):
+    scheduler = FakeScheduler()
+    monkeypatch.setattr(handlers, 'reminder_scheduler', scheduler)
+    return scheduler
+
+
+def access_token(user_id=1):
+    creds = asyncio.run(handlers.get_creds(user_id))
+    return creds.token if creds is not None else None
+
+
+def test_token_saved_by_another_process_replaces_cached_credentials(store, scheduler):
+    store.save(1, token('first'), EXPIRY)
+    assert access_token() == 'first'
+    handlers._calendar_list_cache['1'] = {'etag': 'etag', 'items': [], 'fetched_at': time.monotonic()}
+
+    # Повторная авторизация или обновление токена в другом процессе
+    store.save(1, token('second'), EXPIRY)
+
+    assert access_token() == 'second'
+    assert '1' not in handlers._calendar_list_cache
+    assert scheduler.removed == []
+
+
+def test_token_deleted_by_another_process_drops_credentials_and_reminders(store, scheduler):
+    store.save(1, token('first'), EXPIRY)
+    assert access_token() == 'first'
+
+    store.delete(1)
+
+    assert access_token() is None
+    assert scheduler.removed == ['1']
+
+
+def test_own_saves_keep_the_cache(store, scheduler):
+    store.save(1, token('first'), EXPIRY)
+    creds = asyncio.run(handlers.get_creds(1))
+    handlers.store_credentials(1, creds)
+
+    assert asyncio.run(handlers.get_creds(1)) is creds
+
+
+def test_single_worker_does_not_check_the_store(store, scheduler, monkeypatch):
+    monkeypatch.setattr(handlers.settings, 'workers', 1)
+    store.save(1, token('first'), EXPIRY)
+    assert access_token() == 'first'
+
+    store.save(1, token('second'), EXPIRY)
+
+    assert access_token() == 'first'
+
+
+def test_reminder_tick_drops_users_without_token(store, monkeypatch):
+    scheduler = FakeScheduler({'1', '2'})
+    monkeypatch.setattr(handlers, 'reminder_scheduler', scheduler)
+
+    async def schedule_user_reminders(user_id):
+        pass
+
+    monkeypatch.setattr(handlers, 'schedule_user_reminders', schedule_user_reminders)
+    store.save(1, token('first'), EXPIRY)
+
+    asyncio.run(handlers.send_event_reminders(None))
+
+    assert scheduler.removed == ['2']
@@ -0,0 +1,153 @@
+import asyncio
+import datetime
+import json
+
+import httplib2
+import pytest
+import pytz
+from googleapiclient.errors import HttpError
+
+from app.bot import handlers
+from app.bot.event_store import EventStore
+from app.bot.metrics import metrics
+
+
+class FakeRequest:
+    def __init__(self, result=None, error=None):
+        self.result = result
+        self.error = error
+
+    def execute(self):
+        if self.error is not None:
+            raise self.error
+        return self.result
+
+
+class FakeCalendarService:
+    """
+    Serves events.list pages by ``(calendarId, syncToken, pageToken)`` and records the calls.
+    """
+
+    def __init__(self, pages):
+        self.pages = pages
+        self.calls = []
+
+    def events(self):
+        return self
+
+    def list(self, calendarId, pageToken=None, syncToken=None, **kwargs):
+        key = (calendarId, syncToken, pageToken)
+        self.calls.append(key)
+        result = self.pages[key]
+        if isinstance(result, Exception):
+            return FakeRequest(error=result)
+        return FakeRequest(result)
+
+
+def http_error(status):
+    return HttpError(httplib2.Response({'status': status}), json.dumps({'error': {'code': status}}).encode())
+
+
+def starts_in(hours):
+    start = datetime.datetime.now(pytz.utc) + datetime.timedelta(hours=hours)
+    return start.strftime('%Y-%m-%dT%H:%M:%SZ')
+
+
+def event(event_id, hours=24, summary=None, status='confirmed'):
+    return {'id': event_id, 'status': status, 'summary': summary or event_id,
+            'start': {'dateTime': starts_in(hours)}}
+
+
+@pytest.fixture
+def store(tmp_path, monkeypatch):
+    store = EventStore(str(tmp_path / 'events.sqlite3'))
+    monkeypatch.setattr(handlers, 'get_event_store', lambda: store)
+    monkeypatch.setattr(handlers.settings, 'google_batch_enabled', False)
+    return store
+
+
+def stored(store, calendar_id='work'):
+    since = datetime.datetime.now(pytz.utc) - datetime.timedelta(days=2)
+    return {event_id: summary for event_id, summary, _ in store.upcoming_events(1, calendar_id, since, 100)}
+
+
+def sync(service, calendar_ids=('work',)):
+    return asyncio.run(handlers.sync_calendar_events(service, 1, list(calendar_ids)))
+
+
+def test_full_sync_follows_pages(store):
+    service = FakeCalendarService({
+        ('work', None, None): {'items': [event('a')], 'nextPageToken': 'page-2'},
+        ('work', None, 'page-2'): {'items': [event('b')], 'nextSyncToken': 'sync-1'},
+    })
+
+    assert sync(service) == {}
+    assert service.calls == [('work', None, None), ('work', None, 'page-2')]
+    assert stored(store) == {'a': 'a', 'b': 'b'}
+    assert store.get_sync_token(1, 'work') == 'sync-1'
+
+
+def test_incremental_sync_applies_changes(store):
+    store.apply_changes(1, 'work', [event('a'), event('b')], 'sync-1', full_sync=True)
+    service = FakeCalendarService({
+        ('work', 'sync-1', None): {'items': [{'id': 'a', 'status': 'cancelled'}, event('b', summary='Перенесено')],
+                                   'nextPageToken': 'page-2'},
+        ('work', 'sync-1', 'page-2'): {'items': [event('c')], 'nextSyncToken': 'sync-2'},
+    })
+
+    assert sync(service) == {}
+    # Страницы инкрементальной синхронизации запрашиваются с тем же токеном
+    assert service.calls == [('work', 'sync-1', None), ('work', 'sync-1', 'page-2')]
+    assert stored(store) == {'b': 'Перенесено', 'c': 'c'}
+    assert store.get_sync_token(1, 'work') == 'sync-2'
+
+
+def test_expired_sync_token_triggers_full_resync(store):
+    store.apply_changes(1, 'work', [event('deleted-meanwhile'), event('a')], 'stale', full_sync=True)
+    service = FakeCalendarService({
+        ('work', 'stale', None): http_error(410),
+        ('work', None, None): {'items': [event('a'), event('b')], 'nextSyncToken': 'sync-2'},
+    })
+    resyncs = metrics.counter('event_sync.full_resyncs')
+
+    assert sync(service) == {}
+    assert service.calls == [('work', 'stale', None), ('work', None, None)]
+    assert stored(store) == {'a': 'a', 'b': 'b'}
+    assert store.get_sync_token(1, 'work') == 'sync-2'
+    assert metrics.counter('event_sync.full_resyncs') == resyncs + 1
+
+
+def test_failed_calendar_does_not_stop_the_others(store):
+    store.apply_changes(1, 'home', [event('a')], 'sync-1', full_sync=True)
+    error = http_error(500)
+    service = FakeCalendarService({
+        ('home', 'sync-1', None): error,
+        ('work', None, None): {'items': [event('b')], 'nextSyncToken': 'sync-2'},
+    })
+
+    assert sync(service, ['home', 'work']) == {'home': error}
+    # Календарь с ошибкой остается как был и синхронизируется со старым токеном в следующий раз
+    assert stored(store, 'home') == {'a': 'a'}
+    assert store.get_sync_token(1, 'home') == 'sync-1'
+    assert stored(store, 'work') == {'b': 'b'}
+
+
+def test_apply_changes_prunes_past_events(store):
+    all_day = {'id': 'all-day', 'summary': 'Отпуск',
+               'start': {'date': (datetime.date.today() + datetime.timedelta(days=3)).isoformat()}}
+    store.apply_changes(1, 'work', [event('past', hours=-48), event('recent', hours=-1), all_day], 'sync-1')
+
+    assert stored(store) == {'recent': 'recent', 'all-day': 'Отпуск'}
+
+
+def test_full_sync_replaces_calendar_events(store):
+    store.apply_changes(1, 'work', [event('a'), event('b')], 'sync-1', full_sync=True)
+    store.apply_changes(1, 'home', [event('c')], 'sync-1', full_sync=True)
+
+    store.apply_changes(1, 'work', [event('b')], 'sync-2')
+    assert stored(store) == {'a': 'a', 'b': 'b'}
+
+    store.apply_changes(1, 'work', [event('b')], 'sync-3', full_sync=True)
+    assert stored(store) == {'b': 'b'}
+    # Другие календари пользователя не затрагиваются
+    assert stored(store, 'home') == {'c': 'c'}
@@ -0,0 +1,125 @@
+import asyncio
+import datetime
+
+import pytest
+import pytz
+
+from app.bot import handlers
+from app.bot.fast_parser import parse_event_text
+from app.bot.metrics import metrics
+
+# Четверг, 15 октября 2026, полдень по Москве
+NOW = pytz.timezone('Europe/Moscow').localize(datetime.datetime(2026, 10, 15, 12, 0))
+
+
+@pytest.mark.parametrize('text, summary, date, start_time, end_time', [
+    # Относительные даты
+    ('завтра в 15:00 созвон', 'Созвон', '2026-10-16', '15:00', 'NONE'),
+    ('послезавтра в 9 утра бег', 'Бег', '2026-10-17', '09:00', 'NONE'),
+    ('сегодня в 18:30 ужин с Машей', 'Ужин с Машей', '2026-10-15', '18:30', 'NONE'),
+    ('Созвон с Петей завтра в 16:00', 'Созвон с Петей', '2026-10-16', '16:00', 'NONE'),
+    ('через 2 часа спортзал', 'Спортзал', '2026-10-15', '14:00', 'NONE'),
+    ('через полчаса звонок маме', 'Звонок маме', '2026-10-15', '12:30', 'NONE'),
+    ('через 3 дня в 10:00 стоматолог', 'Стоматолог', '2026-10-18', '10:00', 'NONE'),
+    # Дни недели
+    ('в среду в 10:00 обед', 'Обед', '2026-10-21', '10:00', 'NONE'),
+    ('в субботу в 7 вечера кино', 'Кино', '2026-10-17', '19:00', 'NONE'),
+    # Календарные даты
+    ('20 октября в 11:00 отчет', 'Отчет', '2026-10-20', '11:00', 'NONE'),
+    ('25.12 в 19:00 праздник', 'Праздник', '2026-12-25', '19:00', 'NONE'),
+    # Интервалы
+    ('в пятницу 10-11 встреча', 'Встреча', '2026-10-16', '10:00', '11:00'),
+    ('в понедельник с 14:00 до 15:30 планерка', 'Планерка', '2026-10-19', '14:00', '15:30'),
+    # Продолжительность
+    ('завтра в 10:00 встреча на 2 часа', 'Встреча', '2026-10-16', '10:00', '12:00'),
+    ('завтра в 15:00 созвон на полчаса', 'Созвон', '2026-10-16', '15:00', '15:30'),
+    ('завтра в 7 вечера кино на полтора часа', 'Кино', '2026-10-16', '19:00', '20:30'),
+])
+def test_parses_common_phrasing(text, summary, date, start_time, end_time):
+    assert parse_event_text(text, NOW) == {
+        'event_summary': summary,
+        'event_description': '',
+        'date': date,
+        'start_time': start_time,
+        'end_time': end_time,
+    }
+
+
+@pytest.mark.parametrize('text', [
+    'в следующую пятницу в 10:00 встреча',
+    'завтра утром пробежка',
+    'завтра в 10 или 11 созвон',
+    'встреча с командой',
+    'в 9:00 завтрак',
+    'завтра 10-11 и 14-15 встреча',
+    '31.02 в 10:00 встреча',
+    'завтра в 10:00 встреча в комнате 5',
+    'завтра с 10 до 11 встреча на 2 часа',
+    '',
+])
+def test_falls_back_to_llm_when_ambiguous(text):
+    assert parse_event_text(text, NOW) is None
+
+
+def test_fast_parse_updates_hit_rate():
+    hits, misses = metrics.counter('fast_parser.hits'), metrics.counter('fast_parser.misses')
+
+    assert handlers._fast_parse('завтра в 15:00 созвон').event_summary == 'Созвон'
+    assert handlers._fast_parse('встреча с командой') is None
+
+    assert metrics.counter('fast_parser.hits') == hits + 1
+    assert metrics.counter('fast_parser.misses') == misses + 1
+    assert metrics.snapshot()['gauges']['fast_parser.hit_rate'] == (hits + 1) / (hits + misses + 2)
+
+
+def test_fast_parse_disabled(monkeypatch):
+    monkeypatch.setattr(handlers.settings, 'fast_parser_enabled', False)
+    hits = metrics.counter('fast_parser.hits')
+    assert handlers._fast_parse('завтра в 15:00 созвон') is None
+    assert metrics.counter('fast_parser.hits') == hits
+
+
+CALENDARS = [{'id': 'primary', 'summary': 'Личный'}, {'id': 'work', 'summary': 'Работа'}]
+
+
+class FakeResponse:
+    def __init__(self, content):
+        self.content = content
+
+
+@pytest.fixture
+def calendar_llm(monkeypatch):
+    prompts = []
+
+    async def invoke_llm(prompt, **kwargs):
+        prompts.append(prompt)
+        return FakeResponse('Работа')
+
+    async def get_available_calendars(user_id):
+        return CALENDARS
+
+    monkeypatch.setattr(handlers, 'invoke_llm', invoke_llm)
+    monkeypatch.setattr(handlers, '_get_available_calendars', get_available_calendars)
+    return prompts
+
+
+def test_rule_parsed_text_only_asks_llm_for_calendar(calendar_llm):
+    event_details = asyncio.run(handlers.create_event_from_text(1, 'завтра в 15:00 созвон с клиентом'))
+    assert (event_details.calendar_id, event_details.calendar_name) == ('work', 'Работа')
+    assert event_details.event_summary == 'Созвон с клиентом'
+    assert len(calendar_llm) == 1
+    assert 'Best Calendar' in calendar_llm[0]
+
+
+def test_rule_parsed_text_reuses_calendar_choice(calendar_llm):
+    for _ in range(2):
+        event_details = asyncio.run(handlers.create_event_from_text(1, 'завтра в 10:00 планерка'))
+        assert event_details.calendar_id == 'work'
+    assert len(calendar_llm) == 1
+
+
+def test_rule_parsed_text_without_cache_asks_every_time(calendar_llm, monkeypatch):
+    monkeypatch.setattr(handlers.settings, 'llm_cache_enabled', False)
+    for _ in range(2):
+        asyncio.run(handlers.create_event_from_text(1, 'завтра в 11:00 обед с командой'))
+    assert len(calendar_llm) == 2
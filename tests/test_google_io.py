@@ -0,0 +1,21 @@
+import threading
+
+from app.bot import google_io
+
+
+def test_thread_http_has_timeout_and_no_308_redirects():
+    http = google_io._thread_http()
+
+    assert http.timeout == 60
+    assert 308 not in http.redirect_codes
+    assert google_io._thread_http() is http
+
+
+def test_each_thread_gets_its_own_http():
+    other = []
+    thread = threading.Thread(target=lambda: other.append(google_io._thread_http()))
+    thread.start()
+    thread.join()
+
+    assert other[0] is not google_io._thread_http()
+    assert other[0].timeout == 60
@@ -0,0 +1,58 @@
+import asyncio
+
+from app import main
+from app.bot.leader import LeaderLock
+
+
+class FakeBot:
+    def __init__(self):
+        self.webhook_deleted = False
+
+    async def delete_webhook(self):
+        self.webhook_deleted = True
+
+
+def test_stop_leader_before_scheduler_started(monkeypatch):
+    bot = FakeBot()
+
+    async def stop_bot():
+        pass
+
+    monkeypatch.setattr(main, 'bot', bot)
+    monkeypatch.setattr(main, 'stop_bot', stop_bot)
+    assert not main.scheduler.running
+
+    asyncio.run(main.stop_leader())
+    assert bot.webhook_deleted
+
+
+def run_lead(monkeypatch, tmp_path, held):
+    path = str(tmp_path / 'scheduler.lock')
+    calls = []
+
+    async def start_leader(**kwargs):
+        calls.append(kwargs)
+
+    async def run():
+        other = LeaderLock(path)
+        if held:
+            assert other.try_acquire()
+        task = asyncio.create_task(main.lead())
+        await asyncio.sleep(0.05)
+        other.release()
+        await asyncio.wait_for(task, timeout=1)
+
+    monkeypatch.setattr(main, 'leader', LeaderLock(path))
+    monkeypatch.setattr(main, 'start_leader', start_leader)
+    monkeypatch.setattr(main.settings, 'leader_retry_interval', 0.01)
+    asyncio.run(run())
+    main.leader.release()
+    return calls
+
+
+def test_first_leader_drops_pending_updates(monkeypatch, tmp_path):
+    assert run_lead(monkeypatch, tmp_path, held=False) == [{'drop_pending_updates': True}]
+
+
+def test_follower_taking_over_keeps_pending_updates(monkeypatch, tmp_path):
+    assert run_lead(monkeypatch, tmp_path, held=True) == [{'drop_pending_updates': False}]
@@ -0,0 +1,38 @@
+import time
+
+import pytest
+
+from app.bot.pending_store import MemoryPendingStore, PendingStore, SQLitePendingStore
+
+
+@pytest.fixture(params=['memory', 'sqlite'])
+def store(request, tmp_path):
+    if request.param == 'memory':
+        return MemoryPendingStore(maxsize=100)
+    return SQLitePendingStore(str(tmp_path / 'pending.sqlite3'), maxsize=100)
+
+
+def test_incomplete_backend_fails_on_instantiation():
+    class GetOnlyStore(PendingStore):
+        def get(self, namespace, key):
+            return None
+
+    with pytest.raises(TypeError):
+        GetOnlyStore()
+
+
+def test_set_get_pop(store):
+    store.set('event', 1, {'summary': 'Встреча'}, ttl=60)
+
+    assert store.get('event', '1') == {'summary': 'Встреча'}
+    assert store.get('oauth', 1) is None
+    assert store.pop('event', 1) == {'summary': 'Встреча'}
+    assert store.pop('event', 1) is None
+
+
+def test_records_expire(store):
+    store.set('oauth', 1, {'state': 'abc'}, ttl=0.05)
+    time.sleep(0.1)
+
+    assert store.get('oauth', 1) is None
+    assert store.pop('oauth', 1) is None
@@ -0,0 +1,155 @@
+import asyncio
+import time
+
+from langchain_core.messages import AIMessageChunk
+
+from app.bot import bot, llm, preview
+from app.bot.preview import EventPreview
+
+CHUNKS = ['{"event_summary": "Созвон", ', '"date": "2030-01-01", ', '"start_time": "10:00", ',
+          '"end_time": "NONE"}']
+
+
+class SlowPlaceholder:
+    def __init__(self, delay):
+        self.delay = delay
+        self.edits = []
+
+    async def edit_text(self, text, reply_markup=None):
+        await asyncio.sleep(self.delay)
+        self.edits.append(text)
+
+
+class FakeMessage:
+    def __init__(self, placeholder):
+        self.placeholder = placeholder
+        self.answers = []
+
+    async def answer(self, text, reply_markup=None):
+        self.answers.append(text)
+        return self.placeholder
+
+
+class StreamingLLM:
+    async def astream(self, prompt):
+        for chunk in CHUNKS:
+            await asyncio.sleep(0.01)
+            yield AIMessageChunk(content=chunk)
+
+
+def test_slow_preview_edits_do_not_hold_the_llm_slot(monkeypatch):
+    monkeypatch.setattr(llm, 'llm', StreamingLLM())
+    monkeypatch.setattr(llm, '_semaphore', None)
+    monkeypatch.setattr(preview.settings, 'preview_edit_interval', 0.0)
+    placeholder = SlowPlaceholder(delay=0.5)
+
+    async def main():
+        event_preview = EventPreview(FakeMessage(placeholder))
+        event_preview.start()
+        started = time.monotonic()
+        # Таймаут меньше одной правки: он сработал бы, если бы правки выполнялись внутри запроса к LLM
+        response = await llm.invoke_llm('prompt', timeout=0.3, on_partial=event_preview.on_partial)
+        elapsed = time.monotonic() - started
+        assert llm._get_semaphore()._value == llm.settings.llm_concurrency
+        await event_preview.finish('Готово')
+        return response, elapsed
+
+    response, elapsed = asyncio.run(main())
+    assert response.content == ''.join(CHUNKS)
+    assert elapsed < 0.3
+    assert placeholder.edits[-1] == 'Готово'
+
+
+def test_preview_edits_are_throttled_to_the_latest_response(monkeypatch):
+    monkeypatch.setattr(preview.settings, 'preview_edit_interval', 0.05)
+    placeholder = SlowPlaceholder(delay=0)
+
+    async def main():
+        event_preview = EventPreview(FakeMessage(placeholder))
+        event_preview.start()
+        content = ''
+        for chunk in CHUNKS:
+            content += chunk
+            event_preview.on_partial(content)
+        await asyncio.sleep(0.1)
+        return event_preview
+
+    asyncio.run(main())
+    # Промежуточные ответы объединяются: одна правка с последним полученным ответом
+    assert placeholder.edits == [preview.PLACEHOLDER_TEXT + '\n\nНазвание: Созвон\nДата: 2030-01-01\nНачало: 10:00']
+
+
+def test_finish_cancels_pending_edit(monkeypatch):
+    monkeypatch.setattr(preview.settings, 'preview_edit_interval', 10)
+    placeholder = SlowPlaceholder(delay=0)
+
+    async def main():
+        event_preview = EventPreview(FakeMessage(placeholder))
+        event_preview.start()
+        event_preview._edited_at = time.monotonic()
+        event_preview.on_partial(CHUNKS[0])
+        await asyncio.sleep(0.01)
+        await event_preview.finish('Готово')
+        await asyncio.sleep(0)
+
+    asyncio.run(main())
+    assert placeholder.edits == ['Готово']
+
+
+def test_quick_result_is_sent_without_placeholder(monkeypatch):
+    monkeypatch.setattr(preview.settings, 'preview_placeholder_delay', 10)
+    placeholder = SlowPlaceholder(delay=0)
+    message = FakeMessage(placeholder)
+
+    async def main():
+        event_preview = EventPreview(message)
+        event_preview.start()
+        await asyncio.sleep(0)
+        await event_preview.finish('Готово')
+
+    asyncio.run(main())
+    assert message.answers == ['Готово']
+    assert placeholder.edits == []
+
+
+def test_placeholder_is_sent_after_delay(monkeypatch):
+    monkeypatch.setattr(preview.settings, 'preview_placeholder_delay', 0.01)
+    placeholder = SlowPlaceholder(delay=0)
+    message = FakeMessage(placeholder)
+
+    async def main():
+        event_preview = EventPreview(message)
+        event_preview.start()
+        await asyncio.sleep(0.05)
+        assert message.answers == [preview.PLACEHOLDER_TEXT]
+        await event_preview.finish('Готово')
+
+    asyncio.run(main())
+    assert placeholder.edits == ['Готово']
+
+
+def test_error_replaces_placeholder(monkeypatch):
+    monkeypatch.setattr(preview.settings, 'preview_edit_interval', 0.0)
+    placeholder = SlowPlaceholder(delay=0)
+
+    class FakeUser:
+        id = 1
+
+    class FakeState:
+        async def clear(self):
+            pass
+
+    message = FakeMessage(placeholder)
+    message.from_user = FakeUser()
+    message.text = 'встреча с командой'
+
+    async def create_event_from_text(user_id, user_text, on_partial=None):
+        on_partial(CHUNKS[0])
+        await asyncio.sleep(0.01)
+        raise RuntimeError('LLM недоступна')
+
+    monkeypatch.setattr(bot, 'create_event_from_text', create_event_from_text)
+    asyncio.run(bot.process_event_details(message, FakeState()))
+    # Заглушка не остается висеть: в нее выводится сообщение об ошибке
+    assert message.answers == [preview.PLACEHOLDER_TEXT]
+    assert placeholder.edits[-1] == 'Извините, произошла ошибка. Пожалуйста, попробуйте снова.'
@@ -0,0 +1,157 @@
+import asyncio
+import time
+
+import pytest
+from fastapi.testclient import TestClient
+
+from app.bot import push_channels
+from app.bot.event_store import EventStore
+from app.bot.metrics import metrics
+
+
+class FakeRequest:
+    def __init__(self, result=None, error=None):
+        self.result = result
+        self.error = error
+
+    def execute(self):
+        if self.error is not None:
+            raise self.error
+        return self.result
+
+
+class FakeCalendarService:
+    """
+    Records events.watch and channels.stop calls in the order they are executed.
+    """
+
+    def __init__(self, unsupported=()):
+        self.calls = []
+        self.unsupported = set(unsupported)
+
+    def events(self):
+        return self
+
+    def channels(self):
+        return self
+
+    def watch(self, calendarId, body):
+        if calendarId in self.unsupported:
+            return FakeRequest(error=RuntimeError('push notifications are not supported'))
+        self.calls.append(('watch', calendarId, body['id']))
+        return FakeRequest({'resourceId': f'resource-{calendarId}',
+                            'expiration': str(int((time.time() + 7 * 86400) * 1000))})
+
+    def stop(self, body):
+        self.calls.append(('stop', body['id'], body['resourceId']))
+        return FakeRequest({})
+
+
+@pytest.fixture
+def store(tmp_path, monkeypatch):
+    store = EventStore(str(tmp_path / 'events.sqlite3'))
+    monkeypatch.setattr(push_channels, 'get_event_store', lambda: store)
+    monkeypatch.setattr(push_channels, '_watch_failures', {})
+    return store
+
+
+def test_ensure_channels_watches_every_calendar_once(store):
+    service = FakeCalendarService()
+    asyncio.run(push_channels.ensure_channels(service, 1, ['work', 'home']))
+    asyncio.run(push_channels.ensure_channels(service, 1, ['work', 'home']))
+
+    assert [(call[0], call[1]) for call in service.calls] == [('watch', 'work'), ('watch', 'home')]
+    assert sorted(calendar_id for _, calendar_id, _, _ in store.user_channels(1)) == ['home', 'work']
+
+
+def test_ensure_channels_renews_expiring_channel(store):
+    store.add_channel('old', 1, 'work', 'resource-old', 'token', time.time() + 60)
+    service = FakeCalendarService()
+
+    asyncio.run(push_channels.ensure_channels(service, 1, ['work']))
+
+    # Новый канал создается до остановки старого, чтобы не потерять уведомления
+    assert service.calls[0][:2] == ('watch', 'work')
+    assert service.calls[1] == ('stop', 'old', 'resource-old')
+    channels = store.user_channels(1)
+    assert [channel_id for channel_id, _, _, _ in channels] == [service.calls[0][2]]
+    assert channels[0][3] > time.time() + push_channels.settings.calendar_push_renew_before
+
+
+def test_ensure_channels_does_not_retry_unsupported_calendar(store):
+    service = FakeCalendarService(unsupported={'holidays'})
+    asyncio.run(push_channels.ensure_channels(service, 1, ['holidays']))
+    asyncio.run(push_channels.ensure_channels(service, 1, ['holidays']))
+
+    assert service.calls == []
+    assert store.user_channels(1) == []
+    assert (str(1), 'holidays') in push_channels._watch_failures
+
+
+def test_stop_user_channels(store):
+    store.add_channel('a', 1, 'work', 'resource-a', 'token', time.time() + 3600)
+    store.add_channel('b', 1, 'home', 'resource-b', 'token', time.time() + 3600)
+    service = FakeCalendarService()
+
+    asyncio.run(push_channels.stop_user_channels(service, 1))
+
+    assert sorted(service.calls) == [('stop', 'a', 'resource-a'), ('stop', 'b', 'resource-b')]
+    assert store.user_channels(1) == []
+
+
+def add_clean_channel(store):
+    store.add_channel('channel', 1, 'work', 'resource', 'secret', time.time() + 3600)
+    # Синхронизация после создания канала сбрасывает флаг изменения
+    assert store.calendars_needing_sync(1, ['work'], time.time()) == ['work']
+
+
+def test_sync_notification_is_not_a_change(store):
+    add_clean_channel(store)
+    notifications = metrics.counter('push.notifications')
+
+    assert push_channels.handle_notification('channel', 'secret', 'resource', 'sync') is None
+    assert metrics.counter('push.notifications') == notifications + 1
+    assert store.calendars_needing_sync(1, ['work'], time.time()) == []
+
+
+def test_change_notification_marks_calendar_dirty(store):
+    add_clean_channel(store)
+
+    assert push_channels.handle_notification('channel', 'secret', 'resource', 'exists') == ('1', 'work')
+    assert store.calendars_needing_sync(1, ['work'], time.time()) == ['work']
+
+
+@pytest.mark.parametrize('channel_id', ['unknown', None])
+def test_unknown_channel_is_ignored(store, channel_id):
+    unknown = metrics.counter('push.unknown_channel')
+    assert push_channels.handle_notification(channel_id, 'secret', 'resource', 'exists') is None
+    assert metrics.counter('push.unknown_channel') == unknown + 1
+
+
+@pytest.mark.parametrize('token, resource_id', [('wrong', 'resource'), (None, 'resource'), ('secret', 'other')])
+def test_mismatched_notification_is_rejected(store, token, resource_id):
+    add_clean_channel(store)
+    rejected = metrics.counter('push.rejected')
+
+    assert push_channels.handle_notification('channel', token, resource_id, 'exists') is None
+    assert metrics.counter('push.rejected') == rejected + 1
+    assert store.calendars_needing_sync(1, ['work'], time.time()) == []
+
+
+def test_calendar_push_route_syncs_changed_calendar(store, monkeypatch):
+    from app import main
+
+    add_clean_channel(store)
+    synced = []
+
+    async def sync_user_calendars(user_id, calendar_ids):
+        synced.append((user_id, calendar_ids))
+
+    monkeypatch.setattr(main, 'sync_user_calendars', sync_user_calendars)
+    client = TestClient(main.app)
+    headers = {'X-Goog-Channel-ID': 'channel', 'X-Goog-Resource-ID': 'resource', 'X-Goog-Resource-State': 'exists'}
+
+    assert client.post('/calendar-push', headers={**headers, 'X-Goog-Channel-Token': 'wrong'}).status_code == 200
+    assert synced == []
+    assert client.post('/calendar-push', headers={**headers, 'X-Goog-Channel-Token': 'secret'}).status_code == 200
+    assert synced == [('1', ['work'])]
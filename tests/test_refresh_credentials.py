@@ -0,0 +1,84 @@
+import asyncio
+import threading
+import time
+
+import pytest
+
+from app.bot import handlers
+from app.bot.metrics import metrics
+
+
+class FakeCredentials:
+    def __init__(self, delay=0.05, error=None):
+        self.delay = delay
+        self.error = error
+        self.refreshes = 0
+        self.token = 'old'
+        self._lock = threading.Lock()
+
+    def refresh(self, request):
+        time.sleep(self.delay)
+        with self._lock:
+            self.refreshes += 1
+        if self.error is not None:
+            raise self.error
+        self.token = 'new'
+
+
+@pytest.fixture(autouse=True)
+def no_store(monkeypatch):
+    saved = []
+    monkeypatch.setattr(handlers, 'store_credentials', lambda user_id, creds: saved.append(user_id))
+    monkeypatch.setattr(handlers, '_credentials_cache', {})
+    monkeypatch.setattr(handlers, '_refreshing', {})
+    return saved
+
+
+def test_concurrent_callers_share_one_refresh(no_store):
+    creds = FakeCredentials()
+    deduplicated = metrics.counter('credentials.refresh_deduplicated')
+
+    async def main():
+        return await asyncio.gather(*(handlers.refresh_credentials(1, creds) for _ in range(5)))
+
+    results = asyncio.run(main())
+    assert creds.refreshes == 1
+    assert all(result is creds for result in results)
+    assert metrics.counter('credentials.refresh_deduplicated') == deduplicated + 4
+    assert no_store == [1]
+    assert handlers._refreshing == {}
+
+
+def test_cancelling_the_first_caller_does_not_hang_the_others():
+    creds = FakeCredentials(delay=0.1)
+
+    async def main():
+        owner = asyncio.create_task(handlers.refresh_credentials(1, creds))
+        await asyncio.sleep(0.01)
+        follower = asyncio.create_task(handlers.refresh_credentials(1, creds))
+        await asyncio.sleep(0.01)
+        owner.cancel()
+        result = await asyncio.wait_for(follower, timeout=2)
+        with pytest.raises(asyncio.CancelledError):
+            await owner
+        return result
+
+    assert asyncio.run(main()) is creds
+    assert creds.token == 'new'
+    assert handlers._credentials_cache['1'] is creds
+
+
+def test_refresh_error_reaches_every_caller_and_is_not_reused():
+    creds = FakeCredentials(error=handlers.RefreshError('invalid_grant'))
+
+    async def main():
+        results = await asyncio.gather(*(handlers.refresh_credentials(1, creds) for _ in range(3)),
+                                       return_exceptions=True)
+        assert handlers._refreshing == {}
+        creds.error = None
+        return results, await handlers.refresh_credentials(1, creds)
+
+    results, retried = asyncio.run(main())
+    assert all(isinstance(result, handlers.RefreshError) for result in results)
+    assert retried is creds
+    assert creds.refreshes == 2
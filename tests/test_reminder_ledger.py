@@ -0,0 +1,93 @@
+import asyncio
+import time
+
+import pytest
+
+from app.bot import event_store, handlers
+from app.bot.event_store import EventStore
+from app.bot.reminders import Reminder
+
+KEY = ('1', 'work', 'event', 2000000000.0, 15)
+
+
+@pytest.fixture
+def store(tmp_path):
+    return EventStore(str(tmp_path / 'events.sqlite3'))
+
+
+def claim(store, now=None, stale_after=120):
+    return store.claim_reminder(*KEY, now=time.time() if now is None else now, stale_after=stale_after)
+
+
+def test_reminder_in_flight_is_not_claimed_twice(store):
+    assert claim(store)
+    assert not claim(store)
+
+
+def test_sent_reminder_is_never_claimed_again(store, monkeypatch):
+    assert claim(store)
+    store.mark_reminder_sent(*KEY, now=time.time())
+
+    monkeypatch.setattr(event_store, 'PROCESS_ID', 'restarted')
+    assert not claim(store)
+    assert not claim(store, now=time.time() + 3600)
+
+
+def test_claim_of_dead_process_is_taken_over(store, monkeypatch):
+    assert claim(store)
+    # Процесс упал между записью и отправкой; после перезапуска напоминание отправляется снова
+    monkeypatch.setattr(event_store, 'PROCESS_ID', 'restarted')
+    assert claim(store)
+    assert not claim(store)
+
+
+def test_stale_claim_is_taken_over(store):
+    now = time.time()
+    assert claim(store, now=now)
+    assert not claim(store, now=now + 60)
+    assert claim(store, now=now + 121)
+
+
+def test_released_reminder_can_be_claimed(store):
+    assert claim(store)
+    store.release_reminder(*KEY)
+    assert claim(store)
+
+
+class FakeBot:
+    def __init__(self, error=None):
+        self.error = error
+        self.sent = []
+
+    async def send_message(self, chat_id, text, **kwargs):
+        if self.error is not None:
+            raise self.error
+        self.sent.append(chat_id)
+
+
+def reminder():
+    return Reminder(user_id='1', calendar_id='work', calendar_name='Работа', event_id='event',
+                    event_summary='Встреча', start_at=KEY[3], offset_minutes=KEY[4])
+
+
+def test_send_reminder_marks_sent_after_delivery(store, monkeypatch):
+    monkeypatch.setattr(handlers, 'get_event_store', lambda: store)
+    bot = FakeBot()
+
+    asyncio.run(handlers.send_reminder(bot, reminder()))
+    monkeypatch.setattr(event_store, 'PROCESS_ID', 'restarted')
+    asyncio.run(handlers.send_reminder(bot, reminder()))
+
+    assert bot.sent == ['1']
+
+
+@pytest.mark.parametrize('error', [RuntimeError('network error'), asyncio.CancelledError()])
+def test_failed_send_releases_the_claim(store, monkeypatch, error):
+    monkeypatch.setattr(handlers, 'get_event_store', lambda: store)
+
+    with pytest.raises(type(error)):
+        asyncio.run(handlers.send_reminder(FakeBot(error), reminder()))
+    bot = FakeBot()
+    asyncio.run(handlers.send_reminder(bot, reminder()))
+
+    assert bot.sent == ['1']
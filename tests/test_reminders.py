@@ -0,0 +1,135 @@
+import asyncio
+import datetime
+import time
+
+import pytest
+import pytz
+
+from app.bot import reminders
+from app.bot.reminders import ReminderScheduler
+
+
+@pytest.fixture(autouse=True)
+def offsets(monkeypatch):
+    monkeypatch.setattr(reminders.settings, 'reminder_offsets', '10')
+    monkeypatch.setattr(reminders.settings, 'reminder_grace_seconds', 300)
+
+
+def event(event_id, fires_in):
+    """
+    An event whose 10-minute reminder is due in ``fires_in`` seconds.
+    """
+    start = datetime.datetime.fromtimestamp(time.time() + 600 + fires_in, pytz.utc)
+    return 'work', 'Работа', event_id, event_id, start
+
+
+class Sender:
+    def __init__(self, failures=0):
+        self.failures = failures
+        self.attempts = []
+
+    async def __call__(self, reminder):
+        self.attempts.append(reminder.event_id)
+        if self.failures:
+            self.failures -= 1
+            raise RuntimeError('Telegram недоступен')
+
+
+def run(scenario, send=None):
+    send = send or Sender()
+
+    async def main():
+        scheduler = ReminderScheduler()
+        scheduler.start(send)
+        try:
+            await scenario(scheduler)
+        finally:
+            await scheduler.stop()
+
+    asyncio.run(main())
+    return send.attempts
+
+
+def test_due_reminder_is_sent_once():
+    events = [event('a', 0.05), event('b', 60)]
+
+    async def scenario(scheduler):
+        scheduler.update_user(1, events)
+        await asyncio.sleep(0.2)
+        # Повторное обновление с теми же событиями не планирует отправленное напоминание заново
+        scheduler.update_user(1, events)
+        await asyncio.sleep(0.2)
+
+    assert run(scenario) == ['a']
+
+
+def test_moved_event_fires_at_new_time():
+    fired_early = []
+
+    async def scenario(scheduler):
+        scheduler.update_user(1, [event('a', 0.05)])
+        scheduler.update_user(1, [event('a', 0.3)])
+        await asyncio.sleep(0.15)
+        fired_early.append(scheduler.user_ids() != {'1'})
+        await asyncio.sleep(0.3)
+
+    # Старая запись в куче остается, но пропускается при извлечении
+    assert run(scenario) == ['a']
+    assert fired_early == [False]
+
+
+def test_deleted_events_and_users_are_not_reminded():
+    async def scenario(scheduler):
+        scheduler.update_user(1, [event('a', 0.05), event('b', 0.05)])
+        scheduler.update_user(1, [event('b', 0.05)])
+        scheduler.update_user(2, [event('c', 0.05)])
+        scheduler.remove_user(2)
+        await asyncio.sleep(0.2)
+        assert scheduler.user_ids() == set()
+
+    assert run(scenario) == ['b']
+
+
+def test_late_reminders_are_sent_within_grace_window():
+    async def scenario(scheduler):
+        # После перезапуска: напоминание опоздало на 10 с, другое на 400 с при окне в 300 с
+        scheduler.update_user(1, [event('late', -10), event('too-late', -400)])
+        await asyncio.sleep(0.1)
+
+    assert run(scenario) == ['late']
+
+
+def test_failed_send_is_rescheduled_on_next_update():
+    send = Sender(failures=1)
+
+    events = [event('a', 0.05)]
+
+    async def scenario(scheduler):
+        scheduler.update_user(1, events)
+        await asyncio.sleep(0.2)
+        assert send.attempts == ['a']
+        # Неотправленное напоминание не считается доставленным и планируется снова
+        scheduler.update_user(1, events)
+        await asyncio.sleep(0.1)
+
+    assert run(scenario, send) == ['a', 'a']
+    assert send.failures == 0
+
+
+def test_outdated_entries_do_not_accumulate():
+    heap_sizes = []
+
+    async def scenario(scheduler):
+        for step in range(500):
+            scheduler.update_user(1, [event('a', 3600 + step)])
+        heap_sizes.append(len(scheduler._heap))
+
+    run(scenario)
+    # Куча перестраивается, когда устаревших записей становится больше 2 * live + 64
+    assert heap_sizes[0] <= 2 * 1 + 64
+
+
+def test_follower_does_not_schedule():
+    scheduler = ReminderScheduler()
+    scheduler.update_user(1, [event('a', 60)])
+    assert scheduler.user_ids() == set()
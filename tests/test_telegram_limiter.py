@@ -0,0 +1,123 @@
+import asyncio
+import time
+
+import pytest
+from aiogram.exceptions import TelegramRetryAfter
+from aiogram.methods import GetMe, SendMessage
+
+from app.bot.metrics import metrics
+from app.bot.telegram_limiter import BULK, INTERACTIVE, RateLimitMiddleware, TelegramRateLimiter, bulk_sends
+
+
+def test_interactive_requests_go_before_bulk():
+    order = []
+
+    async def send(limiter, tag, priority):
+        await limiter.acquire(None, priority)
+        order.append(tag)
+
+    async def main():
+        limiter = TelegramRateLimiter(rate=50, burst=2, chat_interval=0)
+        tasks = [asyncio.create_task(send(limiter, f'bulk-{i}', BULK)) for i in range(5)]
+        await asyncio.sleep(0)
+        tasks += [asyncio.create_task(send(limiter, f'interactive-{i}', INTERACTIVE)) for i in range(2)]
+        await asyncio.gather(*tasks)
+
+    asyncio.run(main())
+    # Первые два запроса проходят сразу за счет запаса, дальше ответы пользователям идут раньше рассылки
+    assert order == ['bulk-0', 'bulk-1', 'interactive-0', 'interactive-1', 'bulk-2', 'bulk-3', 'bulk-4']
+
+
+def test_global_rate_is_respected():
+    async def main():
+        limiter = TelegramRateLimiter(rate=100, burst=1, chat_interval=0)
+        started = time.monotonic()
+        await asyncio.gather(*(limiter.acquire(None, INTERACTIVE) for _ in range(11)))
+        return time.monotonic() - started
+
+    assert asyncio.run(main()) >= 0.09
+
+
+def test_same_chat_is_paced():
+    async def main():
+        limiter = TelegramRateLimiter(rate=1000, burst=1000, chat_interval=0.05)
+        started = time.monotonic()
+        for _ in range(3):
+            await limiter.acquire(1, INTERACTIVE)
+        same_chat = time.monotonic() - started
+        started = time.monotonic()
+        for chat_id in range(2, 5):
+            await limiter.acquire(chat_id, INTERACTIVE)
+        return same_chat, time.monotonic() - started
+
+    same_chat, other_chats = asyncio.run(main())
+    assert same_chat >= 0.1
+    assert other_chats < 0.05
+
+
+def retry_after(method, seconds):
+    return TelegramRetryAfter(method=method, message='Flood control exceeded', retry_after=seconds)
+
+
+def run_middleware(middleware, make_request, method):
+    return asyncio.run(middleware(make_request, None, method))
+
+
+def test_retry_after_is_retried_after_the_pause():
+    calls = []
+
+    async def make_request(bot, method):
+        calls.append(time.monotonic())
+        if len(calls) == 1:
+            raise retry_after(method, 1)
+        return 'sent'
+
+    retries = metrics.counter('telegram.retry_after')
+    middleware = RateLimitMiddleware(TelegramRateLimiter(rate=30, burst=30, chat_interval=0), retries=2)
+
+    assert run_middleware(middleware, make_request, SendMessage(chat_id=1, text='x')) == 'sent'
+    assert len(calls) == 2
+    assert calls[1] - calls[0] >= 0.95
+    assert metrics.counter('telegram.retry_after') == retries + 1
+
+
+def test_retry_after_is_raised_when_retries_are_exhausted():
+    calls = []
+
+    async def make_request(bot, method):
+        calls.append(method)
+        raise retry_after(method, 0)
+
+    middleware = RateLimitMiddleware(TelegramRateLimiter(rate=30, burst=30, chat_interval=0), retries=2)
+
+    with pytest.raises(TelegramRetryAfter):
+        run_middleware(middleware, make_request, SendMessage(chat_id=1, text='x'))
+    assert len(calls) == 3
+
+
+def test_requests_without_chat_are_not_limited():
+    async def make_request(bot, method):
+        return 'me'
+
+    limiter = TelegramRateLimiter(rate=1, burst=1, chat_interval=10)
+    middleware = RateLimitMiddleware(limiter, retries=0)
+    started = time.monotonic()
+    for _ in range(3):
+        assert run_middleware(middleware, make_request, GetMe()) == 'me'
+    assert time.monotonic() - started < 0.5
+
+
+def test_send_latency_excludes_queue_wait():
+    async def make_request(bot, method):
+        return 'sent'
+
+    async def main():
+        middleware = RateLimitMiddleware(TelegramRateLimiter(rate=1000, burst=1000, chat_interval=0.2), retries=0)
+        await middleware(make_request, None, SendMessage(chat_id=1, text='x'))
+        with bulk_sends():
+            await middleware(make_request, None, SendMessage(chat_id=1, text='y'))
+
+    asyncio.run(main())
+    timings = metrics.snapshot()['timings']
+    assert timings['telegram.bulk.queue_wait']['last'] >= 0.15
+    assert timings['telegram.bulk.send_latency']['last'] < 0.05
@@ -0,0 +1,75 @@
+import asyncio
+import datetime
+
+import pytest
+
+from app.bot import handlers
+
+
+class FakeCredentials:
+    def __init__(self, expiry):
+        self.expiry = expiry
+        self.refresh_token = 'refresh'
+
+
+class FakeTokenStore:
+    def __init__(self, expiries):
+        self.expiries = expiries
+
+    def expiring_before(self, before):
+        return [user_id for user_id, expiry in sorted(self.expiries.items(), key=lambda item: item[1])
+                if expiry < before]
+
+
+@pytest.fixture
+def refresher(monkeypatch):
+    """
+    Runs refresh_expiring_tokens for tokens expiring in the given seconds and returns
+    when each refresh was scheduled to start, in seconds from the start of the run.
+    """
+    monkeypatch.setattr(handlers.settings, 'token_refresh_ahead', 600)
+    monkeypatch.setattr(handlers.settings, 'token_refresh_interval', 60)
+    monkeypatch.setattr(handlers, '_credentials_cache', {})
+
+    def run(expires_in, rate):
+        monkeypatch.setattr(handlers.settings, 'token_refresh_rate', rate)
+        now = datetime.datetime.utcnow()
+        expiries = {user_id: now + datetime.timedelta(seconds=seconds) for user_id, seconds in expires_in.items()}
+        monkeypatch.setattr(handlers, 'get_token_store', lambda: FakeTokenStore(expiries))
+        monkeypatch.setattr(handlers, 'load_credentials', lambda user_id: FakeCredentials(expiries[user_id]))
+        scheduled = {}
+
+        async def refresh_user_token(bot, user_id, start_at, semaphore):
+            scheduled[user_id] = start_at - started
+
+        async def main():
+            nonlocal started
+            started = asyncio.get_running_loop().time()
+            await handlers.refresh_expiring_tokens(None)
+
+        started = None
+        monkeypatch.setattr(handlers, '_refresh_user_token', refresh_user_token)
+        asyncio.run(main())
+        return scheduled
+
+    return run
+
+
+def test_refreshes_start_within_the_window(refresher):
+    window = 60 * handlers.TOKEN_REFRESH_WINDOW
+    # Токены, которые станут «к обновлению» ближе к концу интервала, обновляются раньше, внутри окна
+    scheduled = refresher({1: 600, 2: 620, 3: 655, 4: 3600}, rate=5)
+
+    assert set(scheduled) == {1, 2, 3}
+    assert scheduled[1] == pytest.approx(0, abs=0.1)
+    assert scheduled[2] == pytest.approx(20, abs=0.1)
+    assert scheduled[3] == pytest.approx(window, abs=0.1)
+
+
+def test_tokens_beyond_rate_are_deferred(refresher):
+    scheduled = refresher({user_id: 600 for user_id in range(10)}, rate=0.1)
+
+    # При 0.1 обновления в секунду в окно 30 секунд укладываются четыре обновления: 0, 10, 20, 30
+    assert len(scheduled) == 4
+    assert max(scheduled.values()) <= 60 * handlers.TOKEN_REFRESH_WINDOW + 0.1
+    assert handlers.metrics.snapshot()['gauges']['token_refresher.deferred'] == 6
@@ -0,0 +1,59 @@
+import datetime
+import json
+
+import pytest
+
+from app.bot.token_store import FileTokenStore, SQLiteTokenStore, TokenStore, migrate_directory
+
+
+def token(expiry):
+    return json.dumps({'token': 'access', 'refresh_token': 'refresh', 'expiry': expiry.isoformat() + 'Z'})
+
+
+@pytest.fixture(params=['file', 'sqlite'])
+def store(request, tmp_path):
+    if request.param == 'file':
+        return FileTokenStore(str(tmp_path / 'credentials'))
+    return SQLiteTokenStore(str(tmp_path / 'tokens.sqlite3'))
+
+
+def test_incomplete_backend_fails_on_instantiation():
+    class LoadOnlyStore(TokenStore):
+        def load(self, user_id):
+            return None
+
+    with pytest.raises(TypeError):
+        LoadOnlyStore()
+
+
+def test_save_load_delete(store):
+    expiry = datetime.datetime(2030, 1, 1, 12, 0)
+    store.save(1, token(expiry), expiry)
+
+    assert json.loads(store.load(1))['token'] == 'access'
+    assert store.user_ids() == [1]
+    assert store.delete(1) is True
+    assert store.load(1) is None
+    assert store.delete(1) is False
+
+
+def test_expiring_before(store):
+    soon = datetime.datetime(2030, 1, 1, 12, 0)
+    later = datetime.datetime(2030, 1, 1, 13, 0)
+    store.save(1, token(soon), soon)
+    store.save(2, token(later), later)
+
+    assert store.expiring_before(datetime.datetime(2030, 1, 1, 12, 30)) == [1]
+
+
+def test_migrate_directory(tmp_path):
+    directory = tmp_path / 'credentials'
+    expiry = datetime.datetime(2030, 1, 1, 12, 0)
+    FileTokenStore(str(directory)).save(5, token(expiry), expiry)
+    store = SQLiteTokenStore(str(tmp_path / 'tokens.sqlite3'))
+
+    assert migrate_directory(str(directory), store) == 1
+    assert store.expiring_before(expiry + datetime.timedelta(seconds=1)) == [5]
+    assert (directory / 'token_5.json.migrated').exists()
+    # Повторный запуск не переносит уже перенесенные файлы
+    assert migrate_directory(str(directory), store) == 0
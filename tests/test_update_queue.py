@@ -0,0 +1,117 @@
+import asyncio
+import random
+
+from aiogram.types import Update
+
+from app.bot.update_queue import UpdateQueue, chat_key
+
+
+def message_update(update_id, chat_id, text='привет'):
+    return Update.model_validate({
+        'update_id': update_id,
+        'message': {
+            'message_id': update_id,
+            'date': 1760000000,
+            'chat': {'id': chat_id, 'type': 'private'},
+            'from': {'id': chat_id, 'is_bot': False, 'first_name': 'Test'},
+            'text': text,
+        },
+    })
+
+
+def callback_update(update_id, user_id):
+    return Update.model_validate({
+        'update_id': update_id,
+        'callback_query': {
+            'id': str(update_id),
+            'chat_instance': '1',
+            'from': {'id': user_id, 'is_bot': False, 'first_name': 'Test'},
+            'data': 'confirm',
+        },
+    })
+
+
+def test_chat_key():
+    assert chat_key(message_update(1, 42)) == 42
+    # Callback без сообщения относится к пользователю
+    assert chat_key(callback_update(2, 7)) == 7
+
+
+def test_same_chat_updates_are_processed_in_order():
+    chats = [101, 102, 103]
+    processed = {chat: [] for chat in chats}
+    active = set()
+    overlaps = []
+
+    async def process(update):
+        chat_id = update.message.chat.id
+        if chat_id in active:
+            overlaps.append(update.update_id)
+        active.add(chat_id)
+        # Обработка разной длительности: без сериализации по чату более раннее обновление завершилось бы позже
+        await asyncio.sleep(random.uniform(0, 0.005))
+        processed[chat_id].append(update.update_id)
+        active.discard(chat_id)
+
+    async def main():
+        queue = UpdateQueue(maxsize=1000, workers=8)
+        queue.start(process)
+        for update_id in range(300):
+            assert queue.put(message_update(update_id, chats[update_id % len(chats)]))
+        await queue.drain(timeout=10)
+
+    asyncio.run(main())
+    assert overlaps == []
+    for chat in chats:
+        assert processed[chat] == sorted(processed[chat])
+        assert len(processed[chat]) == 100
+
+
+def test_slow_chat_does_not_block_other_chats():
+    processed = []
+
+    async def process(update):
+        chat_id = update.message.chat.id
+        if chat_id == 1:
+            await release.wait()
+        processed.append(update.update_id)
+        if len(processed) == 5:
+            others_done.set()
+
+    async def main():
+        nonlocal release, others_done
+        release, others_done = asyncio.Event(), asyncio.Event()
+        queue = UpdateQueue(maxsize=100, workers=2)
+        queue.start(process)
+        # Медленный чат с несколькими обновлениями в очереди и пять обновлений других чатов
+        for update_id in range(3):
+            queue.put(message_update(update_id, 1))
+        for update_id in range(3, 8):
+            queue.put(message_update(update_id, 2 + update_id % 2))
+        await asyncio.wait_for(others_done.wait(), timeout=1)
+        release.set()
+        await queue.drain(timeout=1)
+
+    release = others_done = None
+    asyncio.run(main())
+    assert processed[:5] == [3, 4, 5, 6, 7]
+    assert processed[5:] == [0, 1, 2]
+
+
+def test_put_fails_when_full():
+    release = None
+
+    async def process(update):
+        await release.wait()
+
+    async def main():
+        nonlocal release
+        release = asyncio.Event()
+        queue = UpdateQueue(maxsize=2, workers=2)
+        queue.start(process)
+        results = [queue.put(message_update(update_id, update_id)) for update_id in range(3)]
+        release.set()
+        await queue.drain(timeout=1)
+        return results
+
+    assert asyncio.run(main()) == [True, True, False]